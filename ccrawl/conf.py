@@ -1,9 +1,8 @@
 import os
-import clang.cindex
 
 from traitlets.config import Configurable
 from traitlets.config import PyFileConfigLoader
-from traitlets import Unicode, Bool, observe
+from traitlets import Unicode, Bool, Integer, List, observe
 
 __version__ = "1.9.0"
 
@@ -72,6 +71,8 @@ class Database(Configurable):
     localonly = Bool(False, config=True)  # use local even if a mongodb server is defined
     user = Unicode("", config=True)  # don't define a mongodb user
     verify = Bool(True, config=True)  # don't authenticate mongodb user
+    trigrams = Bool(True, config=True)  # use a trigram index for local regex searches
+    typecache = Integer(4096, config=True)  # keep up to 4096 fetched types in memory
 
 
 class Collect(Configurable):
@@ -80,14 +81,42 @@ class Collect(Configurable):
     cxx = Bool(True, config=True)  # try detecting c++ inputs
     skipcxx = Bool(True, config=True)  # ignore detected c++ files when cxx is False
     allc = Bool(False, config=True)  # parse everything including function bodies
+    preparse = Bool(False, config=True)  # don't store pre-parsed types in documents
+    layouts = Bool(False, config=True)  # don't compute struct layouts after collect
+    closures = Bool(False, config=True)  # don't compute dependency closures after collect
+    jobs = Integer(1, config=True)  # parse files sequentially in a single process
+    timeout = Integer(0, config=True)  # don't limit the parsing time of a file (seconds)
+    memlimit = Integer(0, config=True)  # don't limit the memory of parsing processes (MB)
+    incremental = Bool(False, config=True)  # always parse all files
+    batch = Integer(10000, config=True)  # save collected documents every 10000 documents
     tmp = Unicode()  # don't change temp directory
+    tucache = Unicode("", config=True)  # don't cache parsed translation units
+    prelude = List(Unicode(), config=True)  # don't precompile common headers
     lib = Unicode("", config=True)  # allow to choose clang_library_file
 
     @observe("lib")
     def _lib_changed(self, change):
+        import clang.cindex
+
         clang.cindex.Config.library_file = change["new"]
 
 
+def _runtime_socket():
+    # per-user path of the daemon socket:
+    d = os.getenv("XDG_RUNTIME_DIR")
+    if d and os.path.isdir(d):
+        return os.path.join(d, "ccrawl.sock")
+    uid = os.getuid() if hasattr(os, "getuid") else 0
+    return "/tmp/ccrawl-%d.sock" % uid
+
+
+class Daemon(Configurable):
+    "Configurable parameters related to the daemon mode"
+    socket = Unicode(_runtime_socket(), config=True)  # per-user unix socket of the daemon
+    forward = Bool(True, config=True)  # forward query commands to a running daemon
+    databases = Integer(8, config=True)  # keep up to 8 databases resident in the daemon
+
+
 class Formats(Configurable):
     "Configurable parameters related to formatters"
     default = Unicode("C", config=True)  # show results formatted as C code
@@ -119,10 +148,13 @@ class Config(object):
         self.Terminal = Terminal(config=c)
         self.Database = Database(config=c)
         self.Collect = Collect(config=c)
+        self.Daemon = Daemon(config=c)
         self.Formats = Formats(config=c)
         self.Ghidra = Ghidra(config=c)
         self.src = c
         if self.Collect.lib:
+            import clang.cindex
+
             clang.cindex.Config.library_file = self.Collect.lib
 
     def __str__(self):
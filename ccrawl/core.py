@@ -1,7 +1,8 @@
 from collections import OrderedDict
 from ccrawl import formatters
 from ccrawl.utils import struct_letters, c_type, cxx_type
-from ccrawl.db import where
+from ccrawl.utils import encode_decl, add_preparsed
+from ccrawl.db import Proxy, TinyDB, where, typecache
 
 
 class ccore(object):
@@ -23,8 +24,9 @@ class ccore(object):
     Attributes:
         formatter (function): a function used to print the object
                               in various formats.
-        _cache_ (dict): a global (parent class level) dict of all types
-                        that have been fetched from the database so far.
+        _cache_ (TypeCache): a global (parent class level) bounded cache of
+                             types that have been fetched from databases,
+                             keyed by database, tag and identifier.
     """
 
     _is_typedef = False
@@ -37,7 +39,7 @@ class ccore(object):
     _is_template = False
     _is_namespace = False
     formatter = None
-    _cache_ = {}
+    _cache_ = typecache
 
     def show(self, db=None, r=None, form=None):
         """
@@ -75,20 +77,92 @@ class ccore(object):
 
         return ctypes_.build(self, db)
 
+    def deps(self, limit=None):
+        """
+        Generic method that returns the list of (identifier, limit) of all
+        types on which this type directly depends, in unfolding order.
+        """
+        return []
+
+    def add_subtypes(self, db, limit=None):
+        """
+        Generic method that adds all types on which this type directly depends
+        to its subtypes (unfolding each of them.) All types of the dependency
+        tree are first fetched breadth-first (see prefetch.)
+        """
+        self.subtypes = OrderedDict()
+        self.prefetch(db, limit)
+        for elt, l in self.deps(limit):
+            self.add_subtype(db, elt, l)
+
+    def prefetch(self, db, limit=None):
+        """
+        Generic method that fetches from the database all types on which this
+        type depends, level by level with a single query per level of the
+        dependency tree, and puts them in the types cache so that unfolding
+        them does not query the database for every subtype. If the closure
+        of this type's dependencies is available in the database, all types
+        are fetched with a single query. Nothing is fetched when the cache
+        is disabled for this database, and the cache probes done here are not
+        counted in its hits/misses statistics.
+        """
+        if db is None or _covers(getattr(self, "_prefetched", False), limit):
+            return
+        C = ccore._cache_
+        if not C.enabled(db):
+            return
+        r = db.closure(self.identifier) if isinstance(db, Proxy) else None
+        if r is not None:
+            missing = [elt for elt in r["deps"] if C.peek(db, elt) is None]
+            if missing:
+                D = db.fetch(missing)
+                for elt in missing:
+                    data = D.get(elt)
+                    C.put(db, elt, ccore.from_db(data) if data else False)
+            self._prefetched = None
+            return
+        done = {}
+        level = [(self, limit)]
+        while level:
+            names = OrderedDict()
+            for x, l in level:
+                x._prefetched = l
+                for elt, sl in x.deps(l):
+                    if not _covers(done.get(elt, False), sl):
+                        done[elt] = sl
+                        names[elt] = sl
+            missing = [elt for elt in names if C.peek(db, elt) is None]
+            if missing:
+                D = _fetch(db, missing)
+                if D is None:
+                    return
+                for elt in missing:
+                    data = D.get(elt)
+                    C.put(db, elt, ccore.from_db(data) if data else False)
+            level = []
+            for elt, l in names.items():
+                x = C.peek(db, elt)
+                if x and x.subtypes is None and not _covers(getattr(x, "_prefetched", False), l):
+                    level.append((x, l))
+
     def add_subtype(self, db, elt, limit=None):
         """
         Generic method that fetches item 'elt' from the database and
         adds it to the subtypes of this type before unfolding it.
         """
-        x = ccore._cache_.get(elt, None)
+        x = ccore._cache_.get(db, elt)
         if x is None:
-            data = db.get(where("id") == elt)
-            if data:
-                x = ccore.from_db(data)
-                ccore._cache_[elt] = x
-            else:
-                self.subtypes[elt] = None
-                return
+            data = None
+            tag = getattr(db, "tag", None)
+            if tag is not None and tag._hash:
+                data = db.get(tag & (where("id") == elt))
+            if not data:
+                data = db.get(where("id") == elt)
+            x = ccore.from_db(data) if data else False
+            ccore._cache_.put(db, elt, x)
+        if x is False:
+            self.subtypes[elt] = None
+            return
         self.subtypes[elt] = x.unfold(db, limit)
 
     def graph(self,db,V=None,g=None):
@@ -161,6 +235,32 @@ class ccore(object):
                     data.extend(x.to_db(i, tag, identifier))
         return data
 
+    def decls(self):
+        """
+        Generic method that returns the list of C type strings used by this
+        item (empty by default.)
+        """
+        return []
+
+    def typeinfo(self):
+        """
+        Returns the dict of pre-parsed C type strings used by this item
+        (see utils.encode_decl) which is stored in the "types" field of
+        documents when collecting with the preparse option.
+        """
+        D = {}
+        try:
+            L = self.decls()
+        except Exception:
+            return D
+        for t in L:
+            if t not in D:
+                try:
+                    D[t] = encode_decl(c_type(t))
+                except Exception:
+                    pass
+        return D
+
     @staticmethod
     def from_db(data):
         """
@@ -172,12 +272,40 @@ class ccore(object):
                          one of the below ccore specialized class name.
         """
         identifier = data["id"]
+        if "types" in data:
+            add_preparsed(data["types"])
         val = ccore.getcls(data["cls"])(data["val"])
         val.identifier = identifier
         val.subtypes = None
         return val
 
 
+def _covers(l0, l):
+    """
+    Returns True if types have been prefetched with limit l0 (or not at all
+    if l0 is False) deep enough for limit l.
+    """
+    if l0 is False:
+        return False
+    return l0 is None or (l is not None and l <= l0)
+
+
+def _fetch(db, ids):
+    """
+    Returns a dict mapping identifiers to their first document in db (a
+    Proxy, or a TinyDB database) fetched with a single query, or None if db
+    does not support such queries.
+    """
+    if isinstance(db, Proxy):
+        return db.fetch(ids)
+    if not isinstance(db, TinyDB):
+        return None
+    R = {}
+    for d in db.search(where("id").one_of(list(ids))):
+        R.setdefault(d["id"], d)
+    return R
+
+
 # ------------------------------------------------------------------------------
 
 
@@ -195,18 +323,24 @@ class cTypedef(str, ccore):
         Unfolding a typedef simply adds its underlying type definition to subtypes.
         """
         if self.subtypes is None:
-            self.subtypes = OrderedDict()
-            ctype = c_type(self)
-            if limit != None:
-                if limit <= 0 and ctype.is_ptr:
-                    return self
-            elt = ctype.lbase
-            if elt not in struct_letters:
-                if limit:
-                    limit -= 1
-                self.add_subtype(db, elt, limit)
+            self.add_subtypes(db, limit)
         return self
 
+    def deps(self, limit=None):
+        ctype = c_type(self)
+        if limit != None:
+            if limit <= 0 and ctype.is_ptr:
+                return []
+        elt = ctype.lbase
+        if elt not in struct_letters:
+            if limit:
+                limit -= 1
+            return [(elt, limit)]
+        return []
+
+    def decls(self):
+        return [str(self)]
+
     def __eq__(self, other):
         return str(self) == str(other)
 
@@ -235,22 +369,26 @@ class cStruct(list, ccore):
         Unfolding a struct adds all its fields' types to subtypes.
         """
         if self.subtypes is None:
-            self.subtypes = OrderedDict()
-            T = list(struct_letters.keys())
-            T.append(self.identifier)
-            for (t, n, c) in self:
-                ctype = c_type(t)
-                if limit != None:
-                    if limit <= 0 and ctype.is_ptr:
-                        continue
-                elt = ctype.lbase
-                if elt not in T:
-                    T.append(elt)
-                    if limit:
-                        limit -= 1
-                    self.add_subtype(db, elt, limit)
+            self.add_subtypes(db, limit)
         return self
 
+    def deps(self, limit=None):
+        D = []
+        T = list(struct_letters.keys())
+        T.append(self.identifier)
+        for (t, n, c) in self:
+            ctype = c_type(t)
+            if limit != None:
+                if limit <= 0 and ctype.is_ptr:
+                    continue
+            elt = ctype.lbase
+            if elt not in T:
+                T.append(elt)
+                if limit:
+                    limit -= 1
+                D.append((elt, limit))
+        return D
+
     def index_of(self,n):
         i=0
         for f in self:
@@ -259,6 +397,9 @@ class cStruct(list, ccore):
             i += 1
         return None
 
+    def decls(self):
+        return [t for (t, n, c) in self]
+
     def __eq__(self, other):
         return list(self) == list(other)
 
@@ -287,28 +428,32 @@ class cClass(list, ccore):
 
     def unfold(self, db, limit=None):
         if self.subtypes is None:
-            self.subtypes = OrderedDict()
-            T = list(struct_letters.keys())
-            T.append(self.identifier)
-            for (x, y, _) in self:
-                qal, t = x
-                mn, n = y
-                if qal == "parent":
-                    elt = [n]
-                elif qal == "using":
-                    elt = t
-                else:
-                    if mn or ("virtual" in qal):
-                        continue
-                    elt = cxx_type(t)
-                    elt = elt.show_base(kw=True, ns=True)
-                    elt = [elt]
-                for e in elt:
-                    if e not in T:
-                        T.append(e)
-                        self.add_subtype(db, e, limit)
+            self.add_subtypes(db, limit)
         return self
 
+    def deps(self, limit=None):
+        D = []
+        T = list(struct_letters.keys())
+        T.append(self.identifier)
+        for (x, y, _) in self:
+            qal, t = x
+            mn, n = y
+            if qal == "parent":
+                elt = [n]
+            elif qal == "using":
+                elt = t
+            else:
+                if mn or ("virtual" in qal):
+                    continue
+                elt = cxx_type(t)
+                elt = elt.show_base(kw=True, ns=True)
+                elt = [elt]
+            for e in elt:
+                if e not in T:
+                    T.append(e)
+                    D.append((e, limit))
+        return D
+
     def build(self, db):
         from ccrawl.ext import ctypes_
 
@@ -342,13 +487,13 @@ class cClass(list, ccore):
                 n = cxx_type(n)
                 nn = n.show_base()
                 name = n.show_base(True, True)
-                x = ccore._cache_.get(name, None)
-                try:
-                    if x._is_typedef:
-                        x = ccore._cache_.get(x, None)
-                except Exception:
-                    pass
-                if x is None:
+                # (parents are taken from subtypes rather than from the
+                # types cache, which may have evicted them.)
+                S = self.subtypes or {}
+                x = S.get(name, S.get(y[1]))
+                if isinstance(x, ccore) and x._is_typedef:
+                    x = next(iter((x.subtypes or {}).values()), None)
+                if not isinstance(x, ccore):
                     raise TypeError("unkown type '%s'" % n)
                 assert x._is_class
                 # get layout of the parent class:
@@ -450,22 +595,11 @@ class cUnion(list, ccore):
 
     def unfold(self, db, limit=None):
         if self.subtypes is None:
-            self.subtypes = OrderedDict()
-            T = list(struct_letters.keys())
-            T.append(self.identifier)
-            for (t, n, c) in self:
-                ctype = c_type(t)
-                if limit != None:
-                    if limit <= 0 and ctype.is_ptr:
-                        continue
-                elt = ctype.lbase
-                if elt not in T:
-                    T.append(elt)
-                    if limit:
-                        limit -= 1
-                    self.add_subtype(db, elt, limit)
+            self.add_subtypes(db, limit)
         return self
 
+    deps = cStruct.deps
+
     def index_of(self,n):
         i=0
         for f in self:
@@ -474,6 +608,9 @@ class cUnion(list, ccore):
             i += 1
         return None
 
+    def decls(self):
+        return [t for (t, n, c) in self]
+
     def __eq__(self, other):
         return list(self) == list(other)
 
@@ -497,6 +634,27 @@ class cMacro(str, ccore):
     """
     _is_macro = True
 
+    def value(self):
+        """
+        Returns the integer value of this macro, or None if it is not a
+        numeric literal.
+        """
+        try:
+            return int(self, 0)
+        except ValueError:
+            return None
+
+    def to_db(self, identifier, tag, src):
+        """
+        Adds to the macro document its integer "value" (if the macro is a
+        numeric literal that fits in 64 bits.)
+        """
+        data = ccore.to_db(self, identifier, tag, src)
+        v = self.value()
+        if v is not None and -(1 << 63) <= v < (1 << 63):
+            data[0]["value"] = v
+        return data
+
 
 # ------------------------------------------------------------------------------
 
@@ -519,20 +677,49 @@ class cFunc(dict, ccore):
             return t.pstack[-1].args
         return []
 
+    def decls(self):
+        return [self["prototype"], self.restype()] + self.argtypes()
+
+    def signature(self):
+        """
+        Returns the normalized signature of this function, ie. the list of
+        its return type followed by the types of its arguments, all being
+        normalized by c_type.
+        """
+        P = [c_type(t).show() for t in self.argtypes()]
+        P.insert(0, c_type(self.restype()).show())
+        return P
+
+    def to_db(self, identifier, tag, src):
+        """
+        Adds to the function document its normalized signature "sig"
+        (if its prototype can be parsed.)
+        """
+        data = ccore.to_db(self, identifier, tag, src)
+        try:
+            data[0]["sig"] = self.signature()
+        except Exception:
+            pass
+        return data
+
     def unfold(self, db, limit=None):
         if self.subtypes is None:
-            self.subtypes = OrderedDict()
-            T = list(struct_letters.keys())
-            rett = self.restype()
-            args = self.argtypes()
-            args.insert(0, rett)
-            for t in args:
-                elt = c_type(t).lbase
-                if elt not in T:
-                    T.append(elt)
-                    self.add_subtype(db, elt)
+            self.add_subtypes(db, limit)
         return self
 
+    def deps(self, limit=None):
+        D = []
+        T = list(struct_letters.keys())
+        rett = self.restype()
+        args = self.argtypes()
+        args.insert(0, rett)
+        for t in args:
+            elt = c_type(t).lbase
+            if elt not in T:
+                T.append(elt)
+                D.append((elt, None))
+        return D
+
     def __eq__(self, other):
         return str(self) == str(other)
 
@@ -568,12 +755,11 @@ class cNamespace(list, ccore):
 
     def unfold(self, db, limit=None):
         if self.subtypes is None:
-            self.subtypes = OrderedDict()
-            T = list(struct_letters.keys())
-            T.append(self.identifier)
-            for elt in self:
-                self.add_subtype(db, elt)
+            self.add_subtypes(db, limit)
         return self
 
+    def deps(self, limit=None):
+        return [(elt, None) for elt in self]
+
     def __eq__(self, other):
         return list(self) == list(other)
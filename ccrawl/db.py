@@ -1,13 +1,25 @@
-import requests
+import os
+import re
+import hashlib
+import json
+import sqlite3
+from collections import defaultdict, OrderedDict
+from itertools import count
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
 import click
 from tinydb.storages import JSONStorage, MemoryStorage
 from tinydb.middlewares import CachingMiddleware
+from tinydb.table import Document
 from tinydb import TinyDB, Query, where
 
 """
 This module implements all classes that allow to interact with the various databases
 that are supported by ccrawl. The idea was to allow ccrawl to work either in 'local'
-mode with a TinyDB database stored as a json file, or in 'remote' mode with a MongoDB
+mode with a TinyDB database stored as a json file (or a SQLite database file if the
+local path is given as "sqlite:<path>"), or in 'remote' mode with a MongoDB
 database suited for querying very large sets of documents. 
 """
 
@@ -22,18 +34,57 @@ class Proxy(object):
     to a native MongoDB query when interacting with the remote database. This has
     limitations since MongoDB queries are more expressive but we can always use
     directly the Proxy.rdb instance to avoid this limitation.
+
+    Queries on a local TinyDB database that require equality of the "id", "src",
+    "cls" or "tag" fields are routed through in-memory hash indexes of these
+    fields, built on first use and maintained by the Proxy insert methods.
+
+    Regular expression searches on the id and val fields of the local database
+    use a trigram index of documents (stored alongside the local database file)
+    to preselect candidate documents.
+
+    The layouts (size, alignment and fields offsets) of structured types can be
+    precomputed in the "layouts" table of the local database, as the remote
+    MongoDB structs_ptr32/64 collections do. A layout is removed as soon as
+    documents of the struct or of any type it depends on are inserted or
+    removed through the Proxy.
+
+    Similarly, the transitive closure of the dependencies of every type (all
+    the types it depends on, in topological order) can be stored in the
+    "closures" table of the local database. Unfolding a type with a closure
+    fetches all its dependencies with a single query, and the recursive show
+    command preloads them so that the formatters do not query the database.
     """
 
+    indexed = ("id", "src", "cls", "tag")
+
     def __init__(self, config):
         self.c = config
         self.ldb = None
         self.rdb = None
+        self.path = None
+        self.index = None
+        self.lindex = {}
+        self.qindex = {}
+        self.cindex = None
+        self.preloaded = {}
+        self.generation = 0
+        self.flushed = 0
         self.tag = Query().noop()
+        typecache.resize(self, config.typecache)
         self.req = None
         if config.local:
             try:
-                self.ldb = TinyDB(config.local, storage=CachingMiddleware(JSONStorage))
+                if config.local.startswith("sqlite:"):
+                    self.path = config.local[7:]
+                    if self.path.startswith("//"):
+                        self.path = self.path[2:]
+                    self.ldb = SQLiteDB(self.path)
+                else:
+                    self.path = config.local
+                    self.ldb = TinyDB(config.local, storage=CachingMiddleware(JSONStorage))
             except Exception:
+                self.path = None
                 self.ldb = TinyDB(storage=MemoryStorage)
         else:
             self.ldb = TinyDB(storage=MemoryStorage)
@@ -59,9 +110,76 @@ class Proxy(object):
 
     def insert_multiple(self, docs):
         """
-        Inserts multiple documents in the *local* database only.
+        Inserts multiple documents in the *local* database only,
+        and returns the list of their doc_ids.
+        """
+        docs = list(docs)
+        ids = self.ldb.insert_multiple(docs)
+        self.generation += 1
+        if self.index is not None:
+            for i, d in zip(ids, docs):
+                self._index_doc(self.index, i, d)
+            self.index["count"] = len(self.ldb)
+        self.qindex = {}
+        self.preloaded = {}
+        self.invalidate_layouts([d.get("id") for d in docs])
+        self.invalidate_closures([d.get("id") for d in docs])
+        typecache.invalidate(self, [d.get("id") for d in docs])
+        return ids
+
+    def _index_doc(self, I, i, d):
+        for k in self.indexed:
+            v = d.get(k)
+            if _scalar(v):
+                I[k][v].append(i)
+        v = (d.get("id"), d.get("src"))
+        if _scalar(v[0]) and _scalar(v[1]):
+            I["id,src"][v].append(i)
+
+    def local_index(self):
+        """
+        Returns the in-memory indexes of the *local* TinyDB database, which
+        are (re)built if its number of documents has changed since they were
+        last updated.
+        """
+        n = len(self.ldb)
+        if self.index is None or self.index["count"] != n:
+            I = dict(((k, defaultdict(list)) for k in self.indexed + ("id,src",)))
+            for d in self.ldb:
+                self._index_doc(I, d.doc_id, d)
+            I["count"] = n
+            self.index = I
+        return self.index
+
+    def _local_search(self, q, first=False):
+        """
+        Returns the list of documents matching query q from the *local*
+        database, using in-memory indexes whenever possible.
         """
-        self.ldb.insert_multiple(docs)
+        R = self._preloaded(q, first)
+        if R is not None:
+            return R
+        T = {}
+        if isinstance(self.ldb, TinyDB):
+            T = dict(((k, v) for (k, v) in _eq_terms(q._hash).items() if k in self.indexed))
+        if not T:
+            if first:
+                d = self.ldb.get(q)
+                return [d] if d is not None else []
+            return self.ldb.search(q)
+        I = self.local_index()
+        if "id" in T and "src" in T:
+            L = I["id,src"].get((T["id"], T["src"]), [])
+        else:
+            L = min((I[k].get(v, []) for (k, v) in T.items() if k in I), key=len)
+        R = []
+        if L:
+            for d in self.ldb.get(doc_ids=sorted(L)):
+                if q(d):
+                    R.append(d)
+                    if first:
+                        break
+        return R
 
     def contains(self, q=None, **kargs):
         """
@@ -74,8 +192,11 @@ class Proxy(object):
         for k in kargs:
             q &= where(k) == kargs[k]
         if self.rdb and not self.c.localonly:
+            R = self._preloaded(q, True)
+            if R is not None:
+                return len(R) > 0
             return self.rdb.contains(q._hash, **kargs)
-        return self.ldb.contains(q)
+        return len(self._local_search(q, first=True)) > 0
 
     def search(self, q=None, **kargs):
         """
@@ -90,8 +211,11 @@ class Proxy(object):
         for k in kargs:
             q &= where(k) == kargs[k]
         if self.rdb and not self.c.localonly:
+            R = self._preloaded(q)
+            if R is not None:
+                return R
             return list(self.rdb.search(q._hash, **kargs))
-        return self.ldb.search(q)
+        return self._local_search(q)
 
     def get(self, q=None, **kargs):
         """
@@ -104,8 +228,79 @@ class Proxy(object):
         for k in kargs:
             q &= where(k) == kargs[k]
         if self.rdb and not self.c.localonly:
+            R = self._preloaded(q, True)
+            if R is not None:
+                return R[0] if R else None
             return self.rdb.get(q._hash, **kargs)
-        return self.ldb.get(q)
+        for d in self._local_search(q, first=True):
+            return d
+        return None
+
+    def fetch(self, ids):
+        """
+        Returns a dict that maps identifiers of ids to their document, fetched
+        with a single query of the remote (or local) database. As for get, the
+        document is the first one with this identifier, but documents with
+        the current tag are preferred. Identifiers not found are not in the
+        dict.
+        """
+        R, T = {}, {}
+        for d in self._fetch_all(ids):
+            k = d["id"]
+            R.setdefault(k, d)
+            if self.tag._hash and (k not in T) and self.tag(d):
+                T[k] = d
+        R.update(T)
+        return R
+
+    def _fetch_all(self, ids):
+        ids = list(ids)
+        if not ids:
+            return []
+        P = self.preloaded
+        if all((x in P for x in ids)):
+            return [d for x in ids for d in P[x]]
+        q = where("id").one_of(ids)
+        if self.rdb and not self.c.localonly:
+            return list(self.rdb.search(q._hash))
+        if isinstance(self.ldb, TinyDB):
+            I = self.local_index()["id"]
+            L = sorted(set((i for x in ids for i in I.get(x, []))))
+            return [self.ldb.get(doc_id=i) for i in L]
+        return self.ldb.search(q)
+
+    def search_ids(self, ids, q=None):
+        """
+        Returns the list of documents with identifier in ids that match the
+        query q (filtered by self.tag), fetched with a single query.
+        """
+        q = self.tag if q is None else (self.tag & q)
+        return [d for d in self._fetch_all(ids) if q(d)]
+
+    def preload(self, ids):
+        """
+        Fetches all documents with identifier in ids with a single query and
+        keeps them in memory to answer the following queries that require one
+        of these identifiers (until documents are inserted or removed.)
+        """
+        ids = [x for x in set(ids) if _scalar(x) and x not in self.preloaded]
+        P = dict(((x, []) for x in ids))
+        for d in self._fetch_all(ids):
+            P[d["id"]].append(d)
+        self.preloaded.update(P)
+
+    def _preloaded(self, q, first=False):
+        """
+        Returns the list of preloaded documents matching query q if q
+        requires a preloaded identifier, or None otherwise.
+        """
+        if not self.preloaded:
+            return None
+        i = _eq_terms(q._hash).get("id")
+        if i not in self.preloaded:
+            return None
+        R = [d for d in self.preloaded[i] if q(d)]
+        return R[:1] if first else R
 
     def cleanup_local(self):
         """
@@ -120,9 +315,371 @@ class Proxy(object):
                 D[k] = [e.doc_id]
             else:
                 D[k].append(e.doc_id)
-        for v in D.values():
-            if len(v) > 1:
-                self.ldb.remove(doc_ids=v[1:])
+        L = [i for v in D.values() for i in v[1:]]
+        if L:
+            self.remove_docs(doc_ids=L)
+
+    def fingerprints(self):
+        """
+        Returns the dict of fingerprint records of collected files, indexed
+        by source file, from the *local* database only.
+        (Records are stored in the "fingerprints" table with keys "src",
+        "hash", "tag" and "docs", the later being the list of (id,src) keys of
+        documents that were collected from this file.)
+        """
+        T = self.ldb.table("fingerprints")
+        return dict(((r["src"], r) for r in T.search(self.tag)))
+
+    def update_fingerprints(self, records, removed=None):
+        """
+        Replaces the fingerprint records of the *local* database for all
+        files in records, and removes those of files in removed.
+        """
+        T = self.ldb.table("fingerprints")
+        F = [r["src"] for r in records]
+        if removed:
+            F.extend(removed)
+        T.remove(self.tag & where("src").one_of(F))
+        T.insert_multiple(records)
+
+    def update_docs(self, docs):
+        """
+        Writes back the given (modified) documents to the *local* database only.
+        """
+        docs = list(docs)
+        for d in docs:
+            self.ldb.update(dict(d), doc_ids=[d.doc_id])
+        if docs:
+            self.generation += 1
+            self.index = None
+            self.qindex = {}
+            self.preloaded = {}
+            self.invalidate_closures([d.get("id") for d in docs])
+            typecache.invalidate(self, [d.get("id") for d in docs])
+
+    def remove_docs(self, keys=None, doc_ids=None):
+        """
+        Removes all documents with (id, src, tag) in keys or with given
+        doc_ids from the *local* database only.
+        """
+        L = list(doc_ids or [])
+        ids = set()
+        if keys:
+            for d in self.ldb:
+                if (d["id"], d["src"], d.get("tag")) in keys:
+                    L.append(d.doc_id)
+                    ids.add(d["id"])
+        if L:
+            if doc_ids and (self.has_layouts() or self.has_closures()):
+                ids.update((d["id"] for d in self.ldb.get(doc_ids=list(doc_ids))))
+            self.ldb.remove(doc_ids=L)
+            self.generation += 1
+            self.index = None
+            self.qindex = {}
+            self.preloaded = {}
+            self.invalidate_layouts(ids)
+            self.invalidate_closures(ids)
+            typecache.invalidate(self, None if doc_ids else ids)
+
+    def has_layouts(self):
+        """
+        Returns True if the *local* database has a layouts table.
+        """
+        return "layouts" in self.ldb.tables()
+
+    def layouts(self):
+        """
+        Returns the dict of layout records of the *local* database, indexed
+        by (id, src, tag) keys of their struct documents.
+        (Records are stored in the "layouts" table with keys "id", "src",
+        "tag", "deps" (the identifiers of all types the struct depends on)
+        and either "error" if the struct can't be built, or "types" (the
+        type names of all fields), "ptr32" and "ptr64" with the layout for
+        pointer size of 4 and 8 bytes.)
+        """
+        if not self.has_layouts():
+            return {}
+        T = self.ldb.table("layouts")
+        return dict((((r["id"], r["src"], r.get("tag")), r) for r in T.search(self.tag)))
+
+    def layout(self, identifier, psize, **kargs):
+        """
+        Returns the layout of the struct with given identifier for pointer size
+        psize (4 or 8) from the *local* layouts table, or None if not available.
+        The layout is a dict with keys "size", "align", "offsets" (the list of
+        [offset, size] of each field) and "pointers" (the indices of fields
+        that are pointers.)
+        """
+        if psize not in (4, 8) or not self.has_layouts():
+            return None
+        q = self.tag & (where("id") == identifier)
+        for k in kargs:
+            q &= where(k) == kargs[k]
+        r = self.ldb.table("layouts").get(q)
+        if r is None:
+            return None
+        return r.get("ptr%d" % (psize * 8))
+
+    def update_layouts(self, q=None, force=False):
+        """
+        Computes the layouts of all structs, unions and classes of the *local*
+        database that match query q and have no layout record yet (or all of
+        them if force is True), and stores them in the layouts table.
+        Returns the list of new records.
+        (Building structs requires the amoco package, NotImplementedError is
+        raised otherwise.)
+        """
+        from ccrawl.core import ccore
+        from ccrawl.ext import amoco
+
+        old = self.layouts()
+        if q is None:
+            q = Query().noop()
+        q = self.tag & q & where("cls").one_of(["cStruct", "cUnion", "cClass"])
+        R = []
+        for s in self.ldb.search(q):
+            k = (s["id"], s["src"], s.get("tag"))
+            if (k in old) and not force:
+                continue
+            r = {"id": s["id"], "src": s["src"], "tag": s.get("tag")}
+            x = ccore.from_db(s)
+            try:
+                if x._is_class:
+                    x = x.as_cStruct(self)
+                x.unfold(self)
+                t = amoco.build(x, self)()
+                r["types"] = [f[0] for f in x]
+                for psize in (4, 8):
+                    r["ptr%d" % (psize * 8)] = {
+                        "size": t.size(psize=psize),
+                        "align": t.align(psize=psize),
+                        "offsets": [list(f) for f in t.offsets(psize=psize)],
+                        "pointers": [
+                            i for (i, f) in enumerate(t.fields) if f.typename == "P"
+                        ],
+                    }
+            except NotImplementedError:
+                raise
+            except Exception as e:
+                for p in ("types", "ptr32", "ptr64"):
+                    r.pop(p, None)
+                r["error"] = str(e)
+            r["deps"] = sorted(_deps(x))
+            R.append(r)
+        T = self.ldb.table("layouts")
+        if R:
+            keys = set(((r["id"], r["src"], r["tag"]) for r in R))
+            T.remove(doc_ids=[r.doc_id for (k, r) in old.items() if k in keys])
+        if R:
+            T.insert_multiple(R)
+            self.lindex = {}
+        return R
+
+    def _query_index(self, index, cls):
+        """
+        Returns the given index class instance for all documents of given
+        classes (filtered by self.tag) from the remote database if present,
+        otherwise local. The index of the local database is built on first
+        use, and is stamped with the tag and the generation of the Proxy so
+        that it is rebuilt after any change made through the Proxy.
+        """
+        q = where("cls").one_of(cls)
+        if self.rdb and not self.c.localonly:
+            return index(self.search(q))
+        k = (self.tag._hash, len(self.ldb), self.generation)
+        I = self.qindex.get(index.__name__)
+        if I is None or I[0] != k:
+            I = self.qindex[index.__name__] = (k, index(self.search(q)))
+        return I[1]
+
+    def constant_index(self):
+        """
+        Returns the ConstantIndex of all cMacro and cEnum documents.
+        """
+        return self._query_index(ConstantIndex, ["cMacro", "cEnum"])
+
+    def prototype_index(self):
+        """
+        Returns the PrototypeIndex of all cFunc documents.
+        """
+        return self._query_index(PrototypeIndex, ["cFunc"])
+
+    def uses_index(self):
+        """
+        Returns the UsesIndex of all documents of types and functions.
+        """
+        return self._query_index(
+            UsesIndex, ["cTypedef", "cStruct", "cUnion", "cClass", "cFunc", "cNamespace"]
+        )
+
+    def trigram_index(self):
+        """
+        Returns the TrigramIndex of all documents of the *local* database.
+        The index is loaded from the "<local>.trigrams" file and is rebuilt
+        (and saved) if this file is missing or if the local database file or
+        its number of documents have changed since it was built. The index
+        is not loaded or saved while the database has changes that are not
+        flushed to its file.
+        """
+        dirty = self.generation - self.flushed
+        k = [len(self.ldb), dirty]
+        if self.path and os.path.exists(self.path):
+            st = os.stat(self.path)
+            k = [st.st_size, st.st_mtime_ns] + k
+        I = self.qindex.get("TrigramIndex")
+        if I is None or I[0] != k:
+            T = None
+            if self.path and not dirty:
+                T = TrigramIndex.load(self.path + ".trigrams")
+            if T is None or T.stamp != k:
+                T = TrigramIndex(self.ldb, k)
+                if self.path and not dirty:
+                    T.save(self.path + ".trigrams")
+            I = self.qindex["TrigramIndex"] = (k, T)
+        return I[1]
+
+    def regex_search(self, q, rex, flags=0):
+        """
+        Returns the list of documents matching query q from the *local* database,
+        where q only matches documents with regular expression rex found in their
+        id or val field. If rex requires some literal strings, candidates are
+        preselected with the trigram index (unless Database.trigrams is False.)
+        """
+        C = None
+        if self.c.trigrams:
+            C = self.trigram_index().candidates(rex, flags)
+        if C is None:
+            return self.ldb.search(q)
+        return [d for d in self.ldb.get(doc_ids=C) if q(d)] if C else []
+
+    def get_indexed(self, e):
+        """
+        Returns the document of the given entry of a ConstantIndex or
+        PrototypeIndex.
+        """
+        if e.get("doc_id") is not None and not (self.rdb and not self.c.localonly):
+            return self.ldb.get(doc_id=e["doc_id"])
+        q = (where("id") == e["id"]) & (where("src") == e["src"])
+        if e.get("tag") is not None:
+            q &= where("tag") == e["tag"]
+        return self.get(q)
+
+    def layout_index(self, psize, records=None):
+        """
+        Returns the LayoutIndex of all layouts of the *local* database
+        for pointer size psize (4 or 8), built on first use (from the given
+        layouts records if already loaded.)
+        """
+        if psize not in self.lindex:
+            if records is None:
+                records = self.layouts()
+            self.lindex[psize] = LayoutIndex(records, psize)
+        return self.lindex[psize]
+
+    def invalidate_layouts(self, ids):
+        """
+        Removes the layout records of all structs with identifier in ids
+        or that depend on any type with identifier in ids.
+        """
+        ids = [i for i in set(ids) if _scalar(i)]
+        if ids and self.has_layouts():
+            T = self.ldb.table("layouts")
+            if T.remove(where("id").one_of(ids) | where("deps").any(ids)):
+                self.lindex = {}
+
+    def has_closures(self):
+        """
+        Returns True if the *local* database has a closures table.
+        """
+        return "closures" in self.ldb.tables()
+
+    def closures(self):
+        """
+        Returns the dict of closure records of the *local* database, indexed
+        by (id, src, tag) keys of their documents.
+        (Records are stored in the "closures" table with keys "id", "src",
+        "tag", "deps" (the identifiers of all types the document depends on,
+        each type following the types it depends on) and "missing" (the
+        identifiers of deps that are not found in the database), or "error"
+        if the document can't be unfolded.)
+        """
+        if not self.has_closures():
+            return {}
+        T = self.ldb.table("closures")
+        return dict((((r["id"], r["src"], r.get("tag")), r) for r in T.search(self.tag)))
+
+    def closure(self, identifier):
+        """
+        Returns the closure record of the type with given identifier from the
+        *local* closures table, or None if not available.
+        """
+        if self.cindex is None:
+            I = defaultdict(list)
+            if self.has_closures():
+                for r in self.ldb.table("closures"):
+                    if "deps" in r:
+                        I[r["id"]].append(r)
+            self.cindex = I
+        for r in self.cindex.get(identifier, []):
+            if self.tag(r):
+                return r
+        return None
+
+    def update_closures(self, q=None, force=False):
+        """
+        Computes the transitive closure of the dependencies of all documents
+        of the *local* database that match query q and have no closure record
+        yet (or all of them if force is True), and stores them in the closures
+        table. Returns the list of new records.
+        """
+        from ccrawl.core import ccore
+
+        old = self.closures()
+        if q is None:
+            q = Query().noop()
+        q = self.tag & q & where("cls").one_of(
+            ["cTypedef", "cStruct", "cUnion", "cClass", "cFunc", "cNamespace"]
+        )
+        R = []
+        for s in self.ldb.search(q):
+            k = (s["id"], s["src"], s.get("tag"))
+            if (k in old) and not force:
+                continue
+            r = {"id": s["id"], "src": s["src"], "tag": s.get("tag")}
+            try:
+                r["deps"], r["missing"] = _closure(ccore.from_db(s).unfold(self))
+            except Exception as e:
+                r["error"] = str(e)
+            R.append(r)
+        T = self.ldb.table("closures")
+        if R:
+            keys = set(((r["id"], r["src"], r["tag"]) for r in R))
+            T.remove(doc_ids=[r.doc_id for (k, r) in old.items() if k in keys])
+            T.insert_multiple(R)
+            self.cindex = None
+        return R
+
+    def invalidate_closures(self, ids):
+        """
+        Removes the closure records of all types with identifier in ids
+        or that depend on any type with identifier in ids.
+        """
+        ids = [i for i in set(ids) if _scalar(i)]
+        if ids and self.has_closures():
+            T = self.ldb.table("closures")
+            if T.remove(where("id").one_of(ids) | where("deps").any(ids)):
+                self.cindex = None
+
+
+    def flush(self):
+        """
+        Writes all pending changes of the *local* database to its storage.
+        """
+        if isinstance(self.ldb, SQLiteDB):
+            self.ldb.flush()
+        elif isinstance(self.ldb.storage, CachingMiddleware):
+            self.ldb.storage.flush()
+        self.flushed = self.generation
 
     def cleanup(self):
         """
@@ -144,14 +701,1018 @@ class Proxy(object):
         """
         Close the *local* database only.
         """
+        typecache.release(self)
         self.ldb.close()
 
 
+class LayoutIndex(object):
+    """
+    Inverted index of struct layouts for a given pointer size, that maps
+    total sizes, field offsets, (offset, field size), (offset, field type)
+    and pointer fields' offsets to the set of structs that have them.
+
+    Structs are identified by the (id, src, tag) keys of the records given
+    to the constructor (records with an "error" are not indexed.)
+    """
+
+    def __init__(self, records, psize):
+        self.psize = psize
+        self.keys = set()
+        self.size = defaultdict(set)
+        self.off = defaultdict(set)
+        self.offsize = defaultdict(set)
+        self.offtype = defaultdict(set)
+        self.offptr = defaultdict(set)
+        p = "ptr%d" % (psize * 8)
+        for k, r in records.items():
+            if p not in r:
+                continue
+            ly = r[p]
+            self.keys.add(k)
+            self.size[ly["size"]].add(k)
+            T = r.get("types", [])
+            for i, (o, sz) in enumerate(ly["offsets"]):
+                self.off[o].add(k)
+                self.offsize[(o, sz)].add(k)
+                if i < len(T):
+                    self.offtype[(o, T[i])].add(k)
+            for i in ly["pointers"]:
+                self.offptr[ly["offsets"][i][0]].add(k)
+
+    def __contains__(self, k):
+        return k in self.keys
+
+    def candidates(self, reqs):
+        """
+        Returns the set of keys of indexed structs that satisfy all
+        constraints of reqs, a dict where key "*" requires the total size,
+        and an offset key requires a field at this offset with given size
+        (int), type name (str), any pointer type ("*") or any type ("?").
+        """
+        P = []
+        for o, v in reqs.items():
+            if o == "*":
+                P.append(self.size.get(v, set()))
+            elif v == "?":
+                P.append(self.off.get(o, set()))
+            elif v == "*":
+                P.append(self.offptr.get(o, set()))
+            elif isinstance(v, int):
+                P.append(self.offsize.get((o, v), set()))
+            else:
+                P.append(self.offtype.get((o, v), set()))
+        if not P:
+            return set(self.keys)
+        P.sort(key=len)
+        C = set(P[0])
+        for x in P[1:]:
+            C &= x
+            if not C:
+                break
+        return C
+
+
+class ConstantIndex(object):
+    """
+    Index of the integer values of constants found in a list of cMacro and
+    cEnum documents. It maps every value to its symbols, and every bit
+    position to the symbols whose (non-negative) value has this bit set,
+    negative values being kept apart.
+
+    Macro documents use their "value" field if present, or the integer
+    value of their string otherwise (non-numeric macros are ignored.)
+    Symbols are kept as (document index, position, symbol, value) entries
+    where position is the index of the symbol in its enum, and documents as
+    their id/src/tag/doc_id dict.
+    """
+
+    def __init__(self, docs):
+        self.docs = []
+        self.values = defaultdict(list)
+        self.bits = defaultdict(list)
+        self.neg = []
+        for d in docs:
+            n = len(self.docs)
+            if d["cls"] == "cMacro":
+                v = d.get("value")
+                if v is None:
+                    try:
+                        v = int(d["val"], 0)
+                    except (ValueError, TypeError):
+                        continue
+                self._add((n, 0, d["id"], v))
+            elif d["cls"] == "cEnum":
+                for i, (k, v) in enumerate(d["val"].items()):
+                    if isinstance(v, int):
+                        self._add((n, i, k, v))
+            else:
+                continue
+            self.docs.append(_entry(d))
+
+    def _add(self, e):
+        v = e[3]
+        self.values[v].append(e)
+        if v < 0:
+            self.neg.append(e)
+        else:
+            b = 0
+            while v:
+                if v & 1:
+                    self.bits[b].append(e)
+                v >>= 1
+                b += 1
+
+    def select(self, value, mask=False, symbol=""):
+        """
+        Returns the list of (doc, symbols) where doc is the entry dict
+        of a document with symbols that contain the symbol string and are
+        equal to value, or (if mask is True) that are lower than value with
+        some common bits. The symbols list holds (symbol, exact) tuples in
+        enum order up to the first symbol equal to value.
+        """
+        E = set((e for e in self.values.get(value, []) if symbol in e[2]))
+        if mask:
+            C = set(self.neg)
+            if value > 0:
+                for b in range(value.bit_length()):
+                    if (value >> b) & 1:
+                        C.update(self.bits.get(b, []))
+            for e in C:
+                if e[3] < value and (e[3] & value) and (symbol in e[2]):
+                    E.add(e)
+        R = []
+        for n, i, k, v in sorted(E):
+            if R and R[-1][0] == n:
+                if R[-1][1][-1][1]:
+                    continue
+                R[-1][1].append((k, v == value))
+            else:
+                R.append((n, [(k, v == value)]))
+        return [(self.docs[n], S) for (n, S) in R]
+
+
+class PrototypeIndex(object):
+    """
+    Positional index of the normalized signatures of functions found in a
+    list of cFunc documents, that maps every (position, type) pair to the
+    functions that have this type at this position (position 0 being the
+    return type and position i>0 the type of the i-th argument.)
+
+    Documents use their "sig" field if present, or the signature of their
+    prototype otherwise (functions with unparsable prototypes are ignored.)
+    """
+
+    def __init__(self, docs):
+        from ccrawl.core import ccore
+
+        self.docs = []
+        self.pos = defaultdict(list)
+        for d in docs:
+            S = d.get("sig")
+            if S is None:
+                try:
+                    S = ccore.from_db(d).signature()
+                except Exception:
+                    continue
+            n = len(self.docs)
+            for i, t in enumerate(S):
+                self.pos[(i, t)].append(n)
+            self.docs.append(_entry(d))
+
+    def select(self, reqs):
+        """
+        Returns the list of entry dicts of documents of functions with a
+        signature that has type reqs[i] at every position i.
+        """
+        P = [self.pos.get((i, t), []) for (i, t) in reqs.items()]
+        if not P:
+            return list(self.docs)
+        P.sort(key=len)
+        C = set(P[0])
+        for x in P[1:]:
+            C.intersection_update(x)
+        return [self.docs[n] for n in sorted(C)]
+
+
+class UsesIndex(object):
+    """
+    Reverse dependency index of a list of documents, that maps every type
+    identifier to the documents that directly depend on it, ie. whose
+    unfolding adds this identifier to their subtypes.
+
+    Documents use their "use" field if present (see the store command), or
+    the dependencies of their value otherwise (documents that can't be
+    decoded are ignored.)
+    """
+
+    def __init__(self, docs):
+        from ccrawl.core import ccore
+
+        self.docs = []
+        self.users = defaultdict(list)
+        for d in docs:
+            U = d.get("use")
+            if U is None:
+                try:
+                    U = [elt for (elt, _) in ccore.from_db(d).deps()]
+                except Exception:
+                    continue
+            n = len(self.docs)
+            for elt in U:
+                self.users[elt].append(n)
+            self.docs.append(_entry(d))
+
+    def select(self, identifier, transitive=False):
+        """
+        Returns the list of entry dicts of documents that depend on the type
+        with given identifier, directly or (if transitive is True) through
+        any chain of types.
+        """
+        N = set(self.users.get(identifier, []))
+        if transitive:
+            seen = set([identifier])
+            todo = [self.docs[n]["id"] for n in N]
+            while todo:
+                i = todo.pop()
+                if i in seen:
+                    continue
+                seen.add(i)
+                for n in self.users.get(i, []):
+                    if n not in N:
+                        N.add(n)
+                        todo.append(self.docs[n]["id"])
+        return [self.docs[n] for n in sorted(N)]
+
+
+class TrigramIndex(object):
+    """
+    Index of the (lowercased) trigrams of the identifier and of the
+    stringified value of documents, that maps every trigram to the list of
+    doc_ids of documents where it appears.
+
+    The stamp attribute identifies the state of the database file that was
+    indexed.
+    """
+
+    def __init__(self, docs=None, stamp=None):
+        self.stamp = stamp
+        self.grams = defaultdict(list)
+        for d in docs or []:
+            for t in _trigrams("%s\n%s" % (d["id"], _text(d.get("val")))):
+                self.grams[t].append(d.doc_id)
+
+    @classmethod
+    def load(cls, filename):
+        try:
+            with open(filename, "r") as fd:
+                data = json.load(fd)
+        except (OSError, ValueError):
+            return None
+        I = cls(stamp=data["stamp"])
+        I.grams.update(data["grams"])
+        return I
+
+    def save(self, filename):
+        try:
+            with open(filename + ".tmp", "w") as fd:
+                json.dump({"stamp": self.stamp, "grams": self.grams}, fd)
+            os.replace(filename + ".tmp", filename)
+        except OSError:
+            pass
+
+    def candidates(self, rex, flags=0):
+        """
+        Returns the sorted list of doc_ids of documents that have all trigrams
+        required for a match of regular expression rex in their id or val, or
+        None if rex has no such trigrams.
+        """
+        C = self._eval(_rex_query(rex, flags))
+        return None if C is None else sorted(C)
+
+    def _eval(self, q):
+        if q is None:
+            return None
+        op, L = q
+        if op == "all":
+            P = sorted((self.grams.get(t, []) for t in L), key=len)
+            C = set(P[0])
+            for x in P[1:]:
+                C.intersection_update(x)
+            return C
+        R = [self._eval(x) for x in L]
+        if op == "or":
+            if None in R:
+                return None
+            return set().union(*R)
+        R = [x for x in R if x is not None]
+        if not R:
+            return None
+        C = R[0]
+        for x in R[1:]:
+            C &= x
+        return C
+
+
+def _text(v):
+    # documents are indexed with the same str(val) as in the json database:
+    if isinstance(v, str):
+        return str(v)
+    return str(json.loads(json.dumps(v)))
+
+
+def _trigrams(s):
+    s = s.lower()
+    return set((s[i : i + 3] for i in range(len(s) - 2)))
+
+
+def _rex_query(rex, flags=0):
+    """
+    Returns the trigrams query required by a match of regular expression rex,
+    ie. either None (no requirement) or a ("all", trigrams) tuple or a
+    ("and"|"or", [queries]) tuple.
+    """
+    try:
+        p = sre_parse.parse(rex, flags)
+    except Exception:
+        return None
+    return _seq_query(p)
+
+
+def _flatten(items):
+    for op, av in items:
+        if str(op) == "SUBPATTERN":
+            yield from _flatten(av[-1])
+        elif str(op) == "ATOMIC_GROUP":
+            yield from _flatten(av)
+        else:
+            yield (op, av)
+
+
+def _seq_query(items):
+    Q = []
+    cur = []
+
+    def flush():
+        if len(cur) >= 3:
+            Q.append(("all", _trigrams("".join(cur))))
+        cur[:] = []
+
+    for op, av in _flatten(items):
+        op = str(op)
+        if op == "LITERAL" and av < 128:
+            cur.append(chr(av))
+            continue
+        if op == "AT":
+            # zero-width assertions don't break literal strings:
+            continue
+        flush()
+        if op == "BRANCH":
+            B = [_seq_query(x) for x in av[1]]
+            if None not in B:
+                Q.append(("or", B))
+        elif op in ("MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT") and av[0] > 0:
+            q = _seq_query(av[2])
+            if q is not None:
+                Q.append(q)
+    flush()
+    if not Q:
+        return None
+    if len(Q) == 1:
+        return Q[0]
+    return ("and", Q)
+
+
+def _entry(d):
+    e = dict(((k, d.get(k)) for k in ("id", "src", "tag")))
+    e["doc_id"] = getattr(d, "doc_id", None)
+    return e
+
+
+# ------------------------------------------------------------------------------
+
+
+class TypeCache(object):
+    """
+    Bounded cache of the types (ccore instances) fetched from databases,
+    keyed by (database, tag, identifier). Every database has its own bound
+    (see resize, maxsize being the default bound) and its types are evicted
+    in least recently used order when more types are cached (a bound of 0
+    disables the cache for this database.) The database part of the key is a
+    serial number attached to the database object (a Proxy or a TinyDB) on
+    first use, and the tag part is the database's tag Query if any.
+
+    Identifiers that are not found in a database are cached as False.
+    The Proxy invalidates its types when documents are inserted or removed
+    and when it is closed. Other changes (like sync of a remote database)
+    need explicit calls to invalidate.
+    """
+
+    uids = count()
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.sizes = {}
+        self.data = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return sum((len(D) for D in self.data.values()))
+
+    @classmethod
+    def uid(cls, db):
+        try:
+            return db._cache_uid_
+        except AttributeError:
+            db._cache_uid_ = next(cls.uids)
+        return db._cache_uid_
+
+    def size(self, db):
+        """
+        Returns the maximum number of types cached for the database.
+        """
+        return self.sizes.get(self.uid(db), self.maxsize)
+
+    def enabled(self, db):
+        return self.size(db) > 0
+
+    def resize(self, db, maxsize):
+        """
+        Sets the maximum number of types cached for the database.
+        """
+        self.sizes[self.uid(db)] = maxsize
+        self._trim(self.uid(db), maxsize)
+
+    def release(self, db):
+        """
+        Removes all cached types of the database and forgets its bound.
+        """
+        self.invalidate(db)
+        self.sizes.pop(self.uid(db), None)
+
+    def _trim(self, uid, maxsize):
+        D = self.data.get(uid)
+        while D and len(D) > max(maxsize, 0):
+            D.popitem(last=False)
+            self.evictions += 1
+
+    def peek(self, db, identifier, default=None):
+        """
+        Returns the cached type like get, but without counting a hit or a
+        miss nor refreshing its position (used by prefetch probes.)
+        """
+        D = self.data.get(self.uid(db))
+        if not D:
+            return default
+        x = D.get((getattr(db, "tag", None), identifier), None)
+        return default if x is None else x
+
+    def get(self, db, identifier, default=None):
+        D = self.data.get(self.uid(db))
+        k = (getattr(db, "tag", None), identifier)
+        x = D.get(k, None) if D else None
+        if x is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        D.move_to_end(k)
+        return x
+
+    def put(self, db, identifier, x):
+        uid = self.uid(db)
+        m = self.sizes.get(uid, self.maxsize)
+        if m <= 0:
+            return
+        D = self.data.setdefault(uid, OrderedDict())
+        k = (getattr(db, "tag", None), identifier)
+        D[k] = x
+        D.move_to_end(k)
+        self._trim(uid, m)
+
+    def invalidate(self, db=None, identifiers=None):
+        """
+        Removes cached types of the given database with given identifiers
+        (and the unfolded types that depend on them), or all types of the
+        database if identifiers is None, or all types if db is None.
+        """
+        if db is None:
+            n = len(self)
+            self.data = {}
+            self.invalidations += n
+            return
+        uid = self.uid(db)
+        D = self.data.get(uid)
+        if not D:
+            return
+        if identifiers is None:
+            del self.data[uid]
+            self.invalidations += len(D)
+            return
+        S = set(identifiers)
+        n = -1
+        while n != len(S):
+            n = len(S)
+            for k, x in D.items():
+                x = getattr(x, "subtypes", None)
+                if x and k[1] not in S and not S.isdisjoint(x):
+                    S.add(k[1])
+        K = [k for k in D if k[1] in S]
+        for k in K:
+            del D[k]
+        self.invalidations += len(K)
+
+    def clear(self):
+        self.invalidate()
+
+    def stats(self):
+        return {
+            "size": len(self),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+typecache = TypeCache()
+
+
+# ------------------------------------------------------------------------------
+
+
+class Sink(object):
+    """
+    Streaming sink for documents produced by the collect command.
+
+    Documents are deduplicated as they are added (a cFunc is kept once per
+    prototype unless a later one has locals or calls, other documents are
+    kept once per source file, the last one winning) and are written to the
+    *local* database by batches. Rather than full documents, the sink only
+    keeps a compact index that maps a short digest of each dedup key to the
+    digest of the current document and its doc_id once flushed, so that a
+    replaced document can be removed from the database.
+
+    Method done(filename) is called once all documents from a file have been
+    added. A checkpoint is performed when at least 'batch' documents are
+    pending: they are flushed and the database storage is written so that
+    all files listed in the 'saved' attribute have their documents on disk.
+    If a Journal is provided, the records of these files are then appended
+    to it.
+
+    Only the SQLite storage writes pending documents incrementally. A TinyDB
+    file database is kept in memory and rewritten entirely by every
+    checkpoint, so for this storage the batch grows with the database (a
+    checkpoint is performed when pending documents amount to at least half of
+    the saved ones) to keep the total amount of writes linear.
+    """
+
+    def __init__(self, db, batch=10000, skip=None, journal=None):
+        self.db = db
+        self.batch = batch
+        self.threshold = batch
+        self.rewrite = bool(db.path) and isinstance(db.ldb, TinyDB)
+        self.skip = skip or set()
+        self.journal = journal
+        self.keys = {}
+        self.pending = {}
+        self.replaced = []
+        self.files = []
+        self.records = []
+        self.saved = []
+
+    def __len__(self):
+        return len(self.keys)
+
+    @staticmethod
+    def digest(s):
+        return hashlib.blake2b(s.encode(), digest_size=8).digest()
+
+    def key(self, x):
+        if x["cls"] == "cFunc":
+            return self.digest(x["id"] + x["val"]["prototype"])
+        return self.digest(x["id"] + x["src"])
+
+    def load(self, docs):
+        """
+        Rebuilds the index from documents already saved in the database
+        (used to resume an interrupted collect.)
+        """
+        for x in docs:
+            h = self.digest(json.dumps(x, sort_keys=True, default=str))
+            self.keys[self.key(x)] = (h, x.doc_id)
+
+    def add(self, l):
+        """
+        Adds the list l of collected documents to the sink.
+        """
+        for x in l:
+            if (x["id"], x["src"]) in self.skip:
+                continue
+            k = self.key(x)
+            if x["cls"] == "cFunc":
+                if (k in self.keys) and not (x["val"]["locs"] or x["val"]["calls"]):
+                    continue
+            h = self.digest(json.dumps(x, sort_keys=True, default=str))
+            old = self.keys.get(k)
+            if old is not None:
+                if old[0] == h:
+                    continue
+                if old[1] is not None:
+                    self.replaced.append(old[1])
+            self.keys[k] = (h, None)
+            self.pending[k] = x
+
+    def done(self, filename, record=None):
+        """
+        Marks filename as completed (with its journal record), and performs
+        a checkpoint if the batch of pending documents is full.
+        """
+        self.files.append(filename)
+        if record is not None:
+            self.records.append(record)
+        if len(self.pending) >= self.threshold:
+            self.checkpoint()
+
+    def flush(self):
+        """
+        Writes all pending documents to the database.
+        """
+        if self.replaced:
+            self.db.remove_docs(doc_ids=self.replaced)
+            self.replaced = []
+        if self.pending:
+            ids = self.db.insert_multiple(list(self.pending.values()))
+            for k, i in zip(self.pending, ids or []):
+                self.keys[k] = (self.keys[k][0], i)
+            self.pending = {}
+
+    def checkpoint(self):
+        """
+        Flushes pending documents and writes the database storage.
+        """
+        self.flush()
+        self.db.flush()
+        if self.rewrite:
+            self.threshold = max(self.batch, len(self.db.ldb) // 2)
+        if self.journal is not None:
+            self.journal.write(self.records)
+        self.saved.extend(self.files)
+        self.files = []
+        self.records = []
+
+
+class Journal(object):
+    """
+    Progress journal of the collect command, stored in a json-lines file
+    alongside the local database. The first line holds the tag of the
+    collect and each following line holds the record of a completed file,
+    with keys "src", "hash", "tag" and "docs" (as in the fingerprints table.)
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.fd = None
+
+    def load(self):
+        """
+        Returns the tag and the list of records found in the journal file
+        (the tag is None if there is no journal.)
+        """
+        tag, records = None, []
+        try:
+            with open(self.filename, "r") as fd:
+                tag = json.loads(fd.readline())["tag"]
+                for l in fd:
+                    try:
+                        records.append(json.loads(l))
+                    except ValueError:
+                        # truncated last line:
+                        break
+        except (OSError, ValueError, KeyError):
+            pass
+        return tag, records
+
+    def open(self, tag, records=None):
+        """
+        (Re)creates the journal file for a collect with given tag, starting
+        with the given records.
+        """
+        self.fd = open(self.filename, "w")
+        self.fd.write(json.dumps({"tag": tag}) + "\n")
+        self.write(records or [])
+
+    def write(self, records):
+        """
+        Appends records to the journal and syncs it to disk.
+        """
+        if self.fd is None:
+            return
+        for r in records:
+            self.fd.write(json.dumps(r) + "\n")
+        self.fd.flush()
+        os.fsync(self.fd.fileno())
+
+    def close(self, remove=True):
+        """
+        Closes the journal file, and removes it unless remove is False.
+        """
+        if self.fd is not None:
+            self.fd.close()
+            self.fd = None
+        if remove and os.path.exists(self.filename):
+            os.remove(self.filename)
+
+
+# ------------------------------------------------------------------------------
+
+
+class SQLiteDB(object):
+    """
+    This class implements a local database stored in a SQLite file, with the
+    subset of the TinyDB interface used by ccrawl (search, get, contains,
+    insert, insert_multiple, update, remove, table, iteration, etc.)
+
+    Documents are stored as json strings along with their "id", "cls", "tag"
+    and "src" fields in indexed columns. TinyDB.Query instances are translated
+    into SQL conditions on these columns (equality, one_of, matches or search
+    tests) and any remaining part of the query is evaluated on the documents
+    returned by SQLite.
+    """
+
+    columns = ("id", "cls", "tag", "src")
+
+    def __init__(self, path, table="_default", conn=None):
+        self.path = path
+        self.name = table
+        if conn is None:
+            conn = sqlite3.connect(path)
+            conn.create_function("matches", 2, _sql_matches, deterministic=True)
+            conn.create_function("search", 2, _sql_search, deterministic=True)
+        self.conn = conn
+        C = ", ".join(self.columns)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS "%s" (doc_id INTEGER PRIMARY KEY, %s, doc TEXT)'
+            % (table, C)
+        )
+        for c in self.columns:
+            self.conn.execute(
+                'CREATE INDEX IF NOT EXISTS "%s_%s" ON "%s" (%s)' % (table, c, table, c)
+            )
+        self.conn.commit()
+
+    def __repr__(self):
+        return u"<SQLiteDB path=%s, table=%s, documents_count=%d>" % (
+            self.path, self.name, len(self))
+
+    def tables(self):
+        r = self.conn.execute("SELECT name FROM sqlite_master WHERE type='table'")
+        return set((x[0] for x in r))
+
+    def table(self, name):
+        return SQLiteDB(self.path, name, self.conn)
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM "%s"' % self.name).fetchone()[0]
+
+    def __iter__(self):
+        for d in self._select("1", []):
+            yield d
+
+    def all(self):
+        return list(self)
+
+    def _select(self, w, params, limit=None):
+        sql = 'SELECT doc_id, doc FROM "%s" WHERE %s ORDER BY doc_id' % (self.name, w)
+        if limit:
+            sql += " LIMIT %d" % limit
+        for i, d in self.conn.execute(sql, params):
+            yield Document(json.loads(d), doc_id=i)
+
+    def _select_ids(self, doc_ids):
+        # (sqlite limits the number of parameters of a statement.)
+        doc_ids = sorted(set(doc_ids))
+        for i in range(0, len(doc_ids), 500):
+            ids = doc_ids[i : i + 500]
+            for d in self._select("doc_id IN (%s)" % ",".join(["?"] * len(ids)), ids):
+                yield d
+
+    def _row(self, doc):
+        r = [doc.get(c) for c in self.columns]
+        r = [v if isinstance(v, (str, int, float)) else None for v in r]
+        return r + [json.dumps(doc)]
+
+    def _find(self, q=None, doc_ids=None, limit=None):
+        if doc_ids is not None:
+            R = self._select_ids(list(doc_ids))
+        else:
+            w, params, exact = _sql_where(q._hash if q is not None else ())
+            if exact:
+                R = self._select(w, params, limit)
+            else:
+                R = (d for d in self._select(w, params) if q(d))
+        for d in R:
+            yield d
+
+    def search(self, q):
+        return list(self._find(q))
+
+    def get(self, q=None, doc_id=None, doc_ids=None):
+        if doc_ids is not None:
+            return list(self._find(None, doc_ids))
+        for d in self._find(q, None if doc_id is None else [doc_id], limit=1):
+            return d
+        return None
+
+    def contains(self, q=None, doc_id=None):
+        return self.get(q, doc_id) is not None
+
+    def insert(self, doc):
+        return self.insert_multiple([doc])[0]
+
+    def insert_multiple(self, docs):
+        sql = 'INSERT INTO "%s" (%s, doc) VALUES (?, ?, ?, ?, ?)' % (
+            self.name, ", ".join(self.columns))
+        cur = self.conn.cursor()
+        ids = []
+        for doc in docs:
+            cur.execute(sql, self._row(doc))
+            ids.append(cur.lastrowid)
+        self.conn.commit()
+        return ids
+
+    def update(self, fields, cond=None, doc_ids=None):
+        if cond is None and doc_ids is None:
+            L = self.all()
+        else:
+            L = list(self._find(cond, doc_ids))
+        sql = 'UPDATE "%s" SET %s, doc = ? WHERE doc_id = ?' % (
+            self.name, ", ".join(("%s = ?" % c for c in self.columns)))
+        for d in L:
+            if callable(fields):
+                fields(d)
+            else:
+                d.update(fields)
+            self.conn.execute(sql, self._row(d) + [d.doc_id])
+        self.conn.commit()
+        return [d.doc_id for d in L]
+
+    def remove(self, cond=None, doc_ids=None):
+        if doc_ids is None:
+            doc_ids = [d.doc_id for d in self._find(cond)]
+        doc_ids = list(doc_ids)
+        for i in range(0, len(doc_ids), 500):
+            ids = doc_ids[i : i + 500]
+            self.conn.execute(
+                'DELETE FROM "%s" WHERE doc_id IN (%s)' % (self.name, ",".join(["?"] * len(ids))),
+                ids,
+            )
+        self.conn.commit()
+        return doc_ids
+
+    def truncate(self):
+        self.conn.execute('DELETE FROM "%s"' % self.name)
+        self.conn.commit()
+
+    def flush(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+
+def _sql_matches(rex, value):
+    # (regex flags are not part of the query hash: the match is case
+    # insensitive and the query is evaluated again on returned documents.)
+    if not isinstance(value, str):
+        return 0
+    return re.match(rex, value, re.I | re.S | re.M) is not None
+
+
+def _sql_search(rex, value):
+    if not isinstance(value, str):
+        return 0
+    return re.search(rex, value, re.I | re.S | re.M) is not None
+
+
+def _sql_where(q):
+    """
+    Translates a TinyDB.Query hash into a (condition, parameters, exact) tuple
+    where condition is an SQL expression on the SQLiteDB columns that holds
+    for all documents matching the query. If exact is False, the query needs
+    to be evaluated on the selected documents.
+    """
+    if q is None:
+        return ("1", [], False)
+    if len(q) == 0:
+        return ("1", [], True)
+    op = q[0]
+    if op in ("and", "or"):
+        L = [_sql_where(x) for x in q[1]]
+        if op == "and":
+            S = [x for x in L if x[0] != "1"]
+        else:
+            T = [x for x in L if x[0] == "1"]
+            if T:
+                return ("1", [], any((x[2] for x in T)))
+            S = L
+        if not S:
+            return ("1", [], all((x[2] for x in L)))
+        w = (" %s " % op.upper()).join(("(%s)" % x[0] for x in S))
+        params = sum((x[1] for x in S), [])
+        return (w, params, all((x[2] for x in L)))
+    if len(q) > 2 and len(q[1]) == 1 and q[1][0] in SQLiteDB.columns:
+        c = q[1][0]
+        v = q[2]
+        if op == "==" and _scalar(v):
+            return ("%s = ?" % c, [v], True)
+        if op == "one_of" and all((_scalar(x) for x in v)):
+            return ("%s IN (%s)" % (c, ",".join(["?"] * len(v))), list(v), True)
+        if op in ("matches", "search") and isinstance(v, str):
+            return ("%s(?, %s)" % (op, c), [v], False)
+    return ("1", [], False)
+
+
+def _scalar(v):
+    return isinstance(v, (str, int, float)) and not isinstance(v, bool)
+
+
+def _deps(x, D=None):
+    """
+    Returns the set of identifiers of all types that the unfolded
+    type x depends on (including missing ones.)
+    """
+    if D is None:
+        D = set()
+    for k, v in (x.subtypes or {}).items():
+        if k in D:
+            continue
+        D.add(k)
+        if v is not None:
+            _deps(v, D)
+    return D
+
+
+def _closure(x):
+    """
+    Returns the list of identifiers of all types that the unfolded type x
+    depends on (dependency cycles are broken where they are found, and x is
+    the last type if it depends on itself), and the list of those that are
+    missing.
+    """
+    L, M = [], []
+    seen = set()
+    stack = [(None, iter((x.subtypes or {}).items()))]
+    while stack:
+        for k, v in stack[-1][1]:
+            if k in seen:
+                continue
+            seen.add(k)
+            if k == x.identifier:
+                continue
+            if v is None:
+                L.append(k)
+                M.append(k)
+            elif v.subtypes:
+                stack.append((k, iter(v.subtypes.items())))
+                break
+            else:
+                L.append(k)
+        else:
+            k, _ = stack.pop()
+            if k is not None:
+                L.append(k)
+    if x.identifier in seen:
+        L.append(x.identifier)
+    return L, M
+
+
+def _eq_terms(q, T=None):
+    """
+    Returns the dict of field:value equality terms that are required by the
+    given TinyDB.Query hash (at top-level or within top-level "and" terms.)
+    """
+    if T is None:
+        T = {}
+    if q:
+        if q[0] == "and":
+            for x in q[1]:
+                _eq_terms(x, T)
+        elif q[0] == "==" and len(q[1]) == 1 and _scalar(q[2]):
+            T.setdefault(q[1][0], q[2])
+    return T
+
+
 # ------------------------------------------------------------------------------
 
 
 class CouchDB(object):
     def __init__(self, url, auth=None, verify=True):
+        import requests
+
         self.url = url
         self.verify = verify
         self.session = requests.Session()
@@ -203,6 +1764,9 @@ class MongoDB(object):
             elif op == "search":
                 l, r = q[1][0], q[2]
                 res[l] = {"$regex": r}
+            elif op == "one_of":
+                l, r = q[1][0], q[2]
+                res[l] = {"$in": list(r)}
             elif op == "and":
                 for x in q[1]:
                     res.update(self._where(x))
@@ -1,8 +1,20 @@
 formats = ["raw", "C", "ctypes", "amoco"]
 
 from .raw import *
-from .C import *
-from .ctypes_ import *
-from .amoco import *
 
 default = ccore_raw
+
+# formatters modules are imported on first access to one of their
+# "<class>_<format>" functions:
+modules = {"raw": ".raw", "C": ".C", "ctypes": ".ctypes_", "amoco": ".amoco"}
+
+
+def __getattr__(name):
+    form = name.rpartition("_")[2]
+    if form in modules:
+        from importlib import import_module
+
+        m = import_module(modules[form], __name__)
+        if name in m.__all__:
+            return getattr(m, name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
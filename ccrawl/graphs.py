@@ -240,6 +240,10 @@ def get_cycle_offsets(node,db,P,psize):
             j = col.find_one({"_id": _id})
             if j and i is not None:
                 return j["offsets"][i]
+        else:
+            j = db.layout(obj.identifier, psize)
+            if j and i is not None:
+                return j["offsets"][i]
         # otherwise we need to build the struct:
         ax = amoco.build(obj,db)()
         return ax.offsets(psize)[i]
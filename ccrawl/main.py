@@ -5,15 +5,13 @@ import shutil
 import click
 from ccrawl import conf
 from ccrawl.formatters import formats
-from ccrawl.parser import TYPEDEF_DECL, STRUCT_DECL, UNION_DECL, ENUM_DECL
-from ccrawl.parser import CLASS_DECL, FUNCTION_DECL, MACRO_DEF
-from ccrawl.parser import preprocess,parse
 from ccrawl.core import ccore
 from ccrawl.utils import c_type
-from ccrawl.db import Proxy, Query, where
+from ccrawl.db import Proxy, Sink, Journal, ConstantIndex, PrototypeIndex, Query, where
 
 """
-
+The parser module (and thus libclang) is imported only by commands that need
+it, so that query commands start quickly.
 """
 
 # ccrawl commands utilities:
@@ -28,6 +26,10 @@ def spawn_console(ctx):
     c = conf.config
     if not ctx.obj["db"]:
         ctx.obj["db"] = Proxy(c.Database)
+    from ccrawl.parser import TYPEDEF_DECL, STRUCT_DECL, UNION_DECL, ENUM_DECL
+    from ccrawl.parser import CLASS_DECL, FUNCTION_DECL, MACRO_DEF
+    from ccrawl.parser import preprocess,parse,parse_pool,fingerprints
+    from ccrawl.parser import build_prelude,g_prelude
     cvars = dict(globals(), **locals())
     cvars.update(ctx.obj)
     if c.Terminal.console.lower() == "ipython":
@@ -56,12 +58,83 @@ def spawn_console(ctx):
         interact(banner=conf.BANNER + "\n", local=cvars)
 
 
+def find_docs(db, identifiers, infile=None, match=None, ands=(), first=False):
+    """
+    Yields documents for all given identifiers (and for identifiers read from
+    infile, one per line), followed by documents with identifier matching the
+    match regular expression and "key=value" constraints of ands (like
+    select --and option.) If first is True, only the first document found
+    for every identifier is yielded. Every document is yielded only once.
+    """
+    L = list(identifiers)
+    if infile is not None:
+        L.extend(filter(None, (l.strip() for l in infile)))
+    R = []
+    for identifier in L:
+        Q = db.tag & (where("id") == identifier)
+        D = [db.get(Q)] if first else db.search(Q)
+        if not D or D[0] is None:
+            click.secho("identifier '%s' not found" % identifier, fg="red", err=True)
+            continue
+        R.append(D)
+    if match or ands:
+        Q = Query().noop()
+        if match:
+            Q &= where("id").matches(match)
+        for x in ands:
+            k, v = x.split("=", 1)
+            Q &= where(k).search(v)
+        R.append(db.search(db.tag & Q))
+    done = set()
+    ids = set()
+    for D in R:
+        for l in D:
+            k = (l["id"], l["src"], l.get("tag"))
+            if (k in done) or (first and l["id"] in ids):
+                continue
+            done.add(k)
+            ids.add(l["id"])
+            yield l
+
+
+class CliGroup(click.Group):
+    """
+    Click Group that keeps its raw command line arguments in the context's
+    meta dict, so that query commands can be forwarded to a ccrawl daemon.
+    """
+
+    def parse_args(self, ctx, args):
+        ctx.meta["ccrawl.argv"] = list(args)
+        return super().parse_args(ctx, args)
+
+
+def forward_query(ctx):
+    """
+    Forwards the query command of the Click context to a running ccrawl daemon
+    and exits with its results, or returns if no daemon is listening.
+    """
+    c = conf.config
+    if not (c.Daemon.forward and os.path.exists(c.Daemon.socket)) or c.Database.user:
+        return
+    from ccrawl.srv.daemon import forward
+
+    color = ctx.color
+    if color is None:
+        color = click.get_text_stream("stdout").isatty()
+    rep = forward(c.Daemon.socket, ctx.meta["ccrawl.argv"], c.Terminal.width, color)
+    if rep is None:
+        return
+    click.echo(rep["out"], nl=False, color=color)
+    click.echo(rep["err"], nl=False, err=True, color=color)
+    ctx.exit(rep["code"])
+
+
 # ------------------------------------------------------------------------------
 # ccrawl Commands :
 # ------------------------------------------------------------------------------
 
 
-@click.group(invoke_without_command=True)
+@click.group(cls=CliGroup, invoke_without_command=True)
 @click.option("-v", "--verbose", is_flag=True, default=False, help="display more infos")
 @click.option("-q", "--quiet", is_flag=True, default=False, help="don't display anything")
 @click.option("-b", "--db", help="url for the remote database")
@@ -86,7 +159,11 @@ def cli(ctx, verbose, quiet, db, local, configfile, tag):
     console if no subcommand is found in the Click context.
     The configuration is read, verbosity level is adjusted, and the database
     interface is instanciated.
+    Query commands are forwarded to the ccrawl daemon if one is running, and
+    when the command is served by the daemon (ctx.obj is the Daemon instance)
+    the daemon's resident database interface is used.
     """
+    daemon = ctx.obj
     ctx.obj = {}
     c = conf.config = conf.Config(configfile)
     if quiet:
@@ -107,13 +184,21 @@ def cli(ctx, verbose, quiet, db, local, configfile, tag):
     if local:
         c.Database.local = local
         c.Database.localonly = True
+    queries = ("show", "select", "search", "info", "stats", "uses")
+    if daemon is None and ctx.invoked_subcommand in queries:
+        forward_query(ctx)
+    elif daemon is not None and ctx.invoked_subcommand not in queries:
+        raise click.UsageError("command not served by the daemon")
     if conf.VERBOSE:
         click.echo("loading local database %s ..." % c.Database.local, nl=False)
     try:
-        ctx.obj["db"] = Proxy(c.Database)
+        if daemon is None:
+            ctx.obj["db"] = Proxy(c.Database)
+            if tag:
+                ctx.obj["db"].set_tag(tag)
+        else:
+            ctx.obj["db"] = daemon.proxy(c.Database, tag)
         ctx.obj["tag"] = tag
-        if tag:
-            ctx.obj["db"].set_tag(tag)
     except Exception:
         click.secho("failed", fg="red", err=True)
         exit(1)
@@ -159,6 +244,18 @@ def cli(ctx, verbose, quiet, db, local, configfile, tag):
     type=str,
     help="output dependency graph of collected files")
 @click.option("-C", "--no-cxx","nocxx", is_flag=True, help="ignore C++ files")
+@click.option("-j", "--jobs", type=click.INT, default=0, help="number of parallel parsing processes")
+@click.option("-i", "--incremental", is_flag=True, help="only collect files that have changed")
+@click.option(
+    "--tu-cache", "tucache",
+    type=click.Path(file_okay=False, dir_okay=True),
+    help="directory where parsed translation units are cached")
+@click.option("-r", "--resume", is_flag=True, help="resume an interrupted collect")
+@click.option("--timeout", type=click.INT, default=0, help="maximum parsing time of a file (seconds)")
+@click.option("--memlimit", type=click.INT, default=0, help="memory limit of parsing processes (MB)")
+@click.option("--preparse", is_flag=True, help="store pre-parsed types in documents")
+@click.option("--layouts", is_flag=True, help="compute layouts of collected structs")
+@click.option("--closures", is_flag=True, help="compute dependency closures of collected types")
 @click.argument(
     "src",
     nargs=-1,
@@ -166,7 +263,7 @@ def cli(ctx, verbose, quiet, db, local, configfile, tag):
     # help='directory/files with definitions to collect',
 )
 @click.pass_context
-def collect(ctx, allc, types, functions, macros, strict, recon, xclang, outgraph, nocxx, src):
+def collect(ctx, allc, types, functions, macros, strict, recon, xclang, outgraph, nocxx, jobs, incremental, tucache, resume, timeout, memlimit, preparse, layouts, closures, src):
     """
     Collects types (struct,union,class,...) definitions,
     functions prototypes and/or macro definitions from SRC files/directory.
@@ -181,13 +278,71 @@ def collect(ctx, allc, types, functions, macros, strict, recon, xclang, outgraph
     In strict mode, the clang options need to conform to the makefile
     that lead to the compilation of all input source (i.e. clang diagnostics
     errors are not bypassed).
+
+    With the --jobs option, the preprocessing stage and the parsing of files
+    are performed by a pool of processes (each with its own clang Index) and
+    results are merged in the same order as in sequential mode.
+
+    In incremental mode, a fingerprint of every parsed file (including the
+    contents of all files it includes and the clang options) is recorded in
+    the local database. Files with unchanged fingerprint are not parsed again,
+    and documents previously collected from changed or removed files are
+    replaced.
+
+    The --tu-cache option allows to save clang translation units in the given
+    directory so that later parsing of the same (unmodified) files with the
+    same parameters are loaded from this cache.
+
+    Headers listed in the Collect.prelude configuration parameter are parsed
+    once and precompiled, the resulting precompiled header being included
+    in every parsed file.
+
+    Collected documents are saved to the local database by batches of
+    Collect.batch documents as files are processed, so that memory usage
+    remains bounded and documents of all completed files are written on disk
+    at each checkpoint.
+
+    Completed files are recorded at each checkpoint in a journal file
+    alongside the local database (removed when the collect terminates.)
+    The --resume option allows to continue an interrupted collect by skipping
+    all files found in this journal.
+
+    The --timeout and --memlimit options (as well as --jobs) make files being
+    parsed by supervised worker processes: a file that crashes its worker or
+    exceeds these limits is reported as [err] and the worker is restarted.
+
+    With the --preparse option, the type strings used by every collected
+    object are parsed at collect time and stored in the "types" field of
+    its document, so that later queries don't need to parse them again.
+
+    With the --layouts option, the layouts of all collected structs are
+    computed once collect is done (see the layouts command.)
+
+    With the --closures option, the dependency closures of all collected
+    types are computed once collect is done (see the closures command.)
     """
+    from ccrawl.parser import TYPEDEF_DECL, STRUCT_DECL, UNION_DECL, ENUM_DECL
+    from ccrawl.parser import CLASS_DECL, FUNCTION_DECL, MACRO_DEF
+    from ccrawl.parser import parse,parse_pool,show_report,fingerprints,prelude_fingerprint
+    from ccrawl.parser import build_prelude,clear_prelude,g_prelude
     # take into account options in config:
     c = conf.config
     K = None
     c.Collect.strict |= strict
     c.Collect.allc |= allc
     c.Collect.cxx &= not nocxx
+    c.Collect.incremental |= incremental
+    c.Collect.preparse |= preparse
+    c.Collect.layouts |= layouts
+    c.Collect.closures |= closures
+    if tucache:
+        c.Collect.tucache = tucache
+    if jobs > 0:
+        c.Collect.jobs = jobs
+    if timeout > 0:
+        c.Collect.timeout = timeout
+    if memlimit > 0:
+        c.Collect.memlimit = memlimit
     if types or functions or macros:
         K = []
         if types:
@@ -202,8 +357,6 @@ def collect(ctx, allc, types, functions, macros, strict, recon, xclang, outgraph
         tag = str(time.time())
     else:
         tag = ctx.obj["db"].tag._hash[-1]
-    # temporary database cache:
-    dbo = {}
     # set defaults clang frontend parameters:
     args = [
         "-ferror-limit=0",
@@ -214,7 +367,7 @@ def collect(ctx, allc, types, functions, macros, strict, recon, xclang, outgraph
         args += xclang.split(" ")
     # preprocess all files to compute their dependency graph
     # allowing to order them and possibly add include directive for each file:
-    FILES,G = preprocess_files(src, args, c.Collect.cxx, c.Collect.allc)
+    FILES,G = preprocess_files(src, args, c.Collect.cxx, c.Collect.allc, c.Collect.jobs)
     if outgraph:
         L = ["digraph ccrawl {"]
         for g in G.C:
@@ -227,9 +380,74 @@ def collect(ctx, allc, types, functions, macros, strict, recon, xclang, outgraph
             dot.write('\n'.join(L))
     if recon is True:
         return 0
+    db = ctx.obj["db"]
     total = len(FILES)
     already_done = set()
     W = c.Terminal.width - 12
+    journal = None
+    resumed = []
+    if db.path:
+        journal = Journal(db.path + ".journal")
+        if resume:
+            jtag, resumed = journal.load()
+            if jtag is None:
+                click.secho("no journal found, starting a new collect", fg="yellow")
+            elif ctx.obj["tag"] is None:
+                tag = jtag
+            elif tag != jtag:
+                click.secho("journal tag is '%s', starting a new collect" % jtag, fg="yellow")
+                resumed = []
+        journal.open(tag, resumed)
+    journaled = set((r["src"] for r in resumed))
+    hp = None
+    if c.Collect.prelude:
+        # precompile prelude headers and collect their definitions once:
+        if not c.Terminal.quiet:
+            click.echo("prelude headers...".ljust(W), nl=False)
+        ctx.call_on_close(clear_prelude)
+        lp = build_prelude(args, kind=K, tag=tag, cxx=c.Collect.cxx)
+        # (the prelude record is keyed by the name of the prelude header,
+        # which does not depend on the directory of precompiled headers.)
+        hp = os.path.basename(g_prelude["c"][0])
+    if c.Collect.incremental:
+        # fingerprints depend on clang & collect options as well, and on
+        # the contents of prelude headers:
+        opts = ["strict=%s" % c.Collect.strict, "allc=%s" % c.Collect.allc,
+                "cxx=%s" % c.Collect.cxx, "kind=%s" % [k.value for k in (K or [])],
+                "prelude=%s" % prelude_fingerprint(args),
+                "preparse=%s" % c.Collect.preparse]
+        FP = fingerprints(FILES, G, args+opts)
+        if hp:
+            FP[hp] = prelude_fingerprint(args+opts)
+        FPdb = db.fingerprints()
+        unchanged = set((f for f in FP if f in FPdb and FPdb[f]["hash"] == FP[f]))
+        already_done.update(unchanged)
+        records = list(resumed)
+        # stale documents have already been removed if we resume:
+        keep = remove_changed(db, FPdb, unchanged, remove=not resumed)
+    else:
+        keep = None
+    # documents are streamed to the database by batches:
+    dbo = Sink(db, c.Collect.batch, skip=keep, journal=journal)
+    if resumed:
+        dbo.load(db.ldb.search(where("tag") == tag))
+    elif c.Collect.incremental and not FPdb:
+        # documents of a previous collect without fingerprints are replaced
+        # rather than duplicated:
+        dbo.load(db.ldb.search(where("tag") == tag))
+    if hp and (hp not in already_done) and (hp not in journaled):
+        dbo.add(lp)
+        r = {"src": hp, "hash": "", "tag": tag, "docs": [(x["id"], x["src"]) for x in lp]}
+        if c.Collect.incremental:
+            r["hash"] = FP[hp]
+            records.append(r)
+        dbo.done(hp, r)
+    supervised = (c.Collect.jobs > 1) or c.Collect.timeout or c.Collect.memlimit
+    if supervised:
+        todo = dict(((f,d) for (f,d) in FILES.items()
+                     if f not in already_done and f not in journaled))
+        P = parse_pool(todo, args, kind=K, tag=tag, jobs=c.Collect.jobs,
+                       timeout=c.Collect.timeout, memlimit=c.Collect.memlimit)
     # parse and collect all sources:
     n = 0
     for filename,directives in FILES.items():
@@ -239,10 +457,27 @@ def collect(ctx, allc, types, functions, macros, strict, recon, xclang, outgraph
             p = (n * 100.0) / total
             click.echo(("[%3d%%] %s " % (p, filename)).ljust(W), nl=False)
         if filename in already_done:
+            if not c.Terminal.quiet:
+                click.secho("[same]".rjust(12), fg="blue")
+            continue
+        elif filename in journaled:
+            if not c.Terminal.quiet:
+                click.secho("[done]".rjust(12), fg="blue")
             continue
         else:
             already_done.add(filename)
-        l = parse(filename, args+directives, kind=K, tag=tag)
+        if supervised:
+            l = next(P)
+            if l is None:
+                # worker crashed or exceeded its limits:
+                if not c.Terminal.quiet:
+                    click.secho("[err]".rjust(12), fg="red")
+                continue
+            l, report = l
+            if not c.Terminal.quiet:
+                show_report(report)
+        else:
+            l = parse(filename, args+directives, kind=K, tag=tag)
         t1 = time.time()
         if c.Terminal.timer:
             click.secho("(%.2f+" % (t1 - t0), nl=False, fg="cyan")
@@ -252,30 +487,61 @@ def collect(ctx, allc, types, functions, macros, strict, recon, xclang, outgraph
             # remove already processed/included files
             already_done.union(set([el["src"] for el in l]))
             # aggregate cFunc instances and remove duplicates in dbo:
-            for x in l:
-                if x["cls"] == "cFunc":
-                    kpad = x["id"] + x["val"]["prototype"]
-                    if (kpad not in dbo) or (x["val"]["locs"] or x["val"]["calls"]):
-                        dbo[kpad] = x
-                else:
-                    kpad = x["id"] + x["src"]
-                    dbo[kpad] = x
+            dbo.add(l)
+        docs = [(x["id"], x["src"]) for x in l]
+        r = {"src": filename, "hash": "", "tag": tag, "docs": docs}
+        if c.Collect.incremental:
+            r["hash"] = FP[filename]
+            records.append(r)
+        dbo.done(filename, r)
         t2 = time.time()
         if c.Terminal.timer:
             click.secho("%.2f)" % (t2 - t1), fg="cyan")
-    db = ctx.obj["db"]
 
     if not c.Terminal.quiet:
         click.echo("-" * (c.Terminal.width))
         click.echo("saving database...".ljust(W), nl=False)
+    dbo.flush()
+    if c.Collect.incremental:
+        db.update_fingerprints(records, [f for f in FPdb if f not in unchanged])
+    if c.Collect.layouts:
+        try:
+            db.update_layouts(where("tag") == tag)
+        except NotImplementedError:
+            click.secho("amoco is required to compute layouts", fg="red", err=True)
+    if c.Collect.closures:
+        db.update_closures(where("tag") == tag)
+    if c.Database.trigrams:
+        db.flush()
+        db.trigram_index()
     N = len(dbo)
-    db.insert_multiple(dbo.values())
     db.close()
+    if journal is not None:
+        journal.close()
     if not c.Terminal.quiet:
         click.secho(("[%4d]" % N).rjust(12), fg="green")
     return 0
 
 
+def remove_changed(db, FPdb, unchanged, remove=True):
+    """
+    Removes from the local database all documents previously collected from
+    files that have changed or disappeared, unless they are still provided by
+    an unchanged file, and returns the set of (id,src) keys of documents
+    provided by unchanged files.
+    """
+    keep = set()
+    for f in unchanged:
+        keep.update((tuple(k) for k in FPdb[f]["docs"]))
+    if remove:
+        R = set()
+        for f, r in FPdb.items():
+            if f not in unchanged:
+                R.update(((i, s, r["tag"]) for (i, s) in r["docs"] if (i, s) not in keep))
+        db.remove_docs(R)
+    return keep
+
+
 def do_collect(ctx, src):
     ctx.invoke(
         collect,
@@ -290,7 +556,8 @@ def do_collect(ctx, src):
     )
 
 
-def preprocess_files(src,args,cxx=False,allc=False):
+def preprocess_files(src,args,cxx=False,allc=False,jobs=1):
+    from ccrawl.parser import preprocess
     click.echo("preprocessing files...",nl=False)
     F = Fh = lambda f: f.endswith(".h") or (cxx and f.endswith(".hpp"))
     if allc is True:
@@ -305,7 +572,7 @@ def preprocess_files(src,args,cxx=False,allc=False):
                     FILES.add(filename)
         elif os.path.isfile(D) and F(D):
             FILES.add(D)
-    res,G = preprocess(FILES,args)
+    res,G = preprocess(FILES,args,jobs)
     click.echo("done.")
     return res,G
 
@@ -323,6 +590,8 @@ def search(ctx, ignorecase, rex):
     Search for documents in the remote database
     (or the local database if no remote is found) with either name
     or definition matching the provided regular expression.
+    Documents of the local database are preselected from a trigram index
+    whenever the regular expression requires some literal strings.
     """
     db = ctx.obj["db"]
     flg = re.MULTILINE
@@ -338,9 +607,10 @@ def search(ctx, ignorecase, rex):
     if db.rdb:
         Q |= where("val").matches(rex, flags=flg)
         Q |= where("use").matches(rex, flags=flg)
+        L = db.search(db.tag & Q)
     else:
         Q |= where("val").test(look)
-    L = db.search(db.tag & Q)
+        L = db.regex_search(db.tag & Q, rex, flg)
     for l in L:
         click.echo("found ", nl=False)
         click.secho("%s " % l["cls"], nl=False, fg="cyan")
@@ -400,6 +670,9 @@ def prototype(ctx, proto):
     (or the local database if no remote is found) matching
     constraints on name of its return type or specific
     arguments.
+    Functions are looked up in an index of their normalized signatures,
+    which is built once for the database (or for the selected documents if
+    the select command has constraints.)
     """
     reqs = {}
     try:
@@ -412,18 +685,14 @@ def prototype(ctx, proto):
         return
     db = ctx.obj["db"]
     Q = ctx.obj.get("select", Query().noop())
-    L = db.search(db.tag & Q, cls="cFunc")
+    if Q._hash:
+        PI = PrototypeIndex(db.search(db.tag & Q, cls="cFunc"))
+    else:
+        PI = db.prototype_index()
     R = []
-    with click.progressbar(L) as pL:
-        for l in L:
-            x = ccore.from_db(l)
-            P = [c_type(t).show() for t in x.argtypes()]
-            P.insert(0, c_type(x.restype()).show())
-            if max(reqs) >= len(P):
-                continue
-            if not all(((t == P[i]) for (i, t) in reqs.items())):
-                continue
-            R.append(x.show(db, form="C"))
+    for e in PI.select(reqs):
+        x = ccore.from_db(db.get_indexed(e))
+        R.append(x.show(db, form="C"))
     if R:
         click.echo("\n".join(R))
 
@@ -438,37 +707,22 @@ def constant(ctx, mask, symbol, val):
     from the remote database (or the local database if no remote is found) matching
     constraints on value (possibly representing a mask of several symbols) and
     symbol prefix.
+    Values are looked up in an index of all constants, which is built once
+    for the database (or for the selected documents if the select command
+    has constraints.)
     """
     value = int(val, 0)
     db = ctx.obj["db"]
     Q = ctx.obj.get("select", Query().noop())
-    Q &= (where("cls") == "cMacro") | (where("cls") == "cEnum")
-    L = db.search(db.tag & Q)
+    if Q._hash:
+        Q &= (where("cls") == "cMacro") | (where("cls") == "cEnum")
+        CI = ConstantIndex(db.search(db.tag & Q))
+    else:
+        CI = db.constant_index()
     R = []
-    with click.progressbar(L) as pL:
-        for l in pL:
-            x = ccore.from_db(l)
-            if x._is_macro:
-                if not (symbol in x.identifier):
-                    continue
-                try:
-                    v = int(x, 0)
-                except Exception:
-                    continue
-                else:
-                    if v == value:
-                        R.append(x.identifier + "\n")
-                    elif mask and (symbol in x.identifier):
-                        if v < value and v & value:
-                            R.append(x.identifier + " | ")
-            else:
-                for k, v in x.items():
-                    if v == value and (symbol in k):
-                        R.append(k + "\n")
-                        break
-                    elif mask and (symbol in k):
-                        if v < value and v & value:
-                            R.append(k + " | ")
+    for _, S in CI.select(value, mask, symbol):
+        for k, exact in S:
+            R.append(k + ("\n" if exact else " | "))
     if R:
         s = "".join(R)
         click.echo(s.strip(" |\n"))
@@ -484,8 +738,11 @@ def struct(ctx, pdef, pointer, conds):
     from the remote database (or the local database if no remote is found) matching
     constraints on total size or specific type name or size at given offset within
     the structure.
+    With a pointer size of 4 or 8, the layouts precomputed in the local
+    database by the layouts command are used rather than building structs,
+    and only structs found by intersecting their inverted index entries for
+    all constraints are verified.
     """
-    from ccrawl.ext import amoco
     reqs = {}
     try:
         for p in conds:
@@ -506,22 +763,48 @@ def struct(ctx, pdef, pointer, conds):
         return
     db = ctx.obj["db"]
     Q = ctx.obj.get("select", Query().noop())
-    L = db.search(
-        db.tag & Q & ((where("cls") == "cStruct") | (where("cls") == "cClass"))
-    )
+    Q &= (where("cls") == "cStruct") | (where("cls") == "cClass")
     R = []
     fails = []
+    LY = {}
+    if pointer in (4, 8) and not (db.rdb and not db.c.localonly):
+        LY = db.layouts()
+    if LY:
+        # only verify indexed structs that are candidates for all constraints,
+        # (and structs without a layout, or whose layout failed):
+        LI = db.layout_index(pointer, LY)
+        C = LI.candidates(
+            dict(((o, s.show() if isinstance(s, c_type) else s) for (o, s) in reqs.items()))
+        )
+        ids = set((k[0] for k in C))
+        ids.update((k[0] for k in LY if k not in LI))
+        K = lambda l: (l["id"], l["src"], l.get("tag"))
+        L = [l for l in db.search_ids(ids, Q) if (K(l) in C) or (K(l) not in LI)]
+        L += db.search(Q & ~where("id").one_of(list(set((k[0] for k in LY)))))
+    else:
+        L = db.search(Q)
     with click.progressbar(L) as pL:
         for l in pL:
             x = ccore.from_db(l)
             name = x.identifier
+            ly = LY.get((l["id"], l["src"], l.get("tag")))
             try:
                 if x._is_class:
                     x = x.as_cStruct(db)
-                ax = amoco.build(x,db)
-                t = ax()
-                F,SZ = zip(*(t.offsets(psize=pointer)))
-                xsize = t.size(psize=pointer)
+                if ly is not None:
+                    if "error" in ly:
+                        raise ValueError(ly["error"])
+                    ly = ly["ptr%d" % (pointer * 8)]
+                    F,SZ = zip(*ly["offsets"])
+                    xsize = ly["size"]
+                    P = ly["pointers"]
+                else:
+                    from ccrawl.ext import amoco
+                    ax = amoco.build(x,db)
+                    t = ax()
+                    F,SZ = zip(*(t.offsets(psize=pointer)))
+                    xsize = t.size(psize=pointer)
+                    P = [i for (i, f) in enumerate(t.fields) if f.typename=='P']
             except Exception as e:
                 fails.append("can't build %s (error: %s)" % (x.identifier,str(e)))
                 continue
@@ -541,7 +824,7 @@ def struct(ctx, pdef, pointer, conds):
                     if s == "?":
                         continue
                     if s == "*":
-                        cond = t.fields[i].typename=='P'
+                        cond = i in P
                     elif isinstance(s, c_type):
                         cond = x[i][0] == s.show()
                     else:
@@ -578,25 +861,39 @@ def struct(ctx, pdef, pointer, conds):
 @click.option(
     "-r", "--recursive", is_flag=True, help="recursively search for all types"
 )
-@click.argument("identifier", nargs=1, type=click.STRING)
+@click.option(
+    "-i", "--input", "infile", type=click.File("r"),
+    help="file with identifiers (one per line, '-' for stdin)"
+)
+@click.option("-m", "--match", type=click.STRING, help="regex on identifiers")
+@click.option("-a", "--and", "ands", type=click.STRING, multiple=True,
+              help="key=value constraint (as with select)")
+@click.argument("identifier", nargs=-1, type=click.STRING)
 @click.pass_context
-def show(ctx, form, recursive, identifier):
+def show(ctx, form, recursive, infile, match, ands, identifier):
     """Print a definition
     from the remote database (or the local database if no remote is found) in
     C/C++ (default) format or other supported format (ctypes, amoco, raw).
     If the recursive option is used, the printed definitions include all
     other types required by the topmost definition.
+    Several identifiers can be given as arguments, in a file (--input) or
+    selected by a regular expression (--match) or constraints (--and). They
+    are all printed in the same run, and with the recursive option every
+    required type is printed only once.
     """
     db = ctx.obj["db"]
+    if not (identifier or infile or match or ands):
+        raise click.UsageError("missing identifier")
+    L = find_docs(db, identifier, infile, match, ands)
     if recursive is True:
         recursive = set()
-    Q = where("id") == identifier
-    if db.contains(db.tag & Q):
-        for l in db.search(db.tag & Q):
-            x = ccore.from_db(l)
-            click.echo(x.show(db, recursive, form=form))
-    else:
-        click.secho("identifier '%s' not found" % identifier, fg="red", err=True)
+        L = list(L)
+        if db.has_closures():
+            R = [db.closure(l["id"]) for l in L]
+            db.preload([l["id"] for l in L] + [i for r in R if r for i in r["deps"]])
+    for l in L:
+        x = ccore.from_db(l)
+        click.echo(x.show(db, recursive, form=form))
 
 
 # info command:
@@ -625,20 +922,25 @@ def info(ctx, pointer, identifier):
             click.echo("source    : {}".format(l["src"]))
             click.secho("tag       : {}".format(l["tag"]), fg="magenta")
             if x._is_struct or x._is_union or x._is_class:
-                from ccrawl.ext import amoco
-                try:
-                    t = amoco.build(x, db)()
-                except (TypeError, KeyError) as e:
-                    what = e.args[0]
-                    click.secho(
-                        "can't build %s:\nmissing type: '%s'" % (x.identifier, what),
-                        fg="red",
-                        err=True,
-                    )
-                    click.echo("", err=True)
-                    continue
-                F = t.offsets(psize=pointer)
-                xsize = t.size(psize=pointer)
+                ly = db.layout(identifier, pointer, src=l["src"], tag=l.get("tag"))
+                if ly is not None:
+                    F = ly["offsets"]
+                    xsize = ly["size"]
+                else:
+                    from ccrawl.ext import amoco
+                    try:
+                        t = amoco.build(x, db)()
+                    except (TypeError, KeyError) as e:
+                        what = e.args[0]
+                        click.secho(
+                            "can't build %s:\nmissing type: '%s'" % (x.identifier, what),
+                            fg="red",
+                            err=True,
+                        )
+                        click.echo("", err=True)
+                        continue
+                    F = t.offsets(psize=pointer)
+                    xsize = t.size(psize=pointer)
                 click.secho("size      : {}".format(xsize), fg="yellow")
                 click.secho(
                     "offsets   : {}".format([(f[0], f[1]) for f in F]), fg="yellow"
@@ -661,6 +963,92 @@ def info(ctx, pointer, identifier):
         click.secho("identifier '%s' not found" % identifier, fg="red", err=True)
 
 
+# uses command:
+# ------------------------------------------------------------------------------
+
+
+@cli.command()
+@click.option("-t", "--transitive", is_flag=True, help="include indirect users")
+@click.argument("identifier", nargs=1, type=click.STRING)
+@click.pass_context
+def uses(ctx, transitive, identifier):
+    """Find definitions that use a given type.
+    Definitions of types and functions that directly depend on the type are
+    looked up in a reverse dependency index, built once for the database.
+    With the --transitive option, definitions that depend on the type
+    through other types are included.
+    """
+    db = ctx.obj["db"]
+    done = set()
+    for e in db.uses_index().select(identifier, transitive):
+        if conf.VERBOSE:
+            click.echo("%s [%s]" % (e["id"], e["src"]))
+        elif e["id"] not in done:
+            done.add(e["id"])
+            click.echo(e["id"])
+
+
+# layouts command:
+# ------------------------------------------------------------------------------
+
+
+@cli.command()
+@click.option("-f", "--force", is_flag=True, help="recompute all layouts")
+@click.pass_context
+def layouts(ctx, force):
+    """Compute the layouts of structured definitions.
+    Size, alignment and fields offsets of every struct, union or class
+    are computed for pointer sizes of 4 and 8 bytes, and stored in the
+    layouts table of the local database (or in the structs_ptr32/64
+    collections of the remote database if present.)
+    Layouts are removed from the local database whenever a struct or any
+    type it depends on is updated, and only missing layouts are computed
+    unless the --force option is used.
+    """
+    db = ctx.obj["db"]
+    if db.rdb and not db.c.localonly:
+        db.rdb.update_structs(db)
+        return
+    try:
+        R = db.update_layouts(force=force)
+    except NotImplementedError:
+        click.secho("amoco is required to compute layouts", fg="red", err=True)
+        return
+    fails = ["can't build %s (error: %s)" % (r["id"], r["error"]) for r in R if "error" in r]
+    if conf.VERBOSE:
+        click.secho("\n".join(fails), fg="red", err=True)
+    if not conf.QUIET:
+        click.echo("%d layouts updated (%d failed)" % (len(R), len(fails)))
+    db.close()
+
+
+# closures command:
+# ------------------------------------------------------------------------------
+
+
+@cli.command()
+@click.option("-f", "--force", is_flag=True, help="recompute all closures")
+@click.pass_context
+def closures(ctx, force):
+    """Compute the dependency closures of definitions.
+    The identifiers of all types that a definition depends on (directly or
+    not) are stored in topological order in the closures table of the
+    local database, so that recursive show, graph or builds of this
+    definition fetch all its dependencies with a single query.
+    Closures are removed from the local database whenever a definition or
+    any type it depends on is updated, and only missing closures are
+    computed unless the --force option is used.
+    """
+    db = ctx.obj["db"]
+    R = db.update_closures(force=force)
+    fails = ["can't unfold %s (error: %s)" % (r["id"], r["error"]) for r in R if "error" in r]
+    if conf.VERBOSE:
+        click.secho("\n".join(fails), fg="red", err=True)
+    if not conf.QUIET:
+        click.echo("%d closures updated (%d failed)" % (len(R), len(fails)))
+    db.close()
+
+
 # store command:
 # ------------------------------------------------------------------------------
 
@@ -689,9 +1077,9 @@ def store(ctx, update):
         else:
             if not conf.QUIET:
                 click.secho("ok.", fg="green")
-            if update is True:
-                db.ldb.update(l)
         Done.append(l)
+    if update is True:
+        db.update_docs(Done)
     if db.rdb:
         if not conf.QUIET:
             click.echo("remote db insert multiple ...", nl=False)
@@ -703,8 +1091,9 @@ def store(ctx, update):
         else:
             if not conf.QUIET:
                 click.secho("done.", fg="green")
+            ccore._cache_.invalidate(db)
             if not update:
-                db.ldb.remove(doc_ids=[l.doc_id for l in Done])
+                db.remove_docs(doc_ids=[l.doc_id for l in Done])
 
 
 # sync command:
@@ -756,6 +1145,7 @@ def sync(ctx, interact, printonly):
                         {"_id": r["_id"]}, {"$set": {"val": l["val"], "use": l["use"]}}
                     )
                     db.rdb.update_structs(db, {"_id": r["_id"]})
+                    ccore._cache_.invalidate(db, [l["id"]])
             elif not conf.QUIET:
                 click.secho("matching entry %s [%s]" % (l["id"], l["cls"]), fg="green")
         if isnew:
@@ -766,6 +1156,7 @@ def sync(ctx, interact, printonly):
                 doit = click.confirm("Do you want to continue?")
             if doit and not printonly:
                 db.rdb.db["nodes"].insert_one(l)
+                ccore._cache_.invalidate(db, [l["id"]])
 
 
 # fetch command:
@@ -858,6 +1249,12 @@ def stats(ctx,structs):
     click.echo("       .cMacro    : %d" % len(M))
     P = db.search(db.tag & (where("cls") == "cTemplate"))
     click.echo("       .cTemplate : %d" % len(P))
+    TC = ccore._cache_.stats()
+    click.echo("types cache:")
+    click.echo("       .size      : %d/%d" % (TC["size"], TC["maxsize"]))
+    click.echo("       .hits      : %d" % TC["hits"])
+    click.echo("       .misses    : %d" % TC["misses"])
+    click.echo("       .evictions : %d" % TC["evictions"])
     click.echo("structures:")
     l, s = max(((len(s["val"]), s["id"]) for s in S))
     click.echo("  max fields: %d (in '%s')" % (l, s))
@@ -903,6 +1300,48 @@ def server(ctx):
 
     run(ctx)
 
+# daemon command:
+# ------------------------------------------------------------------------------
+
+@cli.command()
+@click.option(
+    "-s",
+    "--socket",
+    "path",
+    type=click.Path(exists=False, file_okay=True, dir_okay=False),
+    help="path to the unix socket (defaults to Daemon.socket)",
+)
+@click.option("--status", is_flag=True, help="show the status of the running daemon")
+@click.option("--stop", is_flag=True, help="stop the running daemon")
+@click.pass_context
+def daemon(ctx, path, status, stop):
+    """Serve query commands (show, select, search, info) from a long-lived
+    process that keeps databases, their indexes and the types cache loaded.
+    Commands are forwarded to the daemon as long as its socket is the
+    configured Daemon.socket.
+    """
+    from ccrawl.srv.daemon import Daemon, connect, call
+
+    path = path or conf.config.Daemon.socket
+    if status or stop:
+        s = connect(path)
+        if s is None:
+            click.secho("no daemon listening on %s" % path, fg="red", err=True)
+            ctx.exit(1)
+        rep = call(s, {"stop": stop})
+        click.echo(
+            "daemon (pid %d) %s: %d commands served"
+            % (rep["pid"], "stopped" if stop else "running", rep["served"])
+        )
+        return
+    try:
+        d = Daemon(path, cli, ctx.obj["db"], conf.config.Daemon.databases)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    if not conf.QUIET:
+        click.echo("daemon listening on %s" % path)
+    d.serve()
+
 # export command:
 # ------------------------------------------------------------------------------
 
@@ -913,19 +1352,30 @@ def server(ctx):
               show_default=True,
               multiple=False,
               help="export to given format")
-@click.argument("identifier", nargs=1, type=click.STRING)
+@click.option(
+    "-i", "--input", "infile", type=click.File("r"),
+    help="file with identifiers (one per line, '-' for stdin)"
+)
+@click.option("-m", "--match", type=click.STRING, help="regex on identifiers")
+@click.option("-a", "--and", "ands", type=click.STRING, multiple=True,
+              help="key=value constraint (as with select)")
+@click.argument("identifier", nargs=-1, type=click.STRING)
 @click.pass_context
-def export(ctx,form,identifier):
+def export(ctx,form,infile,match,ands,identifier):
+    """Export definitions to a given format (ghidra).
+    Identifiers can be given as arguments, in a file (--input) or selected by
+    a regular expression (--match) or constraints (--and).
+    """
     db = ctx.obj["db"]
-    Q = where('id')==identifier
-    if db.contains(db.tag & Q):
-        l = db.get(db.tag & Q)
+    if not (identifier or infile or match or ands):
+        raise click.UsageError("missing identifier")
+    if form!="ghidra":
+        click.echo("format '%s' not supported."%form)
+        return
+    from ccrawl.ext.ghidra import build
+    for l in find_docs(db, identifier, infile, match, ands, first=True):
         x = ccore.from_db(l)
-        if form=="ghidra":
-            from ccrawl.ext.ghidra import build
-            build(x,db)
-        else:
-            click.echo("format '%s' not supported."%form)
+        build(x,db)
 
 # graph command:
 # ------------------------------------------------------------------------------
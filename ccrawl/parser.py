@@ -6,11 +6,21 @@ from click import echo, secho
 from clang.cindex import CursorKind, TokenKind, TranslationUnit, Index
 import clang.cindex
 import tempfile
+import shutil
+import multiprocessing
+import multiprocessing.connection
+import time
 import hashlib
+import pickle
+from types import SimpleNamespace
 from itertools import chain
 from functools import wraps
 from collections.abc import Iterable
 from collections import OrderedDict, defaultdict
+try:
+    import resource
+except ImportError:
+    resource = None
 from ccrawl import conf
 from ccrawl import graphs
 from ccrawl.core import (
@@ -27,8 +37,15 @@ from ccrawl.core import (
 
 g_indent = 0
 
+# normalized paths of the file being parsed (see SrcName):
+g_srcname = None
+
 CHandlers = {}
 
+# precompiled prelude headers (see build_prelude):
+g_prelude = {}
+g_prelude_tmp = None
+
 # ccrawl classes for clang parser:
 # ------------------------------------------------------------------------------
 
@@ -504,6 +521,13 @@ def get_uniq_typename(t):
         t = "%s %s" % (kind, t.split("::")[-1])
     x = re.compile(r"\((anonymous|unnamed) .*\)")
     s = x.search(t).group(0)
+    if g_srcname is not None:
+        # the location must not depend on the tu cache either:
+        s = re.sub(
+            r" at (.+?)(:\d+:\d+\))",
+            lambda m: " at %s%s" % (g_srcname(m.group(1)), m.group(2)),
+            s,
+        )
     h = hashlib.sha256(s.encode("ascii")).hexdigest()[:8]
     if not t.startswith(kind):
         t = "%s %s" % (kind, t)
@@ -590,15 +614,135 @@ def fix_type_conversion(f, t, cxx, errs):
     return t
 
 
+# translation units cache:
+# ------------------------------------------------------------------------------
+
+
+class CachedDiagnostic(object):
+    """
+    Picklable copy of a clang Diagnostic, restricted to the attributes
+    used by ccrawl. (Diagnostics are not serialized by TranslationUnit.save.)
+    """
+    def __init__(self, d):
+        self.severity = d.severity
+        self.spelling = d.spelling
+        self.category_number = d.category_number
+        self._format = d.format()
+        loc = d.location
+        f = SimpleNamespace(name=loc.file.name) if loc.file else None
+        self.location = SimpleNamespace(
+            file=f, line=loc.line, column=loc.column, offset=loc.offset
+        )
+
+    def format(self):
+        return self._format
+
+
+class CachedTranslationUnit(object):
+    """
+    Wrapper of a TranslationUnit loaded from an AST file, which provides
+    the diagnostics of the original parsing.
+    """
+    def __init__(self, tu, diagnostics):
+        self._tu = tu
+        self.diagnostics = diagnostics
+
+    def __getattr__(self, attr):
+        return getattr(self._tu, attr)
+
+
+def tu_parse(index, filename, args, unsaved_files=None, options=0):
+    """
+    Wrapper of index.parse that reuses translation units saved (as AST files)
+    in the Collect.tucache directory. Entries are keyed by filename, clang
+    args (except -MF), options and file contents, and are discarded if any
+    included file has been modified since the entry was saved.
+    """
+    d = conf.config.Collect.tucache
+    if (not d) or unsaved_files:
+        return index.parse(filename, args, unsaved_files, options)
+    # paths are made absolute in saved AST files, so we need to
+    # always parse the absolute filename to get the same results
+    # (see srcname for the paths recorded in documents):
+    filename = os.path.abspath(filename)
+    h = hashlib.sha256()
+    for a in chain([filename, str(options)], args):
+        if not a.startswith("-MF"):
+            h.update(a.encode("utf-8") + b"\0")
+    try:
+        with open(filename, "rb") as fd:
+            h.update(fd.read())
+    except OSError:
+        return index.parse(filename, args, unsaved_files, options)
+    k = os.path.join(d, h.hexdigest())
+    try:
+        with open(k + ".pkl", "rb") as fd:
+            info = pickle.load(fd)
+        for f, t in info["deps"].items():
+            if os.stat(f).st_mtime != t:
+                raise ValueError(f)
+        tu = TranslationUnit.from_ast_file(k + ".ast", index)
+    except Exception:
+        pass
+    else:
+        if conf.DEBUG:
+            echo("tu_parse: %s loaded from cache" % filename)
+        return CachedTranslationUnit(tu, info["diagnostics"])
+    tu = index.parse(filename, args, unsaved_files, options)
+    try:
+        os.makedirs(d, exist_ok=True)
+        deps = {}
+        for i in tu.get_includes():
+            f = i.include.name
+            deps[f] = os.stat(f).st_mtime
+        info = {
+            "deps": deps,
+            "diagnostics": [CachedDiagnostic(x) for x in tu.diagnostics],
+        }
+        tu.save(k + ".ast")
+        with open(k + ".pkl", "wb") as fd:
+            pickle.dump(info, fd)
+    except Exception:
+        if conf.VERBOSE:
+            secho("can't save %s in tu cache" % filename, fg="yellow", err=True)
+    return tu
+
+
+class SrcName(dict):
+    """
+    Maps the file names of a translation unit to the normalized paths
+    recorded as "src" of documents, so that documents don't depend on the
+    translation units cache (which parses absolute paths): paths are made
+    absolute, and if the parsed filename is relative, paths of files located
+    under the current directory are made relative to it (system headers keep
+    their absolute path.)
+    """
+    def __init__(self, filename):
+        self.relative = not os.path.isabs(filename)
+
+    def __call__(self, f):
+        if f not in self:
+            p = os.path.abspath(f)
+            if self.relative:
+                r = os.path.relpath(p)
+                if r != os.pardir and not r.startswith(os.pardir + os.sep):
+                    p = r
+            self[f] = p
+        return self[f]
+
+
 # ccrawl 'parse' function(s), wrapper of clang index.parse;
 # ------------------------------------------------------------------------------
 
 
-def parse(filename, args=None, unsaved_files=None, options=None, kind=None, tag=None):
+def parse(filename, args=None, unsaved_files=None, options=None, kind=None, tag=None, report=None):
     """
     Function that parses the input filename and returns the
     dictionary of name:object extracted from this C or C++ file.
+    If report is a list, the status and diagnostic messages of the file are
+    appended to it (see show_report) rather than printed.
     """
+    global g_srcname
     # clang parser cindex options:
     if options is None:
         # (detailed processing allows to get macros in iterated cursors)
@@ -628,6 +772,12 @@ def parse(filename, args=None, unsaved_files=None, options=None, kind=None, tag=
         if filename.endswith(".hpp") or filename.endswith(".cpp"):
             _args.extend(cxx_args)
     cxx = "c++" in _args
+    # precompiled prelude headers (see build_prelude):
+    pch = {}
+    for k, (h, pchf, files) in g_prelude.items():
+        pch[k] = (["-include-pch", pchf], files)
+    if unsaved_files:
+        pch = {}
     if not conf.config.Collect.strict:
         # in non strict mode, we allow missing includes
         fd, depf = tempfile.mkstemp(prefix="ccrawl-")
@@ -638,7 +788,7 @@ def parse(filename, args=None, unsaved_files=None, options=None, kind=None, tag=
     if unsaved_files is None:
         # unsaved files are also used to replace existing files by these if the
         # filename matches,
-        # TODO: allowing to "preload" headers like stddef.h for example...
+        # (preloading headers like stddef.h is done with build_prelude.)
         unsaved_files = []
     if kind is None:
         kind = CHandlers
@@ -651,7 +801,8 @@ def parse(filename, args=None, unsaved_files=None, options=None, kind=None, tag=
     index = Index.create()
     # call clang parser:
     try:
-        tu = index.parse(filename, _args, unsaved_files, options)
+        pre, P = pch.get("c++" if cxx else "c", ([], ()))
+        tu = tu_parse(index, filename, _args + pre, unsaved_files, options)
         for err in tu.diagnostics:
             if conf.DEBUG:
                 secho(err.format(), fg="yellow")
@@ -664,10 +815,11 @@ def parse(filename, args=None, unsaved_files=None, options=None, kind=None, tag=
                         if conf.DEBUG:
                             secho("reparse as c++ input...",fg="cyan")
                         cxx = True
-                        tu = index.parse(filename, _args + cxx_args, unsaved_files, options)
+                        pre, P = pch.get("c++", ([], ()))
+                        tu = tu_parse(index, filename, _args + cxx_args + pre, unsaved_files, options)
                         break
                     elif conf.config.Collect.skipcxx:
-                        secho("[c++]".rjust(12), fg="yellow")
+                        _status(report, "[c++]".rjust(12), fg="yellow")
                         if conf.DEBUG:
                             echo("includes:")
                             for t in tu.get_includes():
@@ -677,21 +829,32 @@ def parse(filename, args=None, unsaved_files=None, options=None, kind=None, tag=
                 # this should not happen anymore thanks to -M -MG opts...
                 # we keep it here just in case.
                 if conf.VERBOSE:
-                    secho(err.format(), bg="red", err=True)
+                    _status(report, err.format(), bg="red", err=True)
                 raise ValueError
     except Exception:
-        if not conf.QUIET:
-            secho("[err]", fg="red")
+        if not conf.QUIET or report is not None:
+            _status(report, "[err]", fg="red")
             if conf.VERBOSE:
-                secho("clang index.parse error", fg="red", err=True)
+                _status(report, "clang index.parse error", fg="red", err=True)
         return []
     else:
         if conf.VERBOSE:
-            echo(":")
+            _status(report, ":")
     if not conf.config.Collect.strict:
         os.remove(depf)
     # walk down all AST to get all top-level cursors:
     pool = [(c, []) for c in tu.cursor.get_children()]
+    # definitions from the prelude headers are collected only once:
+    if P:
+        R = {}
+        def in_prelude(c):
+            if c.location.file is None:
+                return False
+            f = c.location.file.name
+            if f not in R:
+                R[f] = os.path.realpath(f) in P
+            return R[f]
+        pool = [(c, e) for (c, e) in pool if not in_prelude(c)]
     #name = str(tu.cursor.extent.start.file.name)
     diag = {}
     for r in tu.diagnostics:
@@ -709,6 +872,7 @@ def parse(filename, args=None, unsaved_files=None, options=None, kind=None, tag=
         for l in span:
             errs.extend(diag.get(cur.location.file.name, None)[l])
     # now finally call the handlers:
+    srcname = g_srcname = SrcName(filename)
     for cur, errs in pool:
         if conf.DEBUG and cur.location.file:
             echo("-" * 80)
@@ -719,17 +883,101 @@ def parse(filename, args=None, unsaved_files=None, options=None, kind=None, tag=
             if kv:
                 ident, cobj = kv
                 if cobj:
-                    for x in cobj.to_db(ident, tag, cur.location.file.name):
+                    for x in cobj.to_db(ident, tag, srcname(cur.location.file.name)):
                         defs[x["id"]] = x
-    if not conf.QUIET:
-        secho(("[%3d]" % len(defs)).rjust(12), fg="green" if not cxx else "cyan")
+    if conf.config.Collect.preparse:
+        # store pre-parsed type strings in documents:
+        for x in defs.values():
+            T = x["val"].typeinfo()
+            if T:
+                x["types"] = T
+    if not conf.QUIET or report is not None:
+        _status(report, ("[%3d]" % len(defs)).rjust(12), fg="green" if not cxx else "cyan")
         for i in diag_get_missing(filename, tu):
-            secho("       %s"%i,fg="red")
+            _status(report, "       %s"%i, fg="red")
         for i in diag_get_incs(filename, tu):
-            secho("       %s"%i[0],fg="magenta")
+            _status(report, "       %s"%i[0], fg="magenta")
     return defs.values()
 
 
+def _status(report, message, **styles):
+    if report is None:
+        secho(message, **styles)
+    else:
+        report.append((message, styles))
+
+
+def show_report(report):
+    """
+    Prints the (message, styles) items of a report list filled by parse.
+    """
+    for message, styles in report:
+        secho(message, **styles)
+
+
+def build_prelude(args=None, kind=None, tag=None, cxx=False):
+    """
+    Creates a header that includes all Collect.prelude headers, parses it and
+    saves the resulting translation unit as a precompiled header for C (and
+    for C++ if cxx is True.) Every following call to parse will include this
+    precompiled header (and will ignore definitions found in prelude headers)
+    rather than re-parsing the prelude headers for each file.
+    The precompiled headers are stored in the Collect.tucache directory if
+    defined (or in a temporary directory otherwise, removed by clear_prelude.)
+
+    Returns the list of documents collected from the prelude headers.
+    """
+    global g_prelude_tmp
+    headers = conf.config.Collect.prelude
+    clear_prelude()
+    if not headers:
+        return []
+    if args is None:
+        args = ["-ferror-limit=0", "-fmodules", "-fbuiltin-module-map"]
+    d = conf.config.Collect.tucache
+    if not d:
+        d = g_prelude_tmp = tempfile.mkdtemp(prefix="ccrawl-")
+    os.makedirs(d, exist_ok=True)
+    src = []
+    for x in headers:
+        if os.path.isfile(x):
+            src.append('#include "%s"' % os.path.abspath(x))
+        else:
+            src.append("#include <%s>" % x)
+    src = "\n".join(src) + "\n"
+    h = os.path.join(d, "prelude-%s.h" % hashlib.sha256(src.encode("utf-8")).hexdigest()[:16])
+    with open(h, "w") as fd:
+        fd.write(src)
+    options = TranslationUnit.PARSE_INCOMPLETE
+    options |= TranslationUnit.PARSE_DETAILED_PROCESSING_RECORD
+    langs = {"c": ["-x", "c-header"]}
+    if cxx:
+        langs["c++"] = ["-x", "c++-header", "-std=c++11", "-fno-delayed-template-parsing"]
+    # collect definitions from prelude headers:
+    defs = list(parse(h, args + langs["c"], kind=kind, tag=tag))
+    index = Index.create()
+    for k, lang in langs.items():
+        tu = index.parse(h, args + lang, None, options)
+        files = set([h])
+        files.update((os.path.realpath(i.include.name) for i in tu.get_includes()))
+        pchf = "%s.%s.pch" % (h[:-2], k)
+        tu.save(pchf)
+        g_prelude[k] = (h, pchf, files)
+    return defs
+
+
+def clear_prelude():
+    """
+    Forgets the precompiled prelude headers, and removes them if they were
+    stored in a temporary directory.
+    """
+    global g_prelude_tmp
+    g_prelude.clear()
+    if g_prelude_tmp is not None:
+        shutil.rmtree(g_prelude_tmp, ignore_errors=True)
+        g_prelude_tmp = None
+
+
 def parse_string(s, args=None, options=0):
     """Crawl wrapper to parse an input string rather than file."""
     # create a tmp filename (file can be removed immediately)
@@ -739,6 +987,178 @@ def parse_string(s, args=None, options=0):
     return parse(tmph, args, [(tmph, s)], options)
 
 
+# parallel parsing of files with a pool of worker processes:
+# ------------------------------------------------------------------------------
+
+
+def init_worker(f, collect, prelude):
+    """
+    Initializer of a worker process: loads the configuration file f and
+    restores the collect parameters and prelude headers of the parent process.
+    Workers are always quiet, the parent process is in charge of the output.
+    """
+    conf.config = conf.Config(f)
+    for k, v in collect.items():
+        setattr(conf.config.Collect, k, v)
+    conf.config.Terminal.quiet = True
+    g_prelude.update(prelude)
+
+
+def parse_worker(job):
+    """
+    Parses a single file within a worker process (using its own clang Index)
+    and returns the list of documents and the report of the file's messages
+    that the parent process shall print (see show_report.)
+    """
+    filename, args, kind, tag = job
+    if kind is not None:
+        kind = [CursorKind.from_id(k) for k in kind]
+    report = []
+    return (list(parse(filename, args, kind=kind, tag=tag, report=report)), report)
+
+
+def supervised_worker(conn, f, collect, prelude, memlimit=0):
+    """
+    Main function of a supervised worker process: parses the jobs received
+    from conn and sends back the (documents, report) results (or None if
+    parsing failed) until it receives None.
+    The address space of the process is limited to memlimit MB if not 0.
+    """
+    init_worker(f, collect, prelude)
+    if memlimit > 0 and resource is not None:
+        m = memlimit << 20
+        resource.setrlimit(resource.RLIMIT_AS, (m, m))
+    while True:
+        job = conn.recv()
+        if job is None:
+            break
+        try:
+            l = parse_worker(job)
+        except Exception:
+            l = None
+        conn.send(l)
+
+
+class Supervised(object):
+    """
+    Handle of a supervised worker process, with the index and deadline
+    of the job it is currently parsing.
+    """
+
+    def __init__(self, f, collect, prelude, memlimit=0):
+        self.conn, c = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=supervised_worker, args=(c, f, collect, prelude, memlimit),
+            daemon=True
+        )
+        self.process.start()
+        c.close()
+        self.job = None
+        self.deadline = None
+
+    def send(self, i, job, timeout=0):
+        self.conn.send(job)
+        self.job = i
+        self.deadline = (time.monotonic() + timeout) if timeout > 0 else None
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(1)
+        if self.process.is_alive():
+            self.kill()
+
+
+def parse_pool(files, args=None, kind=None, tag=None, jobs=2, timeout=0, memlimit=0):
+    """
+    Generator that dispatches the parsing of all (filename, directives) items
+    of files to jobs supervised worker processes and yields the (documents,
+    report) results of parse_worker in the same order as the files.
+    A file that makes its worker crash (segfault, memory limit of memlimit MB
+    reached, etc) or takes more than timeout seconds to parse yields None
+    instead, and the worker is replaced by a new one.
+    """
+    if args is None:
+        args = []
+    if kind is not None:
+        kind = [k.value for k in kind]
+    J = [(f, args + d, kind, tag) for (f, d) in files.items()]
+    if not J:
+        return
+    C = conf.config
+    collect = C.Collect.trait_values(config=True)
+    todo = iter(enumerate(J))
+    results = {}
+    W = []
+
+    def spawn():
+        return Supervised(C.f, collect, g_prelude, memlimit)
+
+    def dispatch(w):
+        for i, job in todo:
+            w.send(i, job, timeout)
+            return
+        w.job = None
+
+    try:
+        for _ in range(min(max(jobs, 1), len(J))):
+            w = spawn()
+            W.append(w)
+            dispatch(w)
+        n = 0
+        while n < len(J):
+            while n in results:
+                yield results.pop(n)
+                n += 1
+            busy = [w for w in W if w.job is not None]
+            if not busy:
+                break
+            D = [w.deadline for w in busy if w.deadline is not None]
+            t = max(0, min(D) - time.monotonic()) if D else None
+            R = [w.conn for w in busy] + [w.process.sentinel for w in busy]
+            ready = multiprocessing.connection.wait(R, t)
+            now = time.monotonic()
+            for k, w in enumerate(W):
+                if w.job is None:
+                    continue
+                if w.conn in ready:
+                    try:
+                        results[w.job] = w.conn.recv()
+                    except (EOFError, OSError):
+                        results[w.job] = None
+                elif w.process.sentinel in ready:
+                    results[w.job] = None
+                elif w.deadline is not None and now >= w.deadline:
+                    results[w.job] = None
+                else:
+                    continue
+                if results[w.job] is None:
+                    # worker crashed or timed out:
+                    w.kill()
+                    W[k] = w = spawn()
+                dispatch(w)
+    finally:
+        for w in W:
+            w.stop()
+
+
+def worker_pool(jobs):
+    """
+    Returns a pool of jobs worker processes initialized with the current
+    configuration.
+    """
+    C = conf.config
+    collect = C.Collect.trait_values(config=True)
+    return multiprocessing.Pool(jobs, init_worker, (C.f, collect, g_prelude))
+
+
 def selected_errs(r):
     if (
         "unknown type name" in r.spelling
@@ -830,7 +1250,13 @@ def deepflatten(cur, ltypes=Iterable):
             r = chain(sub, r)
             yield c
 
-def preprocess(files,args=None):
+def preprocess(files,args=None,jobs=1):
+    """
+    Computes the include graph of all files and returns the dict of root files
+    mapped to the list of include directives needed to parse them, along with
+    the graph. With jobs>1, includes of every file are scanned concurrently by a
+    pool of processes, the graph being always built in sorted files order.
+    """
     if conf.DEBUG:
         import pprint
         echo("")
@@ -841,7 +1267,7 @@ def preprocess(files,args=None):
     M = [""]
     # create all vertices for files:
     # f is a relative path to the file from current dir
-    for f in files:
+    for f in sorted(files):
         basename = os.path.basename(f)
         # a vertex will hold the relative path, so a vertex
         # maps exactly to file,
@@ -859,9 +1285,14 @@ def preprocess(files,args=None):
         # F is just the list of files out of the 'files' set,
         # to make sure we parseincludes them in the order that was provided...
         F.append((f,v))
+    # scan includes of every file:
+    if jobs > 1:
+        with worker_pool(jobs) as P:
+            R = P.starmap(parseincludes, [(f,args) for (f,_) in F], chunksize=1)
+    else:
+        R = (parseincludes(f,args) for (f,_) in F)
     # now try to "link" them based on inclusion:
-    for (filename,v) in F:
-        missing,incs = parseincludes(filename,args)
+    for (filename,v),(missing,incs) in zip(F,R):
         for i in missing:
             bni = os.path.basename(i)
             dni = os.path.dirname(i)
@@ -912,7 +1343,77 @@ def preprocess(files,args=None):
     return (FILES,G)
 
 
+def fingerprints(files,G,args=None):
+    """
+    Returns the dict of all (root) files mapped to their "fingerprint", ie.
+    the sha256 hex digest of the given args, of the file's include directives,
+    and of the contents of the file and of all files it includes transitively
+    according to graph G (as returned by preprocess.)
+    """
+    if args is None:
+        args = []
+    V = dict(((v.data,v) for v in G.V()))
+    H = {}
+    def filehash(f):
+        if f not in H:
+            try:
+                with open(f,"rb") as fd:
+                    H[f] = hashlib.sha256(fd.read()).digest()
+            except OSError:
+                H[f] = b""
+        return H[f]
+    FP = {}
+    for f,directives in files.items():
+        deps = set()
+        pool = [V[f]]
+        while pool:
+            v = pool.pop()
+            if v.data in deps:
+                continue
+            deps.add(v.data)
+            pool.extend((e.v[1] for e in v.e_out()))
+        h = hashlib.sha256()
+        for a in chain(args,sorted(directives)):
+            h.update(a.encode("utf-8")+b"\0")
+        for d in sorted(deps):
+            h.update(d.encode("utf-8")+b"\0")
+            h.update(filehash(d))
+        FP[f] = h.hexdigest()
+    return FP
+
+
+def prelude_fingerprint(args=None):
+    """
+    Returns the fingerprint of the precompiled prelude headers, ie. the sha256
+    hex digest of the given args and of the contents of all files included by
+    the prelude headers (or "" if there is no prelude.)
+    """
+    if not g_prelude:
+        return ""
+    h = hashlib.sha256()
+    for a in args or []:
+        h.update(a.encode("utf-8")+b"\0")
+    F = set()
+    for k,(ph,pchf,files) in sorted(g_prelude.items()):
+        # (the prelude header itself may be in a temporary directory.)
+        h.update(k.encode("utf-8")+b"\0")
+        with open(ph,"rb") as fd:
+            h.update(fd.read())
+        F.update(files)
+        F.discard(ph)
+    for f in sorted(F):
+        h.update(f.encode("utf-8")+b"\0")
+        try:
+            with open(f,"rb") as fd:
+                h.update(hashlib.sha256(fd.read()).digest())
+        except OSError:
+            pass
+    return h.hexdigest()
+
+
 def diag_get_missing(filename,tu):
+    # (diagnostics refer to the parsed path, which is absolute with the tu cache.)
+    filename = tu.spelling
     missing = []
     for err in tu.diagnostics:
         if err.category_number==1:
@@ -926,10 +1427,11 @@ def diag_get_missing(filename,tu):
     return missing
 
 def diag_get_incs(filename,tu):
+    srcname = SrcName(filename)
     incs = []
     for t in tu.get_includes():
         if t.depth==1:
-            x = tu.get_extent(filename, [(t.location.line,1),(t.location.line+1,1)])
+            x = tu.get_extent(tu.spelling, [(t.location.line,1),(t.location.line+1,1)])
             toks = tu.get_tokens(extent=x)
             next(toks)
             next(toks)
@@ -937,7 +1439,7 @@ def diag_get_incs(filename,tu):
             if inc=='<':
                 while inc[-1]!='>':
                     inc += next(toks).spelling
-            incs.append((t.include.name,inc))
+            incs.append((srcname(t.include.name),inc))
     return incs
 
 def parseincludes(filename,args=None):
@@ -946,7 +1448,7 @@ def parseincludes(filename,args=None):
     if args is None:
         _args = ["-ferror-limit=0","-fmodules","-fbuiltin-module-map"]
     else:
-        _args = args
+        _args = args[:]
     if conf.config.Collect.cxx:
         cxx_args = ["-x", "c++", "-std=c++11"]
         if filename.endswith(".hpp") or filename.endswith(".cpp"):
@@ -956,7 +1458,7 @@ def parseincludes(filename,args=None):
     index = Index.create()
     if conf.DEBUG:
         echo("parseincludes(%s)..."%filename,nl="")
-    tu = index.parse(filename, _args, unsaved_files, options)
+    tu = tu_parse(index, filename, _args, unsaved_files, options)
     # get all missing includes from diagnostics:
     missing = diag_get_missing(filename,tu)
     # get all found includes:
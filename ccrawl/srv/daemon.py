@@ -0,0 +1,248 @@
+import os
+import io
+import sys
+import json
+import stat
+import socket
+import socketserver
+import traceback
+from collections import OrderedDict
+from contextlib import redirect_stdout, redirect_stderr
+
+import click
+
+from ccrawl import conf
+from ccrawl.db import Proxy
+
+"""
+The ccrawl daemon is a long-lived process that serves the query commands
+(show, select, search, info, stats and uses) of ccrawl clients over a unix socket.
+Databases opened by the daemon are kept resident with their indexes and
+layouts, as well as the ccore type cache, so that a command forwarded to the
+daemon does not reload the local database.
+
+The protocol is a single line of json per request and per response. A request
+holds the raw command line arguments ("argv"), the client's working directory
+("cwd"), terminal width ("columns"), color mode ("color") and possibly the
+content of its standard input ("stdin"). The response holds the command's
+standard output ("out"), standard error ("err") and exit code ("code").
+
+Since forwarded commands run with the daemon's privileges (and may load any
+configuration file given by the client), the socket is only accessible to its
+owner and clients only connect to a socket owned by their own user.
+"""
+
+commands = ("show", "select", "search", "info", "stats", "uses")
+
+
+def owned(path):
+    """
+    Returns True if path is a unix socket owned by the current user.
+    """
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    return stat.S_ISSOCK(st.st_mode) and st.st_uid == os.getuid()
+
+
+def connect(path):
+    """
+    Returns a socket connected to the daemon listening on the given unix
+    socket path, or None if no daemon of the current user is listening.
+    """
+    if not (path and owned(path)):
+        return None
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(path)
+    except OSError:
+        s.close()
+        return None
+    return s
+
+
+def call(s, msg):
+    """
+    Sends the msg request to the daemon connected with socket s, and returns
+    its response (or None if the daemon closed the connection.)
+    """
+    with s:
+        s.sendall(json.dumps(msg).encode() + b"\n")
+        with s.makefile("rb") as f:
+            data = f.readline()
+    return json.loads(data) if data else None
+
+
+def forward(path, argv, columns=80, color=None):
+    """
+    Forwards the ccrawl command line arguments argv to the daemon listening
+    on the given unix socket path, and returns its response, or None if no
+    daemon is listening. The standard input is sent along only if argv
+    refers to it (as in "show -i -".)
+    """
+    s = connect(path)
+    if s is None:
+        return None
+    msg = {"argv": argv, "cwd": os.getcwd(), "columns": columns, "color": color}
+    if "-" in argv:
+        msg["stdin"] = click.get_text_stream("stdin").read()
+    try:
+        return call(s, msg)
+    except (OSError, ValueError):
+        return None
+
+
+class Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        data = self.rfile.readline()
+        try:
+            msg = json.loads(data)
+        except ValueError:
+            return
+        rep = self.server.process(msg)
+        self.wfile.write(json.dumps(rep).encode() + b"\n")
+
+
+class Daemon(socketserver.UnixStreamServer):
+    """
+    Unix socket server that runs the forwarded commands with the given click
+    group (ie. ccrawl.main.cli) in its own process. Requests are served one
+    at a time.
+
+    Local databases are reopened when their file has changed since they were
+    loaded (after a collect or store command for example.) At most maxdbs
+    databases are kept resident, the least recently used being closed first.
+    """
+
+    def __init__(self, path, cli, db=None, maxdbs=8):
+        if connect(path) is not None:
+            raise RuntimeError("a daemon is already listening on %s" % path)
+        if os.path.lexists(path):
+            if not owned(path):
+                raise RuntimeError("%s is not a socket of the current user" % path)
+            os.remove(path)
+        self.path = path
+        self.cli = cli
+        self.maxdbs = max(1, maxdbs)
+        self.dbs = OrderedDict()
+        if db is not None:
+            self.dbs[_key(db.c)] = (db, _stamp(db.c.local))
+        self.served = 0
+        self.running = False
+        mask = os.umask(0o177)
+        try:
+            super().__init__(path, Handler)
+        finally:
+            os.umask(mask)
+        os.chmod(path, 0o600)
+
+    def proxy(self, config, tag=None):
+        """
+        Returns the resident Proxy associated to the Database config and tag.
+        """
+        key = _key(config)
+        stamp = _stamp(config.local)
+        db, s = self.dbs.get(key, (None, None))
+        if db is not None and s != stamp:
+            db.close()
+            db = None
+        if db is None:
+            db = Proxy(config)
+            # (opening the database may create its file.)
+            self.dbs[key] = (db, _stamp(config.local))
+            while len(self.dbs) > self.maxdbs:
+                self.dbs.popitem(last=False)[1][0].close()
+        self.dbs.move_to_end(key)
+        db.c = config
+        db.set_tag(tag)
+        return db
+
+    def process(self, msg):
+        """
+        Runs the request msg and returns the response.
+        """
+        if msg.get("stop"):
+            self.running = False
+        if "argv" not in msg:
+            return {"served": self.served, "pid": os.getpid()}
+        argv = msg["argv"]
+        out, err = io.StringIO(), io.StringIO()
+        cwd = os.getcwd()
+        columns = os.environ.get("COLUMNS")
+        stdin = sys.stdin
+        conf.VERBOSE = conf.DEBUG = conf.QUIET = False
+        try:
+            os.chdir(msg.get("cwd") or cwd)
+            os.environ["COLUMNS"] = str(msg.get("columns") or 80)
+            sys.stdin = io.StringIO(msg.get("stdin") or "")
+            with redirect_stdout(out), redirect_stderr(err):
+                code = self.run(argv, msg.get("color"))
+        finally:
+            sys.stdin = stdin
+            os.chdir(cwd)
+            if columns is None:
+                os.environ.pop("COLUMNS", None)
+            else:
+                os.environ["COLUMNS"] = columns
+        self.served += 1
+        return {"out": out.getvalue(), "err": err.getvalue(), "code": code}
+
+    def run(self, argv, color=None):
+        """
+        Invokes the forwarded command and returns its exit code.
+        """
+        code = 0
+        try:
+            r = self.cli.main(
+                argv, prog_name="ccrawl", standalone_mode=False, obj=self, color=color
+            )
+            if isinstance(r, int):
+                code = r
+        except click.ClickException as e:
+            e.show()
+            code = e.exit_code
+        except click.Abort:
+            click.echo("Aborted!", err=True)
+            code = 1
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else int(e.code is not None)
+        except Exception:
+            traceback.print_exc()
+            code = 1
+        return code
+
+    def serve(self):
+        """
+        Serves requests until a stop request is received (or interrupted.)
+        """
+        self.running = True
+        try:
+            while self.running:
+                self.handle_request()
+        finally:
+            self.server_close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            for db, _ in self.dbs.values():
+                db.close()
+            self.dbs = {}
+
+
+def _key(config):
+    local = config.local
+    if local and not local.startswith("sqlite:"):
+        local = os.path.abspath(local)
+    return (local, config.url, config.localonly, config.verify)
+
+
+def _stamp(local):
+    if local.startswith("sqlite:"):
+        local = local[7:]
+        if local.startswith("//"):
+            local = local[2:]
+    try:
+        st = os.stat(local)
+    except OSError:
+        return None
+    return (st.st_size, st.st_mtime_ns)
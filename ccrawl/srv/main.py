@@ -4,7 +4,7 @@ from flask_restful import reqparse, abort, Api, Resource
 
 from ccrawl import conf
 from ccrawl.parser import ccore, c_type
-from ccrawl.db import where, Query
+from ccrawl.db import where, Query, ConstantIndex, PrototypeIndex
 
 import re
 
@@ -54,6 +54,7 @@ class Stats(Resource):
             "cTemplate",
         ):
             D[x] = len(db.search(where("cls") == x))
+        D["typecache"] = ccore._cache_.stats()
         return D
 
 
@@ -79,8 +80,12 @@ class Search(Resource):
         rex = args["rex"]
         Q = where("id").matches(rex, flags=flg)
         Q |= where("val").matches(rex, flags=flg)
+        if db.rdb and not db.c.localonly:
+            R = db.search(Q)
+        else:
+            R = db.regex_search(db.tag & Q, rex, flg)
         L = []
-        for l in db.search(Q):
+        for l in R:
             d = {"id": l["id"], "val": l["val"]}
             if args["verbose"]:
                 for k in keys:
@@ -195,15 +200,14 @@ class Select_Prototype(Resource):
                 reqs[pos] = c_type(t).show()
         except Exception:
             return abort(400, reason="bad prototype request")
+        if Q._hash:
+            PI = PrototypeIndex(db.search(Q & (where("cls") == "cFunc")))
+        else:
+            PI = db.prototype_index()
         L = []
-        for l in db.search(Q & (where("cls") == "cFunc")):
+        for e in PI.select(reqs):
+            l = db.get_indexed(e)
             x = ccore.from_db(l)
-            P = [c_type(t).show() for t in x.argtypes()]
-            P.insert(0, c_type(x.restype()).show())
-            if max(reqs) >= len(P):
-                continue
-            if not all(((t == P[i]) for (i, t) in reqs.items())):
-                continue
             d = {"id": l["id"], "val": x.show(db, form=fmt)}
             if verbose:
                 for k in keys:
@@ -212,6 +216,31 @@ class Select_Prototype(Resource):
         return L
 
 
+class Uses(Resource):
+    def get(self):
+        return {"verbose": False, "tag": "", "transitive": False, "identifier": ""}
+
+    def post(self):
+        parser = reqparse.RequestParser()
+        parser.add_argument("verbose", type=bool)
+        parser.add_argument("tag")
+        parser.add_argument("transitive", type=bool)
+        parser.add_argument("identifier")
+        args = parser.parse_args()
+        db = g_ctx.obj["db"]
+        if args["tag"]:
+            db.set_tag(args["tag"])
+        verbose = args["verbose"]
+        L = []
+        for e in db.uses_index().select(args["identifier"], args["transitive"]):
+            d = {"id": e["id"]}
+            if verbose:
+                d["src"] = e["src"]
+                d["tag"] = e["tag"]
+            L.append(d)
+        return L
+
+
 class Select_Constant(Resource):
     def get(self):
         return {
@@ -249,38 +278,19 @@ class Select_Constant(Resource):
             abort(400, reason="invalid value")
         mask = args["mask"]
         pfx = args["prefix"] or ""
-        Q &= (where("cls") == "cMacro") | (where("cls") == "cEnum")
+        if Q._hash:
+            Q &= (where("cls") == "cMacro") | (where("cls") == "cEnum")
+            CI = ConstantIndex(db.search(Q))
+        else:
+            CI = db.constant_index()
         L = []
-        for l in db.search(Q):
-            x = ccore.from_db(l)
-            out = ""
-            if x._is_macro:
-                if pfx not in x.identifier:
-                    continue
-                try:
-                    v = int(x, 0)
-                except Exception:
-                    continue
-                else:
-                    if v == value:
-                        out = x.identifier
-                    elif mask and (pfx in x.identifier):
-                        if v < value and v & value:
-                            out = x.identifier + " | "
-            else:
-                for k, v in x.items():
-                    if v == value and (pfx in k):
-                        out = k
-                        break
-                    elif mask and (pfx in k):
-                        if v < value and v & value:
-                            out = k + " | "
-            if out:
-                d = {"val": out}
-                if verbose:
-                    for k in keys:
-                        d[k] = l[k]
-                L.append(d)
+        for l, S in CI.select(value, mask, pfx):
+            k, exact = S[-1]
+            d = {"val": k if exact else k + " | "}
+            if verbose:
+                for k in keys:
+                    d[k] = l[k]
+            L.append(d)
         return L
 
 
@@ -399,6 +409,7 @@ api.add_resource(Select, "/api/select")
 api.add_resource(Select_Prototype, "/api/select/prototype")
 api.add_resource(Select_Constant, "/api/select/constant")
 api.add_resource(Select_Struct, "/api/select/struct")
+api.add_resource(Uses, "/api/uses")
 
 
 def run(ctx):
@@ -1,3 +1,5 @@
+import re
+from functools import lru_cache
 import pyparsing as pp
 
 
@@ -93,42 +95,11 @@ class c_type(object):
     """
 
     def __init__(self, decl):
-        # get final element type:
-        bf = decl.rfind("#")
-        if bf > 0:
-            try:
-                x = bitfield.parseString(decl)
-            except Exception:
-                x, r = (pp.Group(objecttype) + pp.restOfLine).parseString(decl[:bf])
-                self.lbfw = 0
-            else:
-                r = ""
-                self.lbfw = x.pop()
-        else:
-            x, r = (pp.Group(objecttype) + pp.restOfLine).parseString(decl)
-            self.lbfw = 0
-        lbase = []
-        self.lconst = self.lunsigned = self.lvolatile = False
-        for w in x:
-            if w == "const":
-                self.lconst = True
-            elif w == "unsigned":
-                self.lunsigned = True
-            elif w == "signed":
-                pass
-            elif w == "volatile":
-                self.lvolatile = True
-            else:
-                lbase.append(w)
-        self.lbase = " ".join(lbase)
-        r = r.replace("[]", "*")
-        r = "(%s)" % r
-        try:
-            nest = nested_c.parseString(r).asList()[0]
-        except Exception as e:
-            print("c_type: error while parsing '%s'" % r)
-            raise e
-        self.pstack = pstack(nest, self.__class__)
+        # parsed declarations are memoized by parse_decl, we only need
+        # a copy of the pstack since some callers modify it:
+        D = parse_decl(self.__class__, str(decl))
+        self.__dict__.update(D)
+        self.pstack = list(D["pstack"])
 
     @property
     def is_ptr(self):
@@ -195,6 +166,179 @@ class c_type(object):
         return s + extra
 
 
+@lru_cache(maxsize=8192)
+def parse_decl(cls, decl):
+    """
+    Parses the C type string decl and returns the dict of c_type attributes
+    (lbase, lbfw, lconst, lunsigned, lvolatile and pstack as a tuple.)
+    Results are kept in a bounded LRU cache (see parse_decl.cache_info()
+    for hits/misses counters) and must not be modified.
+    """
+    if cls is c_type and decl in preparsed:
+        return decode_decl(preparsed[decl])
+    D = parse_decl_fast(decl)
+    if D is None:
+        D = parse_decl_pp(cls, decl)
+    return D
+
+
+# pre-parsed declarations (found in documents collected with the preparse
+# option) are used by parse_decl instead of parsing their string:
+preparsed = {}
+preparsed_max = 65536
+
+
+def add_preparsed(types):
+    """
+    Registers the dict of pre-parsed C declarations {decl: info} obtained
+    from a document (see encode_decl.)
+    """
+    if len(preparsed) + len(types) > preparsed_max:
+        preparsed.clear()
+    preparsed.update(types)
+
+
+def encode_decl(t):
+    """
+    Returns the compact json representation of c_type t, as a list
+    [lbase, flags, lbfw, stack] where flags has bits 1 for const, 2 for
+    unsigned and 4 for volatile, and each element of the pointers stack is
+    either ["*", p, const], ["[", a] or ["(", f, cvr].
+    """
+    flags = (t.lconst and 1) | (t.lunsigned and 2) | (t.lvolatile and 4)
+    S = []
+    for p in t.pstack:
+        if isinstance(p, ptr):
+            S.append(["*", p.p, p.const])
+        elif isinstance(p, arr):
+            S.append(["[", p.a])
+        else:
+            S.append(["(", p.f, getattr(p, "cvr", "")])
+    return [t.lbase, flags, t.lbfw, S]
+
+
+def decode_decl(info):
+    """
+    Returns the dict of c_type attributes from the compact representation
+    given by encode_decl.
+    """
+    lbase, flags, lbfw, S = info
+    P = []
+    for x in S:
+        if x[0] == "*":
+            P.append(ptr(x[1], x[2]))
+        elif x[0] == "[":
+            P.append(arr(x[1]))
+        else:
+            P.append(fargs(x[1]))
+            if x[2]:
+                P[-1].cvr = x[2]
+    return {
+        "lbfw": lbfw,
+        "lbase": lbase,
+        "lconst": bool(flags & 1),
+        "lunsigned": bool(flags & 2),
+        "lvolatile": bool(flags & 4),
+        "pstack": tuple(P),
+    }
+
+
+# fast path for the most common declarations: qualifiers, a base type and
+# an optional pointer (possibly const) and/or array indicator, like
+# "const unsigned char", "struct foo *", "char [16]" or "void **const".
+fast_decl = re.compile(
+    r"\s*(?P<pre>(?:(?:const|volatile|signed|unsigned)\s+)*)"
+    r"(?:(?P<kw>struct|union|enum|class)\s+)?"
+    r"(?P<base>long long(?![A-Za-z0-9_$:<>])|[?]?[A-Za-z_][A-Za-z0-9_$:<>]*)"
+    r"\s*(?P<ptr>\*+)?(?:\s*(?P<const>const)(?![A-Za-z0-9_$]))?"
+    r"\s*(?:\[(?P<dim>[1-9][0-9]*)\])?\s*$"
+)
+
+# base names for which the pyparsing grammar needs to be used:
+fast_decl_excl = re.compile(r"(?:const|volatile|signed|unsigned)$|struct|union|enum|class")
+
+
+def parse_decl_fast(decl):
+    """
+    Parses the C type string decl with the fast_decl regular expression and
+    returns the same dict as parse_decl_pp, or None if decl is not one of
+    the common declaration shapes (function pointers, nested declarators,
+    bitfields, etc) that this fast path supports.
+    """
+    if "#" in decl:
+        return None
+    m = fast_decl.match(decl.replace("[]", "*"))
+    if m is None or fast_decl_excl.match(m.group("base")):
+        return None
+    pre = m.group("pre").split()
+    lbase = m.group("base")
+    if m.group("kw"):
+        lbase = "%s %s" % (m.group("kw"), lbase)
+    S = []
+    if m.group("ptr"):
+        S.append(ptr(m.group("ptr"), m.group("const") or ""))
+    elif m.group("const"):
+        return None
+    if m.group("dim"):
+        S.append(arr(int(m.group("dim"))))
+    return {
+        "lbfw": 0,
+        "lbase": lbase,
+        "lconst": "const" in pre,
+        "lunsigned": "unsigned" in pre,
+        "lvolatile": "volatile" in pre,
+        "pstack": tuple(S),
+    }
+
+
+def parse_decl_pp(cls, decl):
+    """
+    Parses the C type string decl with the pyparsing grammar and returns the
+    dict of c_type attributes.
+    """
+    D = {}
+    # get final element type:
+    bf = decl.rfind("#")
+    if bf > 0:
+        try:
+            x = bitfield.parseString(decl)
+        except Exception:
+            x, r = (pp.Group(objecttype) + pp.restOfLine).parseString(decl[:bf])
+            D["lbfw"] = 0
+        else:
+            r = ""
+            D["lbfw"] = x.pop()
+    else:
+        x, r = (pp.Group(objecttype) + pp.restOfLine).parseString(decl)
+        D["lbfw"] = 0
+    lbase = []
+    lconst = lunsigned = lvolatile = False
+    for w in x:
+        if w == "const":
+            lconst = True
+        elif w == "unsigned":
+            lunsigned = True
+        elif w == "signed":
+            pass
+        elif w == "volatile":
+            lvolatile = True
+        else:
+            lbase.append(w)
+    D["lbase"] = " ".join(lbase)
+    D["lconst"] = lconst
+    D["lunsigned"] = lunsigned
+    D["lvolatile"] = lvolatile
+    r = r.replace("[]", "*")
+    r = "(%s)" % r
+    try:
+        nest = nested_c.parseString(r).asList()[0]
+    except Exception as e:
+        print("c_type: error while parsing '%s'" % r)
+        raise e
+    D["pstack"] = tuple(pstack(nest, cls))
+    return D
+
+
 # C++ type declaration parser:
 # ------------------------------------------------------------------------------
 
@@ -302,16 +446,7 @@ class fargs(object):
 
     @property
     def args(self):
-        f = nested_par.parseString(self.f)
-        A = []
-        for x in f.asList()[0]:
-            if not isinstance(x, list):
-                A.extend(x.split(","))
-            else:
-                r = A.pop()
-                r += flatten(x)
-                A.append(r)
-        return list(filter(None, A))
+        return list(split_args(self.f))
 
     def __str__(self):
         if hasattr(self, "cvr"):
@@ -319,6 +454,24 @@ class fargs(object):
         return self.f
 
 
+@lru_cache(maxsize=8192)
+def split_args(f):
+    """
+    returns the tuple of arguments of the arguments part f of a function
+    prototype (memoized.)
+    """
+    f = nested_par.parseString(f)
+    A = []
+    for x in f.asList()[0]:
+        if not isinstance(x, list):
+            A.extend(x.split(","))
+        else:
+            r = A.pop()
+            r += flatten(x)
+            A.append(r)
+    return tuple(filter(None, A))
+
+
 def pstack(plist, cls=c_type):
     """returns the 'stack' of pointers-to array-N-of pointer-to
     function() returning pointer to function() returning ..."""
@@ -34,7 +34,7 @@ setup(
         "click",
         "traitlets",
         "pyparsing",
-        "tinydb",
+        "tinydb>=4.8",
         "python-rapidjson",
         "requests",
         "pymongo",
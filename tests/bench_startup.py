@@ -0,0 +1,99 @@
+"""
+Startup benchmark of ccrawl commands.
+
+Every command is run several times, each time in a fresh python process, and
+the best and mean wall-clock times are reported along with the heavy modules
+that the command has imported.
+
+usage: python bench_startup.py [-n N] [-l local.db] [-- "command args" ...]
+
+(the default commands are "--help" and the query commands show, search,
+select, info and tags on the local database.)
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+heavy = (
+    "clang.cindex",
+    "ccrawl.parser",
+    "ccrawl.graphs",
+    "ccrawl.formatters.C",
+    "ccrawl.formatters.ctypes_",
+    "ccrawl.formatters.amoco",
+    "grandalf",
+    "requests",
+    "pymongo",
+)
+
+script = """
+import sys, json
+from ccrawl.main import cli
+try:
+    cli.main(sys.argv[1:], prog_name="ccrawl", standalone_mode=False)
+finally:
+    sys.stdout.flush()
+    sys.stderr.write("\\n" + json.dumps([m for m in %r if m in sys.modules]) + "\\n")
+""" % (heavy,)
+
+
+def run(args):
+    """
+    Runs ccrawl with given arguments in a new process and returns the
+    elapsed time and the list of heavy modules it imported.
+    """
+    env = dict(os.environ)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, (root, env.get("PYTHONPATH"))))
+    t0 = time.perf_counter()
+    p = subprocess.run(
+        [sys.executable, "-c", script] + args,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    t1 = time.perf_counter()
+    try:
+        mods = json.loads(p.stderr.strip().splitlines()[-1])
+    except (ValueError, IndexError):
+        mods = None
+    return t1 - t0, mods
+
+
+def main():
+    ap = argparse.ArgumentParser(description="ccrawl startup benchmark")
+    ap.add_argument("-n", type=int, default=5, help="runs per command")
+    ap.add_argument("-l", "--local", default="/tmp/ccrawl.db", help="local database")
+    ap.add_argument("commands", nargs="*")
+    opts = ap.parse_args()
+    commands = opts.commands or [
+        "--help",
+        "show 'struct _mystruct'",
+        "search _mystruct",
+        "select constant 0x10",
+        "info 'struct _mystruct'",
+        "tags",
+    ]
+    import shlex
+
+    for cmd in commands:
+        args = shlex.split(cmd)
+        if cmd != "--help":
+            args = ["-q", "-b", "None", "-l", opts.local] + args
+        T = []
+        for _ in range(opts.n):
+            t, mods = run(args)
+            T.append(t)
+        print(
+            "%-32s best %6.1f ms  mean %6.1f ms  heavy: %s"
+            % (cmd[:32], min(T) * 1000, sum(T) * 1000 / len(T), ", ".join(mods or []) or "-")
+        )
+
+
+if __name__ == "__main__":
+    main()
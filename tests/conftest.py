@@ -135,3 +135,5 @@ def dbfile():
     os.close(fd)
     yield fname
     os.remove(fname)
+    if os.path.exists(fname + ".trigrams"):
+        os.remove(fname + ".trigrams")
@@ -1,4 +1,5 @@
 import pytest
+import json
 from ccrawl.core import *
 from ccrawl.db import Query
 
@@ -47,3 +48,115 @@ def test_from_db_2(db_doc2):
     assert "yyyy" in x.subtypes
     y = x.subtypes["yyyy"]
     assert y._is_typedef
+
+
+def test_unfold_batched(configfile, monkeypatch):
+    from ccrawl.conf import Config
+    from ccrawl.db import Proxy
+    c = Config(configfile)
+    c.Database.local = u""
+    c.Database.url = u""
+    db = Proxy(c.Database)
+    db.insert_multiple([
+        {"cls": "cStruct", "id": "struct A", "src": "a.h",
+         "val": [["struct B", "b", ""], ["C *", "c", ""], ["int", "i", ""]]},
+        {"cls": "cStruct", "id": "struct B", "src": "a.h",
+         "val": [["D", "d", ""], ["struct A *", "a", ""]]},
+        {"cls": "cTypedef", "id": "C", "src": "a.h", "val": "struct C"},
+        {"cls": "cStruct", "id": "struct C", "src": "a.h",
+         "val": [["D", "d", ""], ["E", "e", ""]]},
+        {"cls": "cTypedef", "id": "D", "src": "a.h", "val": "unsigned int"},
+    ])
+    calls = []
+    get, fetch = db.get, db.fetch
+    db.get = lambda q: calls.append("get") or get(q)
+    db.fetch = lambda ids: calls.append(sorted(ids)) or fetch(ids)
+    def shape(x, seen):
+        if x is None or id(x) in seen:
+            return None
+        seen.add(id(x))
+        return [(k, shape(v, seen)) for k, v in x.subtypes.items()]
+    ccore._cache_.clear()
+    x = ccore.from_db(db.get(where("id") == "struct A"))
+    calls[:] = []
+    x.unfold(db)
+    assert calls == [["C", "struct B"], ["D", "struct A", "struct C"], ["E"]]
+    S = shape(x, set())
+    assert [k for k, _ in S] == ["struct B", "C"]
+    assert x.subtypes["C"].subtypes["struct C"].subtypes["E"] is None
+    # same subtypes as unbatched unfold:
+    ccore._cache_.clear()
+    x = ccore.from_db(db.get(where("id") == "struct A"))
+    monkeypatch.setattr(ccore, "prefetch", lambda self, db, limit=None: None)
+    calls[:] = []
+    x.unfold(db)
+    assert calls == ["get"] * 6
+    assert shape(x, set()) == S
+    ccore._cache_.clear()
+    db.close()
+
+
+def test_cClass_parents_uncached(configfile):
+    from ccrawl.conf import Config
+    from ccrawl.db import Proxy
+    c = Config(configfile)
+    c.Database.local = u""
+    c.Database.url = u""
+    c.Database.typecache = 0
+    db = Proxy(c.Database)
+    try:
+        db.insert_multiple([
+            {"cls": "cClass", "id": "class Base", "src": "derived.hpp",
+             "val": [[["", "int"], ["", "d"], ["PROTECTED", None]]]},
+            {"cls": "cClass", "id": "class Derived", "src": "derived.hpp",
+             "val": [[["parent", ""], ["", "class Base"], ["PUBLIC", ""]],
+                     [["using", ["class Base"]], ["", "d"], ["", ""]]]},
+            {"cls": "cClass", "id": "struct vBase", "src": "derived.hpp",
+             "val": [[["virtual", "void ()"], ["_ZN5vBase1fEv", "f"], ["PUBLIC", None]]]},
+            {"cls": "cClass", "id": "struct vDerived", "src": "derived.hpp",
+             "val": [[["parent", ""], ["", "struct vBase"], ["PRIVATE", ""]],
+                     [["virtual, override", "void ()"], ["_ZN8vDerived1fEv", "f"],
+                      ["PUBLIC", None]]]},
+        ])
+        x = ccore.from_db(db.get(where("id") == "class Derived"))
+        assert [(t, n) for (t, n, _) in x.as_cStruct(db)] == [("int", "d")]
+        x = ccore.from_db(db.get(where("id") == "struct vDerived"))
+        vptr, M, V = x.cStruct_build_info(db)
+        assert vptr == 1 and M == [] and len(ccore._cache_) == 0
+    finally:
+        db.close()
+
+
+@pytest.fixture
+def preparsed(monkeypatch):
+    # (pre-parsed types and decls decoded from them must not leak to other tests.)
+    from ccrawl import utils
+    monkeypatch.setattr(utils, "preparsed", {})
+    utils.parse_decl.cache_clear()
+    yield utils.preparsed
+    utils.parse_decl.cache_clear()
+
+
+def test_typeinfo(preparsed):
+    from ccrawl import utils
+    doc = {
+        "id": "struct S",
+        "cls": "cStruct",
+        "val": [["unsigned char *", "a", ""], ["int (*)(char, void *)", "f", ""],
+                ["myu8 [4]", "b", ""]],
+    }
+    x = ccore.from_db(doc)
+    T = x.typeinfo()
+    assert sorted(T) == sorted(t for (t, n, c) in doc["val"])
+    doc["types"] = json.loads(json.dumps(T))
+    utils.parse_decl.cache_clear()
+    ccore.from_db(doc)
+    for t, n, c in doc["val"]:
+        assert t in preparsed
+        assert c_type(t).show(n) == utils.c_type(t).show(n)
+        D = utils.decode_decl(preparsed[t])
+        P = utils.parse_decl_pp(c_type, t)
+        assert D["lbase"] == P["lbase"] and D["lunsigned"] == P["lunsigned"]
+        assert [str(p) for p in D["pstack"]] == [str(p) for p in P["pstack"]]
+    f = ccore.from_db({"id": "f", "cls": "cFunc", "val": {"prototype": "int *(char, long)"}})
+    assert f.decls() == ["int *(char, long)", "int *", "char", " long"]
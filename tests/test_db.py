@@ -22,6 +22,404 @@ def test_Proxy_tinydb(configfile, db_doc1, db_doc2):
     db.close()
 
 
+def test_Proxy_index(configfile, db_doc1, db_doc2):
+    c = Config(configfile)
+    c.Database.local = u""
+    c.Database.url = u""
+    db = Proxy(c.Database)
+    db.insert_multiple([dict(db_doc1, src="a.h", tag="0")] + db_doc2)
+    assert db.get(where("id") == "xxx")["val"] == "int"
+    I = db.index
+    assert I["count"] == 3
+    assert I["id,src"][("xxx", "a.h")] == [1]
+    db.insert_multiple([dict(db_doc1, src="b.h", tag="1", val="char")])
+    assert db.index is I and I["count"] == 4
+    assert db.get((where("id") == "xxx") & (where("src") == "b.h"))["val"] == "char"
+    db.set_tag("1")
+    assert [x["src"] for x in db.search(where("id") == "xxx")] == ["b.h"]
+    assert not db.contains(db.tag & (where("cls") == "cStruct"))
+    db.ldb.insert(dict(db_doc1, tag="1"))
+    assert len(db.search(where("id") == "xxx")) == 2
+    assert db.index["count"] == 5
+    db.close()
+
+
+def test_Proxy_sqlite(configfile, db_doc1, db_doc2, tmp_path):
+    c = Config(configfile)
+    c.Database.local = u"sqlite://" + str(tmp_path / "test.sqlite")
+    c.Database.url = u""
+    db = Proxy(c.Database)
+    assert type(db.ldb).__name__ == "SQLiteDB"
+    assert db.path == str(tmp_path / "test.sqlite")
+    assert len(list(db.ldb)) == 0
+    db.ldb.insert(db_doc1)
+    assert db.ldb.contains(where("id") == "xxx")
+    db.insert_multiple(db_doc2)
+    x = db.get(where("id") == "struct X")
+    assert x["cls"] == "cStruct"
+    assert len(db.search(where("cls") == "cTypedef")) == 2
+    db.close()
+    db = Proxy(c.Database)
+    assert len(db.ldb) == 3
+    T = TinyDB(storage=MemoryStorage)
+    T.insert_multiple(list(db.ldb))
+    for q in (
+        where("id") == "xxx",
+        (where("cls") == "cTypedef") & (where("val") == "int"),
+        (where("cls") == "cStruct") | where("val").matches("int.*"),
+        where("id").matches("STRUCT", flags=re.I),
+        where("id").search("X") & Query().noop(),
+        ~(where("id") == "xxx"),
+        where("cls").one_of(["cStruct", "cTypedef"]),
+        where("val").test(lambda v: isinstance(v, list)),
+    ):
+        assert db.ldb.search(q) == T.search(q)
+    db.ldb.remove(where("cls") == "cTypedef")
+    assert len(db.ldb) == 1
+    db.close()
+
+
+def test_Sink(configfile):
+    c = Config(configfile)
+    c.Database.local = u""
+    c.Database.url = u""
+    db = Proxy(c.Database)
+    sink = Sink(db, batch=2)
+    f1 = {"cls": "cFunc", "id": "f", "src": "a.c",
+          "val": {"prototype": "int (void)", "locs": [], "calls": []}}
+    f2 = {"cls": "cFunc", "id": "f", "src": "b.c",
+          "val": {"prototype": "int (void)", "locs": [], "calls": ["g"]}}
+    t1 = {"cls": "cTypedef", "id": "t", "src": "a.h", "val": "int"}
+    t2 = {"cls": "cTypedef", "id": "t", "src": "a.h", "val": "long"}
+    sink.add([f1, t1])
+    sink.done("a.c")
+    assert len(list(db.ldb)) == 2
+    assert sink.saved == ["a.c"]
+    sink.add([dict(f1, src="c.c"), dict(t1)])
+    sink.done("c.c")
+    assert len(list(db.ldb)) == 2
+    sink.add([f2, t2])
+    sink.done("b.c")
+    sink.flush()
+    assert len(sink) == 2
+    assert len(list(db.ldb)) == 2
+    assert db.get(where("id") == "f")["src"] == "b.c"
+    assert db.get(where("id") == "t")["val"] == "long"
+    db.close()
+
+
+@pytest.mark.parametrize("backend", ["tinydb", "sqlite"])
+def test_Sink_checkpoints(configfile, backend, tmp_path):
+    c = Config(configfile)
+    c.Database.local = str(tmp_path / "test.db")
+    if backend == "sqlite":
+        c.Database.local = u"sqlite://" + str(tmp_path / "test.sqlite")
+    c.Database.url = u""
+    db = Proxy(c.Database)
+    sink = Sink(db, batch=2)
+    flushes = []
+    flush = db.flush
+    db.flush = lambda: flushes.append(len(db.ldb)) or flush()
+    for i in range(64):
+        f = "f%d.h" % i
+        sink.add([{"cls": "cMacro", "id": "M%d" % i, "src": f, "val": "1"}])
+        sink.done(f)
+    sink.checkpoint()
+    assert len(db.ldb) == 64 and len(sink.saved) == 64
+    if backend == "sqlite":
+        assert len(flushes) == 33
+    else:
+        # the whole file is rewritten by every checkpoint:
+        assert len(flushes) == 10 and sum(flushes) < 4 * 64
+    db.close()
+
+
+@pytest.mark.parametrize("backend", ["tinydb", "sqlite"])
+def test_Proxy_layouts(configfile, backend, tmp_path):
+    c = Config(configfile)
+    c.Database.local = u""
+    if backend == "sqlite":
+        c.Database.local = u"sqlite://" + str(tmp_path / "test.sqlite")
+    c.Database.url = u""
+    db = Proxy(c.Database)
+    s = {"cls": "cStruct", "id": "struct S", "src": "a.h", "tag": "0",
+         "val": [["T", "a", None], ["char *", "p", None]]}
+    t = {"cls": "cTypedef", "id": "T", "src": "a.h", "tag": "0", "val": "int"}
+    db.insert_multiple([s, t])
+    assert db.layout("struct S", 8) is None
+    ly = {"size": 16, "align": 8, "offsets": [[0, 4], [8, 8]], "pointers": [1]}
+    db.ldb.table("layouts").insert(
+        {"id": "struct S", "src": "a.h", "tag": "0", "deps": ["T"],
+         "ptr32": dict(ly, size=8, align=4, offsets=[[0, 4], [4, 4]]), "ptr64": ly}
+    )
+    assert db.layout("struct S", 8) == ly
+    assert db.layout("struct S", 4)["size"] == 8
+    assert db.layout("struct S", 8, src="b.h") is None
+    assert db.layout("struct S", 0) is None
+    assert ("struct S", "a.h", "0") in db.layouts()
+    # unrelated documents don't invalidate the layout:
+    db.insert_multiple([{"cls": "cTypedef", "id": "U", "src": "b.h", "tag": "0", "val": "int"}])
+    assert db.layout("struct S", 8) == ly
+    db.remove_docs(doc_ids=[db.get(where("id") == "U").doc_id])
+    assert db.layout("struct S", 8) == ly
+    # removing a dependency does:
+    db.remove_docs(keys={("T", "a.h", "0")})
+    assert db.layout("struct S", 8) is None
+    db.close()
+
+
+def test_LayoutIndex():
+    ly = lambda sz, off, ptrs: {"size": sz, "align": 8, "offsets": off, "pointers": ptrs}
+    R = {
+        ("struct A", "a.h", "0"): {"types": ["int", "char *"],
+                                   "ptr64": ly(16, [[0, 4], [8, 8]], [1])},
+        ("struct B", "a.h", "0"): {"types": ["long", "long"],
+                                   "ptr64": ly(16, [[0, 8], [8, 8]], [])},
+        ("struct C", "a.h", "0"): {"error": "missing type"},
+    }
+    LI = LayoutIndex(R, 8)
+    A, B = ("struct A", "a.h", "0"), ("struct B", "a.h", "0")
+    assert A in LI and ("struct C", "a.h", "0") not in LI
+    assert LI.candidates({"*": 16}) == {A, B}
+    assert LI.candidates({"*": 16, 8: "*"}) == {A}
+    assert LI.candidates({0: 8}) == {B}
+    assert LI.candidates({0: "int", 8: "?"}) == {A}
+    assert LI.candidates({4: "?"}) == set()
+    assert LI.candidates({}) == {A, B}
+    assert LayoutIndex(R, 4).keys == set()
+
+
+def test_ConstantIndex():
+    docs = [
+        {"cls": "cMacro", "id": "M1", "src": "a.h", "val": " 0x1"},
+        {"cls": "cMacro", "id": "M4", "src": "a.h", "val": "4", "value": 4},
+        {"cls": "cMacro", "id": "MS", "src": "a.h", "val": "\"str\""},
+        {"cls": "cEnum", "id": "enum E", "src": "a.h",
+         "val": {"E2": 2, "E5": 5, "E6": 6, "EN": -1}},
+    ]
+    CI = ConstantIndex(docs)
+    assert [d["id"] for d in CI.docs] == ["M1", "M4", "enum E"]
+    R = CI.select(4)
+    assert R == [({"id": "M4", "src": "a.h", "tag": None, "doc_id": None}, [("M4", True)])]
+    assert CI.select(5, mask=True) == [
+        (CI.docs[0], [("M1", False)]),
+        (CI.docs[1], [("M4", False)]),
+        (CI.docs[2], [("E5", True)]),
+    ]
+    assert CI.select(7, mask=True, symbol="E") == [
+        (CI.docs[2], [("E2", False), ("E5", False), ("E6", False), ("EN", False)])
+    ]
+    assert CI.select(-1) == [(CI.docs[2], [("EN", True)])]
+    assert CI.select(3) == []
+
+
+@pytest.mark.parametrize("backend", ["tinydb", "sqlite"])
+def test_Proxy_constant_index(configfile, backend, tmp_path):
+    c = Config(configfile)
+    c.Database.local = u"sqlite:%s" % (tmp_path / "db.sqlite") if backend == "sqlite" else u""
+    c.Database.url = u""
+    db = Proxy(c.Database)
+    db.insert_multiple([
+        {"cls": "cMacro", "id": "M1", "src": "a.h", "val": "1"},
+        {"cls": "cMacro", "id": "M2", "src": "a.h", "val": "2"},
+    ])
+    assert [d["id"] for d, _ in db.constant_index().select(2)] == ["M2"]
+    L = db.ldb.search(where("id") == "M1")
+    L[0]["val"] = "2"
+    db.update_docs(L)
+    assert [d["id"] for d, _ in db.constant_index().select(2)] == ["M1", "M2"]
+    db.flush()
+    n = len(db.ldb)
+    db.insert_multiple([{"cls": "cMacro", "id": "M1", "src": "a.h", "val": "2"}])
+    db.flush()
+    db.cleanup_local()
+    assert len(db.ldb) == n
+    assert len(db.constant_index().select(2)) == 2
+    db.close()
+
+
+def test_PrototypeIndex():
+    docs = [
+        {"cls": "cFunc", "id": "f", "src": "a.h", "sig": ["int", "char *", "int"],
+         "val": {"prototype": "int (char *, int)"}},
+        {"cls": "cFunc", "id": "g", "src": "a.h",
+         "val": {"prototype": "int (char*)"}},
+        {"cls": "cFunc", "id": "h", "src": "a.h",
+         "val": {"prototype": "void (int, int)"}},
+    ]
+    PI = PrototypeIndex(docs)
+    ids = lambda reqs: [e["id"] for e in PI.select(reqs)]
+    assert ids({0: "int"}) == ["f", "g"]
+    assert ids({1: "char *"}) == ["f", "g"]
+    assert ids({0: "int", 2: "int"}) == ["f"]
+    assert ids({2: "int"}) == ["f", "h"]
+    assert ids({3: "int"}) == []
+    assert ids({}) == ["f", "g", "h"]
+
+
+def test_UsesIndex():
+    docs = [
+        {"cls": "cTypedef", "id": "myint", "src": "a.h", "val": "int"},
+        {"cls": "cStruct", "id": "struct A", "src": "a.h",
+         "val": [["myint", "x", ""], ["struct B *", "next", ""]]},
+        {"cls": "cStruct", "id": "struct B", "src": "b.h",
+         "val": [["struct A", "a", ""]]},
+        {"cls": "cTypedef", "id": "B_t", "src": "b.h", "val": "struct B"},
+        {"cls": "cFunc", "id": "f", "src": "b.h", "use": ["B_t"],
+         "val": {"prototype": "int (B_t)"}},
+        {"cls": "cMacro", "id": "M", "src": "b.h", "val": "1"},
+    ]
+    UI = UsesIndex(docs)
+    ids = lambda *args: [e["id"] for e in UI.select(*args)]
+    assert ids("myint") == ["struct A"]
+    assert ids("myint", True) == ["struct A", "struct B", "B_t", "f"]
+    assert ids("struct A") == ["struct B"]
+    assert ids("struct A", True) == ["struct A", "struct B", "B_t", "f"]
+    assert ids("B_t") == ["f"]
+    assert ids("f", True) == []
+    assert ids("int") == []
+
+
+@pytest.mark.parametrize("backend", ["tinydb", "json", "sqlite"])
+def test_TrigramIndex(configfile, backend, tmp_path):
+    c = Config(configfile)
+    c.Database.local = u""
+    if backend == "json":
+        c.Database.local = str(tmp_path / "test.db")
+    if backend == "sqlite":
+        c.Database.local = u"sqlite://" + str(tmp_path / "test.sqlite")
+    c.Database.url = u""
+    db = Proxy(c.Database)
+    db.insert_multiple([
+        {"cls": "cTypedef", "id": "uint32_t", "src": "a.h", "val": "unsigned int"},
+        {"cls": "cStruct", "id": "struct foo", "src": "a.h",
+         "val": [["uint32_t", "bar", None], ["char *", "name", None]]},
+        {"cls": "cMacro", "id": "FOO", "src": "a.h", "val": "0x10"},
+    ])
+    I = db.trigram_index()
+    assert I.candidates("struct") == [2]
+    assert I.candidates("(?i)foo") == [2, 3]
+    assert I.candidates("unsigned|uint32") == [1, 2]
+    assert I.candidates("xyz") == []
+    assert I.candidates("[a-z]+_t") is None
+    for rex in ("foo", "FOO", r"\['uint32_t'", "uint.*_t", "(na|ba)me", "^st", "zzz"):
+        cx = re.compile(rex)
+        q = where("id").matches(rex) | where("val").test(lambda v: cx.search(str(v)))
+        assert db.regex_search(q, rex) == db.ldb.search(q)
+    # saved index is not used while inserted documents are not flushed:
+    db.flush()
+    db.trigram_index()
+    db.insert_multiple([{"cls": "cMacro", "id": "BAR", "src": "b.h", "val": "0x20"}])
+    q = where("id").matches("BAR")
+    assert [d["id"] for d in db.regex_search(q, "BAR")] == ["BAR"]
+    db.close()
+
+
+def test_TypeCache(configfile):
+    from ccrawl.core import ccore
+    c = Config(configfile)
+    c.Database.local = u""
+    c.Database.url = u""
+    c.Database.typecache = 2
+    db = Proxy(c.Database)
+    db.insert_multiple([
+        {"cls": "cTypedef", "id": "foo_t", "src": "a.h", "tag": "a", "val": "int"},
+        {"cls": "cTypedef", "id": "foo_t", "src": "b.h", "tag": "b", "val": "char"},
+        {"cls": "cTypedef", "id": "bar_t", "src": "a.h", "tag": "a", "val": "foo_t"},
+    ])
+    TC = ccore._cache_
+    assert TC.size(db) == 2
+    c.Database.typecache = 0
+    other = Proxy(c.Database)
+    assert TC.size(db) == 2 and not TC.enabled(other)
+    other.insert_multiple([
+        {"cls": "cTypedef", "id": "bar_t", "src": "a.h", "val": "foo_t"},
+    ])
+    fetch = other.fetch
+    other.fetch = lambda *args: pytest.fail("prefetch with a disabled cache")
+    ccore.from_db(other.get(where("id") == "bar_t")).prefetch(other)
+    other.fetch = fetch
+    other.close()
+    TC.clear()
+    hits, misses = TC.hits, TC.misses
+    ccore.from_db(db.get(where("id") == "bar_t")).prefetch(db)
+    assert (TC.hits, TC.misses) == (hits, misses) and len(TC) == 1
+    TC.clear()
+    bar = db.get(where("id") == "bar_t")
+    for tag, val in (("a", "int"), ("b", "char")):
+        db.set_tag(tag)
+        assert ccore.from_db(bar).unfold(db).subtypes["foo_t"] == val
+        assert TC.get(db, "foo_t") == val
+    assert len(TC) == 2
+    db.set_tag("a")
+    hits, misses = TC.hits, TC.misses
+    ccore.from_db(bar).unfold(db)
+    assert TC.hits > hits and TC.misses == misses
+    db.insert_multiple([
+        {"cls": "cTypedef", "id": "foo_t", "src": "c.h", "tag": "c", "val": "long"},
+    ])
+    assert TC.get(db, "foo_t") is None
+    db.set_tag("b")
+    assert TC.get(db, "foo_t") is None
+    TC.put(db, "x", 1)
+    TC.put(db, "y", 2)
+    TC.put(db, "z", 3)
+    assert len(TC) == 2 and TC.get(db, "x") is None
+    assert TC.stats()["evictions"] >= 1
+    db.close()
+    assert len(TC) == 0 and TC.size(db) == TC.maxsize
+
+
+def test_Proxy_closures(configfile):
+    from ccrawl.core import ccore
+    c = Config(configfile)
+    c.Database.local = u""
+    c.Database.url = u""
+    db = Proxy(c.Database)
+    db.insert_multiple([
+        {"cls": "cStruct", "id": "struct A", "src": "a.h",
+         "val": [["struct B", "b", ""], ["C *", "c", ""]]},
+        {"cls": "cStruct", "id": "struct B", "src": "a.h",
+         "val": [["D", "d", ""], ["struct A *", "a", ""]]},
+        {"cls": "cTypedef", "id": "C", "src": "a.h", "val": "struct C"},
+        {"cls": "cStruct", "id": "struct C", "src": "a.h",
+         "val": [["D", "d", ""], ["E", "e", ""]]},
+        {"cls": "cTypedef", "id": "D", "src": "a.h", "val": "unsigned int"},
+    ])
+    assert not db.has_closures()
+    assert db.closure("struct A") is None
+    R = db.update_closures()
+    assert len(R) == 5
+    r = db.closure("struct A")
+    assert r["deps"] == ["D", "struct B", "E", "struct C", "C", "struct A"]
+    assert r["missing"] == ["E"]
+    assert db.closure("struct B")["deps"] == ["D", "E", "struct C", "C", "struct A", "struct B"]
+    assert db.closure("D")["deps"] == []
+    assert db.update_closures() == []
+    # unfolding uses a single fetch:
+    calls = []
+    fetch = db.fetch
+    db.fetch = lambda ids: calls.append(sorted(ids)) or fetch(ids)
+    ccore._cache_.clear()
+    x = ccore.from_db(db.get(where("id") == "struct A")).unfold(db)
+    assert calls == [["C", "D", "E", "struct A", "struct B", "struct C"]]
+    assert list(x.subtypes) == ["struct B", "C"]
+    # preloaded documents answer queries:
+    db.preload(r["deps"])
+    assert db.get(where("id") == "struct C")["src"] == "a.h"
+    assert db.search(where("id") == "E") == []
+    # closures depending on a new type are removed:
+    db.insert_multiple([{"cls": "cTypedef", "id": "E", "src": "b.h", "val": "char"}])
+    assert db.preloaded == {}
+    assert db.closure("struct A") is None
+    assert db.closure("D") is not None
+    R = db.update_closures()
+    assert sorted(r["id"] for r in R) == ["C", "E", "struct A", "struct B", "struct C"]
+    assert db.closure("struct A")["missing"] == []
+    ccore._cache_.clear()
+    db.close()
+
+
 def test_Proxy_mongodb(configfile, db_doc2):
     c = Config(configfile)
     c.Database.local = u""
@@ -76,6 +76,21 @@ def test_04_cmd_show(configfile, dbfile):
     assert l[0] == "struct xt_string_info {"
     assert l[3] == "  int (*pfunc)(myu8, int);"
 
+
+def test_04_cmd_show_batch(configfile, dbfile):
+    runner = CliRunner(mix_stderr=False)
+    result = runner.invoke(
+        cli,
+        ["-l", dbfile, "-b", "None", "-c", configfile, "show", "-r", "-i", "-",
+         "struct grA", "-m", ".*gr[BG]$"],
+        input="struct grB\nstruct nope\n",
+    )
+    assert result.exit_code == 0
+    assert "identifier 'struct nope' not found" in result.stderr
+    l = result.stdout.split("\n")
+    for s in ("struct grA {", "struct grB {", "struct grG {"):
+        assert l.count(s) == 1
+
 def test_05_cmd_graph(configfile, dbfile):
     runner = CliRunner()
     result = runner.invoke(
@@ -98,3 +113,296 @@ def test_05_cmd_graph(configfile, dbfile):
     assert l[2] == "//graph has a strongly connected component of size 4"
     assert l[3] == "digraph {"
     assert l[6] == '  v0 [label="struct grG"  shape="box"]'
+
+def test_06_cmd_collect_incremental(configfile, tmp_path):
+    import shutil
+    src = str(tmp_path / "src")
+    shutil.copytree(os.path.join(os.path.dirname(__file__), "samples/xxx"), src)
+    dbfile = str(tmp_path / "incr.db")
+    cmd = ["-l", dbfile, "-b", "None", "-c", configfile, "-g", "incr",
+           "collect", "-i", src]
+    runner = CliRunner()
+    result = runner.invoke(cli, cmd)
+    assert result.exit_code == 0
+    db = Proxy(conf.config.Database)
+    N = len(db.ldb)
+    FP = db.fingerprints()
+    db.close()
+    assert len(FP) > 0
+    result = runner.invoke(cli, cmd)
+    assert result.exit_code == 0
+    db = Proxy(conf.config.Database)
+    assert len(db.ldb) == N
+    assert db.fingerprints() == FP
+    db.close()
+    # update one file:
+    f = sorted(FP)[0]
+    with open(f, "a") as fd:
+        fd.write("\n#define CCRAWL_INCR 1\n")
+    result = runner.invoke(cli, cmd)
+    assert result.exit_code == 0
+    db = Proxy(conf.config.Database)
+    assert len(db.ldb) == N + 1
+    assert db.get(where("id") == "CCRAWL_INCR")["src"] == f
+    db.close()
+    # remove it:
+    os.remove(f)
+    result = runner.invoke(cli, cmd)
+    assert result.exit_code == 0
+    db = Proxy(conf.config.Database)
+    assert not db.contains(where("src") == f)
+    assert f not in db.fingerprints()
+    db.close()
+
+
+def test_07_cmd_collect_resume(configfile, tmp_path, monkeypatch):
+    import ccrawl.parser
+    cfg = str(tmp_path / "resume.conf")
+    with open(configfile) as fd, open(cfg, "w") as out:
+        out.write(fd.read() + "c.Collect.batch = 1\n")
+    src = os.path.join(os.path.dirname(__file__), "samples")
+    dbfile = str(tmp_path / "resume.db")
+    cmd = ["-l", dbfile, "-b", "None", "-c", cfg, "-g", "resume", "collect", src]
+    runner = CliRunner()
+    result = runner.invoke(cli, cmd)
+    assert result.exit_code == 0
+    assert not os.path.exists(dbfile + ".journal")
+    db = Proxy(conf.config.Database)
+    D = sorted((x["id"], x["src"]) for x in db.ldb)
+    db.close()
+    os.remove(dbfile)
+    # interrupt the collect after some files:
+    _parse = ccrawl.parser.parse
+    count = []
+    def parse(*args, **kargs):
+        count.append(args[0])
+        if len(count) > 5 and len(count) < 10:
+            raise KeyboardInterrupt
+        return _parse(*args, **kargs)
+    monkeypatch.setattr(ccrawl.parser, "parse", parse)
+    result = runner.invoke(cli, cmd)
+    assert result.exit_code != 0
+    with open(dbfile + ".journal") as fd:
+        assert len(fd.readlines()) == 6
+    done = set(count[:5])
+    count[:] = [None] * 10
+    result = runner.invoke(cli, cmd + ["--resume"])
+    assert result.exit_code == 0
+    assert len(count) > 10 and done.isdisjoint(count[10:])
+    assert not os.path.exists(dbfile + ".journal")
+    db = Proxy(conf.config.Database)
+    assert sorted((x["id"], x["src"]) for x in db.ldb) == D
+    db.close()
+
+
+def test_08_lazy_imports(configfile, dbfile):
+    import sys, subprocess
+    script = (
+        "import sys\n"
+        "from ccrawl.main import cli\n"
+        "cli.main(sys.argv[1:], standalone_mode=False)\n"
+        "print([m for m in ('clang.cindex', 'ccrawl.parser', 'requests',"
+        " 'ccrawl.formatters.amoco') if m in sys.modules])\n"
+    )
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    out = subprocess.check_output(
+        [sys.executable, "-c", script, "-l", dbfile, "-b", "None", "-c", configfile,
+         "show", "struct xt_string_info"],
+        env=env, universal_newlines=True,
+    )
+    assert out.strip().split("\n")[-1] == "[]"
+
+
+def test_09_cmd_daemon(configfile, dbfile, tmp_path):
+    import sys, time, subprocess
+    sock = str(tmp_path / "ccrawl.sock")
+    cfg = str(tmp_path / "daemon.conf")
+    with open(configfile) as fd, open(cfg, "w") as out:
+        out.write(fd.read() + "\nc.Daemon.socket = %r\n" % sock)
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    opts = ["-l", dbfile, "-b", "None", "-c", cfg]
+    runner = CliRunner()
+    local = runner.invoke(cli, opts + ["show", "-f", "C", "struct xt_string_info"])
+    p = subprocess.Popen(
+        [sys.executable, "-c", "from ccrawl.main import cli; cli()"] + opts + ["daemon"],
+        env=env, stdout=subprocess.DEVNULL,
+    )
+    try:
+        for _ in range(100):
+            if os.path.exists(sock):
+                break
+            time.sleep(0.1)
+        assert os.stat(sock).st_mode & 0o777 == 0o600
+        result = runner.invoke(cli, opts + ["show", "-f", "C", "struct xt_string_info"])
+        assert result.exit_code == 0
+        assert result.output == local.output
+        result = runner.invoke(cli, opts + ["show", "-i", "-"], input="struct grA\n")
+        assert result.exit_code == 0
+        assert result.output.startswith("struct grA {")
+        result = runner.invoke(cli, opts + ["daemon", "--stop"])
+        assert result.exit_code == 0
+        assert "stopped: 2 commands served" in result.output
+        p.wait(10)
+    finally:
+        if p.poll() is None:
+            p.kill()
+    assert not os.path.exists(sock)
+
+
+def test_10_daemon_databases(configfile, tmp_path):
+    from ccrawl.srv.daemon import Daemon
+    sock = str(tmp_path / "ccrawl.sock")
+    d = Daemon(sock, cli, maxdbs=2)
+    try:
+        c = conf.Config(configfile)
+        c.Database.url = u""
+        P = []
+        for i in range(3):
+            c.Database.local = str(tmp_path / ("%d.db" % i))
+            P.append(d.proxy(c.Database))
+        assert len(d.dbs) == 2 and P[0] not in [x for (x, _) in d.dbs.values()]
+        c.Database.local = str(tmp_path / "1.db")
+        assert d.proxy(c.Database) is P[1]
+    finally:
+        d.server_close()
+    # refuse to replace a file that is not a socket:
+    with pytest.raises(RuntimeError):
+        Daemon(str(tmp_path / "0.db"), cli)
+
+
+def test_11_cmd_collect_prelude(configfile, tmp_path):
+    pre = tmp_path / "pre"
+    src = tmp_path / "src"
+    pre.mkdir()
+    src.mkdir()
+    (pre / "p.h").write_text("#define N 4\ntypedef int myint;\n")
+    (src / "user.h").write_text("struct s { myint a[N]; };\n")
+    cfg = str(tmp_path / "prelude.conf")
+    with open(configfile) as fd, open(cfg, "w") as out:
+        out.write(fd.read() + "c.Collect.prelude = [%r]\n" % str(pre / "p.h"))
+    dbfile = str(tmp_path / "prelude.db")
+    cmd = ["-l", dbfile, "-b", "None", "-c", cfg, "-g", "pre", "collect", "-i", str(src)]
+    runner = CliRunner()
+    def state():
+        db = Proxy(conf.config.Database)
+        s = db.get(where("id") == "struct s")["val"]
+        FP = db.fingerprints()
+        N = len(db.ldb)
+        db.close()
+        return s, FP, N
+    assert runner.invoke(cli, cmd).exit_code == 0
+    s, FP, N = state()
+    assert s == [["myint[4]", "a", None]]
+    hp = [f for f in FP if f.startswith("prelude-")]
+    assert len(hp) == 1 and FP[hp[0]]["hash"]
+    assert runner.invoke(cli, cmd).exit_code == 0
+    assert state() == (s, FP, N)
+    # editing a prelude header updates documents:
+    (pre / "p.h").write_text("#define N 8\ntypedef int myint;\n")
+    assert runner.invoke(cli, cmd).exit_code == 0
+    s, FP2, N2 = state()
+    assert s == [["myint[8]", "a", None]] and N2 == N
+    assert FP2[hp[0]]["hash"] != FP[hp[0]]["hash"]
+
+
+def test_12_cmd_info_layouts(configfile, tmp_path, monkeypatch):
+    import sys
+    monkeypatch.delitem(sys.modules, "ccrawl.ext.amoco", raising=False)
+    c = conf.Config(configfile)
+    c.Database.local = str(tmp_path / "ly.db")
+    c.Database.url = u""
+    db = Proxy(c.Database)
+    db.insert_multiple([{"cls": "cStruct", "id": "struct S", "src": "a.h", "tag": "0",
+                         "val": [["int", "a", None], ["char *", "p", None]]},
+                        {"cls": "cStruct", "id": "struct T", "src": "a.h", "tag": "0",
+                         "val": [["int", "a", None]]}])
+    ly = {"size": 16, "align": 8, "offsets": [[0, 4], [8, 8]], "pointers": [1]}
+    lt = {"size": 4, "align": 4, "offsets": [[0, 4]], "pointers": []}
+    db.ldb.table("layouts").insert_multiple([
+        {"id": "struct S", "src": "a.h", "tag": "0", "deps": [], "ptr64": ly,
+         "ptr32": dict(ly, size=8, align=4, offsets=[[0, 4], [4, 4]])},
+        {"id": "struct T", "src": "a.h", "tag": "0", "deps": [], "ptr64": lt, "ptr32": lt},
+    ])
+    db.close()
+    opts = ["-l", c.Database.local, "-b", "None", "-c", configfile]
+    runner = CliRunner()
+    result = runner.invoke(cli, opts + ["info", "-p", "8", "struct S"])
+    assert result.exit_code == 0
+    assert "size      : 16" in result.output
+    calls = []
+    layouts, search_ids = Proxy.layouts, Proxy.search_ids
+    def spy_layouts(self):
+        calls.append("layouts")
+        return layouts(self)
+    def spy_search_ids(self, ids, q=None):
+        calls.append(sorted(ids))
+        return search_ids(self, ids, q)
+    monkeypatch.setattr(Proxy, "layouts", spy_layouts)
+    monkeypatch.setattr(Proxy, "search_ids", spy_search_ids)
+    result = runner.invoke(cli, opts + ["select", "struct", "-p", "8", "*:16"])
+    assert result.exit_code == 0
+    assert "struct S" in result.output and "struct T" not in result.output
+    assert calls == ["layouts", ["struct S"]]
+    assert "ccrawl.ext.amoco" not in sys.modules
+
+
+def test_13_cmd_collect_tucache(configfile, tmp_path, monkeypatch):
+    import json
+    monkeypatch.chdir(os.path.dirname(__file__))
+    runner = CliRunner()
+    def docs(*opts):
+        dbfile = str(tmp_path / "tu.db")
+        cmd = ["-l", dbfile, "-b", "None", "-c", configfile, "-g", "tu", "collect"]
+        result = runner.invoke(cli, cmd + list(opts) + ["samples"])
+        assert result.exit_code == 0
+        db = Proxy(conf.config.Database)
+        D = sorted((x["id"], x["src"], json.dumps(x["val"], sort_keys=True)) for x in db.ldb)
+        db.close()
+        os.remove(dbfile)
+        return D
+    tucache = str(tmp_path / "tucache")
+    D = docs()
+    assert ("struct _mystruct", "samples/header.h") in [d[:2] for d in D]
+    assert docs("--tu-cache", tucache) == D
+    # (translation units are now loaded from the cache:)
+    assert docs("--tu-cache", tucache) == D
+
+
+def test_14_cmd_collect_then_incremental(configfile, tmp_path):
+    src = os.path.join(os.path.dirname(__file__), "samples/xxx")
+    dbfile = str(tmp_path / "first.db")
+    cmd = ["-l", dbfile, "-b", "None", "-c", configfile, "-g", "first", "collect"]
+    runner = CliRunner()
+    assert runner.invoke(cli, cmd + [src]).exit_code == 0
+    db = Proxy(conf.config.Database)
+    N = len(db.ldb)
+    db.close()
+    for _ in range(2):
+        assert runner.invoke(cli, cmd + ["-i", src]).exit_code == 0
+        db = Proxy(conf.config.Database)
+        assert len(db.ldb) == N
+        assert len(db.fingerprints()) > 0
+        db.close()
+
+
+def test_15_cmd_collect_jobs_output(tmp_path, monkeypatch):
+    monkeypatch.chdir(os.path.dirname(__file__))
+    monkeypatch.setattr(conf, "QUIET", False)
+    rc = tmp_path / "ccrawlrc"
+    rc.write_text(u"c.Terminal.quiet = False\nc.Terminal.timer = False\n"
+                  u"c.Collect.strict = False\nc.Collect.cxx = True\n")
+    runner = CliRunner()
+    def output(*opts):
+        dbfile = str(tmp_path / "jobs.db")
+        cmd = ["-l", dbfile, "-b", "None", "-c", str(rc), "-g", "jobs", "collect"]
+        cmd += list(opts) + ["samples/auto.h", "samples/classes.hpp"]
+        result = runner.invoke(cli, cmd, color=True)
+        assert result.exit_code == 0
+        os.remove(dbfile)
+        return result.output[result.output.index("preprocessing files"):]
+    out = output()
+    assert "\x1b[36m       [ 13]" in out
+    assert output("-j", "2") == out
+    assert output("--timeout", "60") == out
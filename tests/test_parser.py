@@ -45,6 +45,7 @@ def test_parser_c(configfile, c_header):
     assert defs[0]["id"] == "MYCONST"
     assert defs[0]["tag"] == "test"
     assert defs[0]["val"] == " 0x10"
+    assert defs[0]["value"] == 0x10
     x = ccore.from_db(defs[5])
     assert x._is_typedef
     assert str(x) == "int (*)(int, char, unsigned int, void *)"
@@ -67,3 +68,112 @@ def test_parser_cxx(configfile, cxx_myclass):
         ("_ZN7MyClassC1Ei", "MyClass"),
         ("PUBLIC", None),
     )
+
+
+def test_parse_pool(configfile, c_header):
+    c = conf.Config(configfile)
+    c.Terminal.quiet = True
+    c.Terminal.timer = False
+    c.Collect.strict = False
+    c.Collect.cxx = False
+    conf.config = c
+    files = {c_header: []}
+    defs = list(parse(c_header, tag="test"))
+    L = list(parse_pool(files, tag="test", jobs=2))
+    assert len(L) == 1
+    docs, report = L[0]
+    assert [x["id"] for x in docs] == [x["id"] for x in defs]
+    assert [x["val"] for x in docs] == [x["val"] for x in defs]
+    assert report[0] == (("[%3d]" % len(defs)).rjust(12), {"fg": "green"})
+
+
+def test_parse_pool_supervised(configfile, c_header, monkeypatch):
+    import ccrawl.parser
+    c = conf.Config(configfile)
+    c.Terminal.quiet = True
+    c.Collect.strict = False
+    c.Collect.cxx = False
+    conf.config = c
+    _parse_worker = ccrawl.parser.parse_worker
+    def parse_worker(job):
+        if job[0] == "crash":
+            os._exit(1)
+        if job[0] == "hang":
+            time.sleep(60)
+        return _parse_worker(job)
+    monkeypatch.setattr(ccrawl.parser, "parse_worker", parse_worker)
+    files = {"crash": [], "hang": [], c_header: []}
+    t0 = time.time()
+    L = list(parse_pool(files, tag="test", jobs=2, timeout=2))
+    assert time.time() - t0 < 30
+    assert L[0] is None and L[1] is None
+    assert len(L) == 3 and len(L[2][0]) > 0
+
+
+def test_preprocess_pool(configfile, c_headers):
+    c = conf.Config(configfile)
+    c.Terminal.quiet = True
+    c.Collect.strict = False
+    c.Collect.cxx = False
+    conf.config = c
+    args = ["-ferror-limit=0", "-fmodules", "-fbuiltin-module-map"]
+    F1, G1 = preprocess(set(c_headers), args)
+    F2, G2 = preprocess(set(c_headers), args, jobs=2)
+    assert list(F1.keys()) == list(F2.keys())
+    assert [sorted(v) for v in F1.values()] == [sorted(v) for v in F2.values()]
+    E1 = [(e.v[0].data, e.v[1].data, e.data) for e in G1.E()]
+    E2 = [(e.v[0].data, e.v[1].data, e.data) for e in G2.E()]
+    assert sorted(E1) == sorted(E2)
+
+
+def test_parse_tucache(configfile, c_header, tmp_path):
+    c = conf.Config(configfile)
+    c.Terminal.quiet = True
+    c.Collect.strict = False
+    c.Collect.cxx = False
+    c.Collect.tucache = str(tmp_path)
+    conf.config = c
+    defs1 = list(parse(c_header, tag="test"))
+    assert len(list(tmp_path.glob("*.ast"))) == 1
+    defs2 = list(parse(c_header, tag="test"))
+    assert defs1 == defs2
+    assert defs2[0]["src"] == os.path.abspath(c_header)
+    # sources are the same with or without the cache:
+    rel = os.path.relpath(c_header)
+    c.Collect.tucache = ""
+    defs3 = list(parse(rel, tag="test"))
+    c.Collect.tucache = str(tmp_path)
+    defs4 = list(parse(rel, tag="test"))
+    assert defs3 == defs4
+    assert defs4[0]["src"] == rel
+
+
+def test_SrcName(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    S = SrcName("a.h")
+    assert S("a.h") == "a.h"
+    assert S(str(tmp_path / "b" / ".." / "c.h")) == "c.h"
+    assert S("/usr/include/stdio.h") == "/usr/include/stdio.h"
+    assert S("../x.h") == os.path.abspath("../x.h")
+    S = SrcName(str(tmp_path / "a.h"))
+    assert S("c.h") == str(tmp_path / "c.h")
+
+
+def test_parse_prelude(configfile, tmp_path):
+    c = conf.Config(configfile)
+    c.Terminal.quiet = True
+    c.Collect.strict = False
+    c.Collect.cxx = False
+    c.Collect.prelude = [os.path.join(os.path.dirname(__file__), "samples/xxx/yyy/somewhere.h")]
+    conf.config = c
+    src = tmp_path / "user.h"
+    src.write_text("struct user { myu8 a[C1]; };\n")
+    defs = build_prelude(tag="test")
+    assert "struct xt_string_info" in [d["id"] for d in defs]
+    defs = list(parse(str(src), tag="test"))
+    d = os.path.dirname(g_prelude["c"][0])
+    c.Collect.prelude = []
+    build_prelude()
+    assert not g_prelude and not os.path.exists(d)
+    assert [d["id"] for d in defs] == ["struct user"]
+    assert defs[0]["val"] == [("myu8[10]", "a", None)]
@@ -152,3 +152,58 @@ def test_cxx_type_16():
     t = cxx_type("struct A::B::C::D")
     assert t.ns == "A::B::C::"
     assert t.show_base() == "D"
+
+
+def test_c_type_cache():
+    parse_decl.cache_clear()
+    t = c_type("int (*)(char *, int)")
+    assert parse_decl.cache_info().misses == 1
+    t.pstack.pop()
+    t.lbase = "char"
+    t2 = c_type("int (*)(char *, int)")
+    assert parse_decl.cache_info().hits == 1
+    assert t2.lbase == "int"
+    assert len(t2.pstack) == 2
+    assert t2.pstack[0].args == ["char *", " int"]
+    c = cxx_type("int (*)(char *, int)")
+    assert parse_decl.cache_info().misses == 2
+    assert c.show() == t2.show()
+
+
+def test_c_type_fast(configfile):
+    import os
+    from ccrawl import conf
+    from ccrawl.parser import parse
+    def leaves(x):
+        if isinstance(x, str):
+            yield str(x)
+        elif isinstance(x, dict):
+            for v in x.values():
+                yield from leaves(v)
+        elif isinstance(x, (list, tuple)):
+            for v in x:
+                yield from leaves(v)
+    def dump(D):
+        D = dict(D)
+        D["pstack"] = [(type(p), vars(p)) for p in D["pstack"]]
+        return D
+    c = conf.Config(configfile)
+    c.Terminal.quiet = True
+    conf.config = c
+    decls = {"unsigned long long", "long long int", "char [2][3]", "char *const *",
+             "char [0]", "char *[]", "structure_t *", "classic", "signed char",
+             "const volatile struct foo **", "?_abc * const", "std::vector<int> *"}
+    samples = os.path.join(os.path.dirname(__file__), "samples")
+    for R, D, F in os.walk(samples):
+        for f in F:
+            if f.endswith((".h", ".hpp", ".c", ".cpp")):
+                for x in parse(os.path.join(R, f), tag="test"):
+                    decls.update(leaves(x["val"]))
+    n = 0
+    for d in decls:
+        D = parse_decl_fast(d)
+        if D is not None:
+            n += 1
+            for cls in (c_type, cxx_type):
+                assert dump(D) == dump(parse_decl_pp(cls, d)), d
+    assert n > 100